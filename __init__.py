@@ -5,10 +5,15 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+from address_cache import USPSAddressCache
+from address_queue import USPSAddressQueue
 from carrier import CarrierConfig
 from configuration import USPSConfiguration
+from country import Subdivision
 from trytond.pool import Pool
 from party import Address
+from revalidation import USPSAddressRevalidation
+from zip_cache import USPSZipCache
 
 
 def register():
@@ -16,5 +21,10 @@ def register():
         Address,
         CarrierConfig,
         USPSConfiguration,
+        USPSZipCache,
+        USPSAddressCache,
+        USPSAddressRevalidation,
+        USPSAddressQueue,
+        Subdivision,
         module='shipping_usps', type_='model'
     )
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+    address_cache.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import datetime, timedelta
+
+from trytond.model import fields, ModelSQL, ModelView
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from usps.exceptions import USPSInvalidAddress
+
+__all__ = ['USPSAddressCache']
+
+
+class USPSAddressCache(ModelSQL, ModelView):
+    """
+    Address validation results of USPS by canonical address key, shared by
+    all the processes
+    """
+    __name__ = 'usps.address.cache'
+    _rec_name = 'key'
+
+    key = fields.Char('Key', required=True, select=True, readonly=True)
+    address1 = fields.Char('Address 1', readonly=True)
+    address2 = fields.Char('Address 2', readonly=True)
+    city = fields.Char('City', readonly=True)
+    state = fields.Char('State', readonly=True)
+    zip5 = fields.Char('ZIP5', readonly=True)
+    zip4 = fields.Char('ZIP4', readonly=True)
+    subdivision = fields.Many2One(
+        'country.subdivision', 'Subdivision', readonly=True
+    )
+    error = fields.Char('Error', readonly=True)
+    fetched_at = fields.DateTime('Fetched At', required=True, readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(USPSAddressCache, cls).__setup__()
+        cls._order.insert(0, ('fetched_at', 'DESC'))
+
+    @classmethod
+    def get_fresh_many(cls, keys, stale=False, config=None):
+        """
+        Returns a dictionary of the cached validations by key for the given
+        canonical address keys, omitting the ones older than the validity set
+        in the USPS configuration.
+
+        :param stale: Return also the validations older than the validity
+        :param config: Active record of the USPS configuration, read if not
+                       given
+        """
+        USPSConfiguration = Pool().get('usps.configuration')
+        cursor = Transaction().cursor
+
+        validity = (config or USPSConfiguration(1)).address_cache_validity
+        keys = list(keys)
+        validations = {}
+        for offset in xrange(0, len(keys), cursor.IN_MAX):
+            domain = [('key', 'in', keys[offset:offset + cursor.IN_MAX])]
+            if validity and not stale:
+                domain.append(
+                    ('fetched_at', '>=', datetime.now() - timedelta(validity))
+                )
+            # Oldest first, so that the latest validation of a key is kept
+            for record in cls.search(domain, order=[('fetched_at', 'ASC')]):
+                validations[record.key] = record
+        return validations
+
+    @classmethod
+    def store(cls, key, result):
+        """
+        Caches the result of an address validation and returns the record.
+
+        :param key: The canonical key of the address validated
+        :param result: The :class:`usps.results.AddressResult` of the
+            validation or the :exception:`USPSInvalidAddress` of its error
+        """
+        Subdivision = Pool().get('country.subdivision')
+
+        values = {
+            'fetched_at': datetime.now(),
+        }
+        if isinstance(result, USPSInvalidAddress):
+            values.update(dict.fromkeys([
+                'address1', 'address2', 'city', 'state', 'zip5', 'zip4',
+                'subdivision',
+            ]))
+            values['error'] = unicode(result[0])
+        else:
+            values.update({
+                'address1': result.Address1 or None,
+                'address2': result.Address2 or None,
+                'city': result.City,
+                'state': result.State,
+                'zip5': result.Zip5,
+                'zip4': result.Zip4 or None,
+                'subdivision': Subdivision.get_usps_subdivision(result.State),
+                'error': None,
+            })
+
+        records = cls.search([('key', '=', key)])
+        if records:
+            cls.write(records, values)
+            return records[0]
+        values['key'] = key
+        record, = cls.create([values])
+        return record
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+    address_queue.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import datetime
+
+from party import COMPARED_FIELDS
+from trytond.model import fields, ModelSQL, ModelView
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from usps.address_validation import AddressValidation
+
+__all__ = ['USPSAddressQueue']
+
+
+class USPSAddressQueue(ModelSQL, ModelView):
+    """
+    Addresses created or modified in deferred validation mode, validated
+    with USPS in the background by the scheduler
+    """
+    __name__ = 'usps.address.queue'
+    _rec_name = 'address'
+
+    #: Number of addresses validated and committed together, the number of
+    #: addresses USPS validates per request
+    batch_size = AddressValidation.max_batch_size
+
+    address = fields.Many2One(
+        'party.address', 'Address', required=True, select=True,
+        readonly=True, ondelete='CASCADE'
+    )
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+    ], 'State', required=True, readonly=True, select=True)
+    outcome = fields.Selection([
+        (None, ''),
+        ('valid', 'Valid'),
+        ('suggested', 'Suggested'),
+        ('invalid', 'Invalid'),
+        ('error', 'Error'),
+    ], 'Outcome', readonly=True)
+    suggestions = fields.Text('Suggestions', readonly=True)
+    differences = fields.Char(
+        'Differences', readonly=True,
+        help='Fields of the address changed by the first suggestion.'
+    )
+    message = fields.Char('Message', readonly=True)
+    validated_at = fields.DateTime('Validated At', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(USPSAddressQueue, cls).__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+
+    @staticmethod
+    def default_state():
+        return 'pending'
+
+    @classmethod
+    def enqueue(cls, addresses):
+        """
+        Queues the US addresses for validation, unless they are already
+        pending
+        """
+        cursor = Transaction().cursor
+
+        addresses = [
+            address for address in addresses
+            if not address.country or address.country.code == 'US'
+        ]
+        pending = set()
+        for offset in xrange(0, len(addresses), cursor.IN_MAX):
+            pending.update(entry.address.id for entry in cls.search([
+                ('address', 'in', map(
+                    int, addresses[offset:offset + cursor.IN_MAX]
+                )),
+                ('state', '=', 'pending'),
+            ]))
+        vlist = []
+        for address in addresses:
+            if address.id not in pending:
+                pending.add(address.id)
+                vlist.append({'address': address.id})
+        return cls.create(vlist)
+
+    @classmethod
+    def process(cls):
+        """
+        Validates the pending addresses batch by batch, committing each
+        batch. Called by the scheduler.
+        """
+        cursor = Transaction().cursor
+
+        while True:
+            entries = cls.search([
+                ('state', '=', 'pending'),
+            ], order=[('id', 'ASC')], limit=cls.batch_size)
+            if not entries:
+                break
+            cls.process_batch(entries)
+            cursor.commit()
+
+    @classmethod
+    def process_batch(cls, entries):
+        """
+        Validates the addresses of the entries together and records their
+        outcome. The entries whose address fails its validation are done
+        with an error outcome, so that they do not block the queue.
+        """
+        Address = Pool().get('party.address')
+
+        results = Address.usps_validate_addresses_apart(
+            [entry.address for entry in entries]
+        )
+        validated_at = datetime.now()
+        for entry, result in zip(entries, results):
+            values = cls.get_outcome_values(entry.address, result)
+            values.update({
+                'state': 'done',
+                'validated_at': validated_at,
+            })
+            cls.write([entry], values)
+
+    @staticmethod
+    def get_outcome_values(address, result):
+        """
+        Returns the values of the outcome fields for a result of
+        `usps_validate_addresses_apart` of the address
+        """
+        Address = Pool().get('party.address')
+
+        outcome = Address.usps_outcome_of(result)
+        values = {
+            'outcome': outcome,
+            'suggestions': None,
+            'differences': None,
+            'message': None,
+        }
+        if outcome == 'suggested':
+            values['suggestions'] = '\n\n'.join(
+                suggestion.get_full_address(None) for suggestion in result
+            )
+            values['differences'] = ', '.join(address.usps_differences(
+                dict(
+                    (name, getattr(result[0], name))
+                    for name in COMPARED_FIELDS
+                )
+            ))
+        elif outcome == 'invalid':
+            values['message'] = result or None
+        elif outcome == 'error':
+            values['message'] = unicode(
+                result.args[0] if result.args else result.__class__.__name__
+            )
+        return values
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_parser.py
+
+    Compares the parsing of USPS responses with lxml.objectify and with
+    usps.parser, in CPU time and in memory kept by the results.
+
+    Usage: python benchmarks/bench_parser.py [--addresses 5] [--number 20000]
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lxml import objectify  # noqa
+
+from usps.parser import parse_address_response  # noqa
+
+ADDRESS = (
+    '<Address ID="%d"><FirmName>XYZ CORP.</FirmName>'
+    '<Address2>6406 IVY LN</Address2><City>GREENBELT</City>'
+    '<State>MD</State><Zip5>20770</Zip5><Zip4>1441</Zip4></Address>'
+)
+
+
+def make_response(addresses):
+    return '<AddressValidateResponse>%s</AddressValidateResponse>' % ''.join(
+        ADDRESS % index for index in xrange(addresses)
+    )
+
+
+def parse_objectify(xml):
+    "Parse as the objectify based API does and read the fields"
+    response = objectify.fromstring(xml)
+    addresses = list(response.iterchildren('Address'))
+    for address in addresses:
+        (str(address.City), str(address.State), str(address.Zip5),
+            str(address.Zip4))
+    return addresses
+
+
+def parse_results(xml):
+    "Parse with usps.parser and read the fields"
+    results = [result for id, result, error in parse_address_response(xml)]
+    for result in results:
+        result.City, result.State, result.Zip5, result.Zip4
+    return results
+
+
+PARSERS = {
+    'objectify': parse_objectify,
+    'parser': parse_results,
+}
+
+
+def measure_memory(name, xml, number):
+    """
+    Keeps the results of `number` responses and prints the growth of the
+    maximum resident set size in KiB. Run in its own process.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results = [PARSERS[name](xml) for i in xrange(number)]
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print after - before
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--addresses', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--memory', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    xml = make_response(args.addresses)
+
+    if args.memory:
+        measure_memory(args.memory, xml, args.number)
+        return
+
+    print 'Responses of %d addresses, %d runs' % (args.addresses, args.number)
+    for name in sorted(PARSERS):
+        seconds = timeit.timeit(
+            lambda: PARSERS[name](xml), number=args.number
+        )
+        memory = subprocess.check_output([
+            sys.executable, __file__, '--memory', name,
+            '--addresses', str(args.addresses), '--number', str(args.number),
+        ]).strip()
+        print '%-10s %8.1f us/response %8s KiB kept' % (
+            name, seconds / args.number * 1e6, memory
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    bench_serializer.py
+
+    Compares the writing of AddressValidateRequest documents with
+    lxml.builder and with usps.serializer.
+
+    Usage: python benchmarks/bench_serializer.py [--addresses 5]
+        [--number 20000]
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lxml import etree  # noqa
+from lxml.builder import E  # noqa
+
+from usps.address_validation import AddressValidation  # noqa
+from usps.serializer import serialize_request  # noqa
+
+ADDRESS = {
+    'FirmName': 'XYZ Corp.',
+    'Address2': '6406 Ivy Lane',
+    'City': 'Greenbelt',
+    'State': 'MD',
+}
+
+
+def write_builder(addresses):
+    "Build the request with lxml.builder and serialize it"
+    return etree.tostring(E.AddressValidateRequest(*[
+        AddressValidation.address_request_type(id=str(index), **values)
+        for index, values in enumerate(addresses)
+    ], USERID='XXXXXXX'))
+
+
+def write_templates(addresses):
+    "Write the request with usps.serializer"
+    return serialize_request('AddressValidateRequest', 'XXXXXXX', [
+        AddressValidation.address_request_xml(id=str(index), **values)
+        for index, values in enumerate(addresses)
+    ])
+
+
+WRITERS = {
+    'builder': write_builder,
+    'templates': write_templates,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--addresses', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+    addresses = [ADDRESS] * args.addresses
+
+    assert write_builder(addresses) == write_templates(addresses)
+
+    print 'Requests of %d addresses, %d runs' % (args.addresses, args.number)
+    for name in sorted(WRITERS):
+        seconds = timeit.timeit(
+            lambda: WRITERS[name](addresses), number=args.number
+        )
+        print '%-10s %8.1f us/request' % (
+            name, seconds / args.number * 1e6
+        )
+
+
+if __name__ == '__main__':
+    main()
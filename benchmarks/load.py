@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+    load.py
+
+    Load benchmark of the client paths of the API against the local fake
+    USPS server: single requests, batches, threads and futures. Reports the
+    lookups per second, the HTTP requests per second, the p50/p99 latency of
+    the calls and the memory growth of the client.
+
+    Usage: python benchmarks/load.py [--lookups 500] [--latency 0.02]
+        [--threads 10] [--scenario single ...]
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from usps.api import BaseAPI  # noqa
+from usps.city_state_lookup import CityStateLookup  # noqa
+from usps.testing import FakeUSPSServer  # noqa
+
+
+def single(api, zips, args):
+    "One lookup per call, sequentially"
+    latencies = []
+    for zip5 in zips:
+        start = time.time()
+        api.lookup(zip5)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def batched(api, zips, args):
+    "Calls of lookup_many with --batch ZIP codes, sequentially"
+    latencies = []
+    for offset in xrange(0, len(zips), args.batch):
+        start = time.time()
+        api.lookup_many(zips[offset:offset + args.batch])
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def threaded(api, zips, args):
+    "One lookup per call, from --threads threads"
+    latencies = []
+    lock = threading.Lock()
+
+    def run(zips):
+        for zip5 in zips:
+            start = time.time()
+            api.lookup(zip5)
+            with lock:
+                latencies.append(time.time() - start)
+
+    threads = [
+        threading.Thread(target=run, args=(zips[index::args.threads],))
+        for index in xrange(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def futures(api, zips, args):
+    "All the lookups submitted at once as futures"
+    pending = [(api.lookup_async(zip5), time.time()) for zip5 in zips]
+    latencies = []
+    for future, submitted in pending:
+        future.result()
+        latencies.append(time.time() - submitted)
+    return latencies
+
+
+SCENARIOS = {
+    'single': single,
+    'batched': batched,
+    'threaded': threaded,
+    'async': futures,
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_scenario(args):
+    """
+    Runs a scenario against the server of --url and prints its results as
+    JSON. Run in its own process to measure its memory.
+    """
+    BaseAPI.configure_concurrency(args.threads)
+    BaseAPI.configure_pool(pool_maxsize=args.threads)
+    api = CityStateLookup(
+        'XXXXXXX', '', cache=None, read_timeout=60, breaker_threshold=0
+    )
+    api.urls = {
+        'secure': args.url + '/ShippingAPI.dll',
+        'unsecure': args.url + '/ShippingAPITest.dll',
+    }
+    zips = ['%05d' % number for number in xrange(args.lookups)]
+
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    latencies = SCENARIOS[args.scenario](api, zips, args)
+    duration = time.time() - start
+    print json.dumps({
+        'duration': duration,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'memory': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='latency of the fake server in seconds')
+    parser.add_argument('--threads', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=50,
+                        help='ZIP codes per call of the batched scenario')
+    parser.add_argument('--scenario', action='append',
+                        choices=sorted(SCENARIOS))
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.url:
+        args.scenario, = args.scenario
+        run_scenario(args)
+        return
+
+    server = FakeUSPSServer(latency=args.latency, resolve_any=True).start()
+    print '%d lookups, server latency %gs, %d threads' % (
+        args.lookups, args.latency, args.threads
+    )
+    print '%-9s %9s %9s %10s %10s %10s' % (
+        'scenario', 'lookups/s', 'HTTP/s', 'p50 ms', 'p99 ms', 'KiB'
+    )
+    try:
+        for scenario in args.scenario or sorted(SCENARIOS):
+            requests = server.requests
+            result = json.loads(subprocess.check_output([
+                sys.executable, __file__, '--url', server.url,
+                '--scenario', scenario, '--lookups', str(args.lookups),
+                '--threads', str(args.threads), '--batch', str(args.batch),
+            ]))
+            print '%-9s %9.1f %9.1f %10.1f %10.1f %10d' % (
+                scenario,
+                args.lookups / result['duration'],
+                (server.requests - requests) / result['duration'],
+                result['p50'] * 1000, result['p99'] * 1000,
+                result['memory'],
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
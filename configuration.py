@@ -5,7 +5,11 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+from trytond.cache import Cache
 from trytond.model import fields, ModelSingleton, ModelSQL, ModelView
+from trytond.pyson import Bool, Eval
+from trytond.rpc import RPC
+from usps.api import BaseAPI
 from usps.address_validation import AddressValidation
 from usps.city_state_lookup import CityStateLookup
 
@@ -21,12 +25,200 @@ class USPSConfiguration(ModelSingleton, ModelSQL, ModelView):
     username = fields.Char('USPS Username', required=True)
     password = fields.Char('USPS User Password', required=True)
     is_test = fields.Boolean('Is Test')
+    street_validation = fields.Boolean(
+        'Street Level Validation', help='Validate the street, city, state '
+        'and ZIP+4 of the addresses instead of only the city and state of '
+        'their ZIP code.'
+    )
+    deferred_validation = fields.Boolean(
+        'Deferred Validation', help='Queue the created and modified '
+        'addresses to be validated with USPS in the background.'
+    )
+    validation_freshness = fields.Integer(
+        'Validation Freshness', help='Number of days an address found '
+        'valid is not validated again while it is unchanged. Leave empty '
+        'to always validate the addresses.'
+    )
+    zip_cache_validity = fields.Integer(
+        'ZIP Cache Validity', help='Number of days a city/state lookup is '
+        'kept in the ZIP cache. Leave empty to keep them forever.'
+    )
+    address_cache_validity = fields.Integer(
+        'Address Cache Validity', help='Number of days a street level '
+        'validation is kept in the address cache. Leave empty to keep them '
+        'forever.'
+    )
+    offline_first = fields.Boolean(
+        'Offline First', help='Look up the city and state of ZIP codes in '
+        'the ZIP dataset first and only call USPS for the missing ones.'
+    )
+    zip_dataset = fields.Char(
+        'ZIP Dataset', states={
+            'required': Bool(Eval('offline_first')),
+        }, depends=['offline_first'],
+        help='Path of the dataset file loaded with usps-load-zips.'
+    )
+    connect_timeout = fields.Float(
+        'Connect Timeout', help='Seconds to wait for the connection to USPS.'
+    )
+    read_timeout = fields.Float(
+        'Read Timeout', help='Seconds to wait for the response of USPS.'
+    )
+    max_retries = fields.Integer(
+        'Maximum Retries', help='Number of retries of the requests failing '
+        'with a connection error, a timeout or a server error.'
+    )
+    breaker_threshold = fields.Integer(
+        'Circuit Breaker Threshold', help='Number of consecutive failed '
+        'requests after which USPS is not called during the cool down. '
+        'Set 0 to always call USPS.'
+    )
+    breaker_cooldown = fields.Integer(
+        'Circuit Breaker Cool Down',
+        help='Seconds during which USPS is not called once the circuit '
+        'breaker threshold is reached.'
+    )
+
+    rate_limit = fields.Float(
+        'Rate Limit', help='Maximum number of requests per second sent to '
+        'USPS. Leave empty for no limit.'
+    )
+    rate_limit_burst = fields.Integer(
+        'Rate Limit Burst', help='Maximum number of requests sent at once '
+        'within the rate limit. Defaults to the rate limit.'
+    )
+    rate_limit_file = fields.Char(
+        'Rate Limit File', help='Path of a file through which the server '
+        'processes of the host, or of a file system supporting locks, '
+        'respect the rate limit together. Leave empty to apply it per '
+        'process.'
+    )
+
+    # API instances keep connection pools and caches, so they are kept for
+    # the whole process.
+    _api_instance_cache = Cache(
+        'usps.configuration.get_api_instance_of', context=False
+    )
+
+    @classmethod
+    def __setup__(cls):
+        super(USPSConfiguration, cls).__setup__()
+        cls.__rpc__.update({
+            'get_metrics': RPC(),
+            'get_metrics_prometheus': RPC(),
+        })
+
+    @staticmethod
+    def default_validation_freshness():
+        return 30
+
+    @staticmethod
+    def default_zip_cache_validity():
+        return 90
+
+    @staticmethod
+    def default_address_cache_validity():
+        return 90
+
+    @staticmethod
+    def default_connect_timeout():
+        return 5
+
+    @staticmethod
+    def default_read_timeout():
+        return 30
+
+    @staticmethod
+    def default_max_retries():
+        return 2
+
+    @staticmethod
+    def default_breaker_threshold():
+        return 5
+
+    @staticmethod
+    def default_breaker_cooldown():
+        return 60
+
+    def get_api_options(self):
+        """
+        Returns the keyword arguments of the API instances for the
+        connection settings
+        """
+        return {
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'max_retries': self.max_retries,
+            'breaker_threshold': self.breaker_threshold,
+            'breaker_cooldown': self.breaker_cooldown,
+            'rate_limit': self.rate_limit,
+            'rate_limit_burst': self.rate_limit_burst,
+            'rate_limit_file': self.rate_limit_file,
+        }
+
+    @classmethod
+    def create(cls, vlist):
+        records = super(USPSConfiguration, cls).create(vlist)
+        cls._api_instance_cache.clear()
+        return records
+
+    @classmethod
+    def write(cls, *args):
+        super(USPSConfiguration, cls).write(*args)
+        cls._api_instance_cache.clear()
+
+    @classmethod
+    def delete(cls, records):
+        super(USPSConfiguration, cls).delete(records)
+        cls._api_instance_cache.clear()
 
     def get_api_instance_of(self, call):
         """
         Return API Instance according to type
+
+        The instances are memoized per process by credentials and settings,
+        the memo is cleared when the configuration is modified.
         """
+        options = self.get_api_options()
+        key = (
+            self.username, self.password, self.is_test, call,
+            tuple(sorted(options.items())),
+        )
+        api_instance = self._api_instance_cache.get(key)
+        if api_instance is not None:
+            return api_instance
+
         if call == 'address_val':
-            return AddressValidation(self.username, self.password, self.is_test)
+            api_instance = AddressValidation(
+                self.username, self.password, self.is_test, **options
+            )
         elif call == 'city_state_lookup':
-            return CityStateLookup(self.username, self.password, self.is_test)
+            # Cached by usps.zip.cache instead, with the validity set here
+            api_instance = CityStateLookup(
+                self.username, self.password, self.is_test, cache=None,
+                **options
+            )
+        else:
+            return None
+        return self._api_instance_cache.set(key, api_instance)
+
+    @classmethod
+    def get_metrics(cls):
+        """
+        Returns the timings, outcomes and payload sizes of the USPS calls
+        made by this server process, by API type. See
+        :meth:`usps.instrumentation.MemoryInstrumentation.snapshot`.
+        """
+        if not hasattr(BaseAPI.instrumentation, 'snapshot'):
+            return {}
+        return BaseAPI.instrumentation.snapshot()
+
+    @classmethod
+    def get_metrics_prometheus(cls):
+        """
+        Returns the metrics of :meth:`get_metrics` in the Prometheus text
+        exposition format
+        """
+        if not hasattr(BaseAPI.instrumentation, 'to_prometheus'):
+            return ''
+        return BaseAPI.instrumentation.to_prometheus()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+    country.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from trytond.cache import Cache
+from trytond.pool import PoolMeta
+
+__all__ = ['Subdivision']
+__metaclass__ = PoolMeta
+
+
+class Subdivision:
+    "Subdivision"
+    __name__ = 'country.subdivision'
+
+    # Index of the US subdivision ids by USPS state code, built once per
+    # process and cleared when the subdivisions are modified.
+    _usps_index_cache = Cache('country.subdivision.usps_index', context=False)
+
+    @classmethod
+    def create(cls, vlist):
+        records = super(Subdivision, cls).create(vlist)
+        cls._usps_index_cache.clear()
+        return records
+
+    @classmethod
+    def write(cls, *args):
+        super(Subdivision, cls).write(*args)
+        cls._usps_index_cache.clear()
+
+    @classmethod
+    def delete(cls, records):
+        super(Subdivision, cls).delete(records)
+        cls._usps_index_cache.clear()
+
+    @classmethod
+    def get_usps_index(cls):
+        """
+        Returns a dictionary of the US subdivision ids by USPS state code.
+        The codes matching more than one subdivision are left out.
+        """
+        index = cls._usps_index_cache.get('US')
+        if index is not None:
+            return index
+
+        index = {}
+        duplicates = set()
+        for subdivision in cls.search([('code', 'like', 'US-%')]):
+            state = subdivision.code[3:]
+            if state in index:
+                duplicates.add(state)
+            index[state] = subdivision.id
+        for state in duplicates:
+            del index[state]
+        return cls._usps_index_cache.set('US', index)
+
+    @classmethod
+    def get_usps_subdivision(cls, state):
+        """
+        Returns the id of the US subdivision of the USPS state code or None
+        if there is no unique match.
+        """
+        return cls.get_usps_index().get(state)
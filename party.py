@@ -5,12 +5,35 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+from datetime import datetime, timedelta
+
+from trytond.exceptions import UserError
+from trytond.model import fields
 from trytond.pool import Pool, PoolMeta
-from usps.exceptions import USPSInvalidZip5
+from usps.exceptions import USPSServiceUnavailable
+from usps.normalize import (
+    canonical_hash, is_zip5, normalize_zip5, split_zip
+)
+from usps.ratelimit import BULK, INTERACTIVE
+from usps.zip_dataset import get_dataset
 
 __all__ = ['Address']
 __metaclass__ = PoolMeta
 
+#: Fields of the addresses whose modification changes their validation
+VALIDATED_FIELDS = frozenset([
+    'name', 'street', 'streetbis', 'city', 'zip', 'country', 'subdivision',
+])
+
+#: Fields of the addresses USPS may suggest another value for
+COMPARED_FIELDS = ('street', 'streetbis', 'city', 'zip', 'subdivision')
+
+
+class USPSUnavailableError(UserError):
+    """
+    Raised when USPS is not available and the cache can not answer instead
+    """
+
 
 class Address:
     '''
@@ -18,14 +41,53 @@ class Address:
     '''
     __name__ = 'party.address'
 
+    usps_fingerprint = fields.Char('USPS Fingerprint', readonly=True)
+    usps_validated_at = fields.DateTime('USPS Validated At', readonly=True)
+    usps_outcome = fields.Selection([
+        (None, ''),
+        ('valid', 'Valid'),
+        ('suggested', 'Suggested'),
+        ('invalid', 'Invalid'),
+    ], 'USPS Outcome', readonly=True)
+
     @classmethod
     def __setup__(cls):
         super(Address, cls).__setup__()
         cls._error_messages.update({
             'usps_invalid_country':
-                'USPS address validation not available for %s.'
+                'USPS address validation not available for %s.',
+            'usps_unavailable':
+                'USPS address validation is currently not available: %s',
+            'usps_invalid_zip': 'The ZIP code "%s" is not valid.',
         })
 
+    @classmethod
+    def create(cls, vlist):
+        addresses = super(Address, cls).create(vlist)
+        cls._usps_enqueue(addresses)
+        return addresses
+
+    @classmethod
+    def write(cls, *args):
+        super(Address, cls).write(*args)
+        actions = iter(args)
+        modified = []
+        for addresses, values in zip(actions, actions):
+            if VALIDATED_FIELDS.intersection(values):
+                modified.extend(addresses)
+        cls._usps_enqueue(modified)
+
+    @classmethod
+    def _usps_enqueue(cls, addresses):
+        """
+        Queues the addresses for validation in deferred validation mode
+        """
+        USPSConfiguration = Pool().get('usps.configuration')
+        AddressQueue = Pool().get('usps.address.queue')
+
+        if addresses and USPSConfiguration(1).deferred_validation:
+            AddressQueue.enqueue(addresses)
+
     def _usps_address_validate(self):
         """
         Validates the address using the USPS API.
@@ -35,53 +97,482 @@ class Address:
             trytond-shipping module.
         """
         USPSConfiguration = Pool().get('usps.configuration')
-        Subdivision = Pool().get('country.subdivision')
-        Address = Pool().get('party.address')
 
-        api_instance = USPSConfiguration(1).get_api_instance_of(
-            'city_state_lookup'
+        config = USPSConfiguration(1)
+        self._usps_check_country()
+        if self._usps_is_fresh(config):
+            return True
+        if config.street_validation:
+            validations = self._usps_street_validations(
+                config, [self], INTERACTIVE
+            )
+            result = self._usps_street_suggest(
+                validations[self._usps_address_key()]
+            )
+        else:
+            zip5 = self._usps_zip5()
+            lookup = self._usps_city_state_lookups(
+                config, [zip5], INTERACTIVE
+            )[zip5]
+            result = self._usps_suggest(lookup)
+        self._usps_record_outcomes(config, [self], [result])
+        return result
+
+    @classmethod
+    def usps_validate_addresses(cls, addresses):
+        """
+        Validates many addresses at once and returns a list with the result
+        for each address, in the same order: True, a list of suggestions
+        like `_usps_address_validate` or the error message if it failed.
+
+        Identical addresses are validated once and the ZIP5 codes, or the
+        addresses in street level mode, are sent together, concurrently in
+        batches. The addresses validated within the freshness window and
+        unchanged since are not sent.
+
+        :param addresses: List of active records of party.address
+        """
+        USPSConfiguration = Pool().get('usps.configuration')
+
+        config = USPSConfiguration(1)
+        fresh = [address._usps_is_fresh(config) for address in addresses]
+        stale = [
+            address for address, is_fresh in zip(addresses, fresh)
+            if not is_fresh
+        ]
+        suggest = cls._usps_suggester(config, [
+            address for address in stale
+            if not address.country or address.country.code == 'US'
+        ])
+
+        results = {}
+        for address in stale:
+            key = address._usps_validation_key()
+            if key in results:
+                continue
+            try:
+                address._usps_check_country()
+                results[key] = suggest(address)
+            except UserError, exc:
+                results[key] = exc.message
+        cls._usps_record_outcomes(config, stale, [
+            results[address._usps_validation_key()] for address in stale
+        ])
+        return [
+            True if is_fresh else results[address._usps_validation_key()]
+            for address, is_fresh in zip(addresses, fresh)
+        ]
+
+    @classmethod
+    def usps_validate_addresses_apart(cls, addresses):
+        """
+        Validates the addresses like `usps_validate_addresses`, but if that
+        fails, validates them one by one so that an address failing does
+        not fail the others: the exception raised by its validation is
+        returned as its result. USPS being unavailable is still raised.
+        """
+        try:
+            return cls.usps_validate_addresses(addresses)
+        except USPSUnavailableError:
+            raise
+        except Exception:
+            pass
+        return map(cls._usps_validate_address_apart, addresses)
+
+    @classmethod
+    def _usps_validate_address_apart(cls, address):
+        """
+        Returns the result of the validation of the address alone or the
+        exception it raised, see `usps_validate_addresses_apart`
+        """
+        try:
+            return cls.usps_validate_addresses([address])[0]
+        except USPSUnavailableError:
+            raise
+        except Exception, exc:
+            return exc
+
+    @classmethod
+    def _usps_suggester(cls, config, addresses):
+        """
+        Sends the addresses to USPS at once and returns a function returning
+        the result of `_usps_suggest` or `_usps_street_suggest` for each of
+        them.
+
+        :param config: Active record of the USPS configuration
+        """
+        if config.street_validation:
+            validations = cls._usps_street_validations(config, addresses)
+            return lambda address: address._usps_street_suggest(
+                validations[address._usps_address_key()]
+            )
+        # The addresses without a valid ZIP get an error when suggested
+        zips = [normalize_zip5(address.zip) for address in addresses]
+        lookups = cls._usps_city_state_lookups(config, filter(is_zip5, zips))
+        return lambda address: address._usps_suggest(
+            lookups[address._usps_zip5()]
+        )
+
+    def _usps_zip5(self):
+        """
+        Returns the ZIP5 of the address or raises an error if it has no
+        valid ZIP code
+        """
+        zip5 = normalize_zip5(self.zip)
+        if not is_zip5(zip5):
+            self.raise_user_error('usps_invalid_zip', (self.zip or '',))
+        return zip5
+
+    def _usps_validation_key(self):
+        """
+        Returns a key identical for the addresses with the same validation
+        result.
+        """
+        return (
+            self.name, self.street, self.streetbis, self.city, self.zip,
+            self.country and self.country.id,
+            self.subdivision and self.subdivision.id,
         )
 
+    def _usps_fingerprint(self, config):
+        """
+        Returns the fingerprint of the normalized values of the address
+        validated by USPS in the validation mode of the configuration
+        """
+        mode = 'street' if config.street_validation else 'city_state'
+        return '%s:%s' % (mode, self._usps_address_key())
+
+    def _usps_is_fresh(self, config):
+        """
+        Returns True if the address was found valid within the validation
+        freshness of the configuration and is unchanged since
+        """
+        if self.id is None or self.id < 0 \
+                or not config.validation_freshness \
+                or self.usps_outcome != 'valid':
+            return False
+        return (
+            self.usps_validated_at >= datetime.now() - timedelta(
+                config.validation_freshness
+            )
+            and self.usps_fingerprint == self._usps_fingerprint(config)
+        )
+
+    @staticmethod
+    def usps_outcome_of(result):
+        """
+        Returns the outcome, valid, suggested or invalid, of a validation
+        result of `usps_validate_addresses`, or error for the exception of
+        an address failing `usps_validate_addresses_apart`
+        """
+        if result is True:
+            return 'valid'
+        elif isinstance(result, list) and result:
+            return 'suggested'
+        elif isinstance(result, Exception):
+            return 'error'
+        return 'invalid'
+
+    @classmethod
+    def _usps_record_outcomes(cls, config, addresses, results):
+        """
+        Stores the fingerprint and the outcome of the validation results on
+        the saved addresses
+        """
+        validated_at = datetime.now()
+        actions = []
+        for address, result in zip(addresses, results):
+            if address.id is None or address.id < 0:
+                continue
+            actions.extend(([address], {
+                'usps_fingerprint': address._usps_fingerprint(config),
+                'usps_validated_at': validated_at,
+                'usps_outcome': cls.usps_outcome_of(result),
+            }))
+        if actions:
+            cls.write(*actions)
+
+    def _usps_check_country(self):
+        """
+        Raises an error if the address can not be validated by USPS
+        """
         if self.country and self.country.code != 'US':
             # XXX: Either this or assume it is the US of A
             self.raise_user_error('usps_invalid_country', self.country.name)
 
-        zipcode_request_type = api_instance.zipcode_request_type(
-            Zip5=self.zip[:5]
+    def _usps_suggest(self, lookup):
+        """
+        Returns True if the address matches the city/state lookup of its
+        ZIP5 or a list with the suggested address.
+
+        :param lookup: `usps.zip.cache` record of the ZIP5 of the address
+        """
+        if lookup.error:
+            self.raise_user_error(lookup.error)
+
+        subdivision = self._usps_subdivision_of(lookup)
+        if subdivision is None:
+            # If a unique match cannot be found for the subdivision,
+            # we wont be able to save the address anyway.
+            return []
+
+        suggested = {
+            'city': lookup.city,
+            'zip': lookup.zip5,
+            'subdivision': subdivision,
+        }
+        if not self.usps_differences(suggested):
+            # USPS return same address if address is passed.
+            return True
+        return [self._usps_suggestion(suggested)]
+
+    def usps_differences(self, suggested):
+        """
+        Returns the list of the names of the fields of the address differing
+        from the suggested values, compared case insensitively, in the order
+        of `COMPARED_FIELDS`. A suggested ZIP5 is compared with the ZIP5 of
+        the address only, so that its ZIP4 is not a difference.
+
+        :param suggested: dictionary of the suggested values by field name,
+            a `country.subdivision` record for the subdivision
+        """
+        differences = []
+        for name in COMPARED_FIELDS:
+            if name not in suggested:
+                continue
+            value, suggested_value = getattr(self, name), suggested[name]
+            if name == 'subdivision':
+                value = value and value.id
+                suggested_value = suggested_value and suggested_value.id
+            elif name == 'zip' and not split_zip(suggested_value)[1]:
+                value = normalize_zip5(value)
+                suggested_value = normalize_zip5(suggested_value)
+            else:
+                value = (value or '').upper()
+                suggested_value = (suggested_value or '').upper()
+            if value != suggested_value:
+                differences.append(name)
+        return differences
+
+    def _usps_suggestion(self, suggested):
+        """
+        Returns an unsaved copy of the address with the suggested values,
+        keeping its ZIP if the suggested one does not differ
+        """
+        Address = Pool().get('party.address')
+
+        values = {
+            'name': self.name,
+            'street': self.street,
+            'streetbis': self.streetbis,
+            'city': self.city,
+            'zip': self.zip,
+            'subdivision': self.subdivision,
+            'country': self.country,
+        }
+        values.update(suggested)
+        if 'zip' in suggested and not self.usps_differences({
+                'zip': suggested['zip']}):
+            values['zip'] = self.zip
+        return Address(**values)
+
+    @staticmethod
+    def _usps_subdivision_of(record):
+        """
+        Returns the subdivision of a cached USPS result or None if there is
+        no unique match for its state.
+        """
+        Subdivision = Pool().get('country.subdivision')
+
+        if record.subdivision is not None:
+            return record.subdivision
+        # The subdivision may have been created after the result was cached.
+        subdivision_id = Subdivision.get_usps_subdivision(record.state)
+        if subdivision_id is None:
+            return None
+        return Subdivision(subdivision_id)
+
+    def _usps_address_values(self):
+        """
+        Returns the keyword arguments of
+        `AddressValidation.address_request_type` for the address
+        """
+        state = ''
+        if self.subdivision and self.subdivision.code.startswith('US-'):
+            state = self.subdivision.code[3:]
+        return {
+            'Address1': self.streetbis or '',
+            'Address2': self.street or '',
+            'City': self.city or '',
+            'State': state,
+            'Zip5': self.zip or '',
+        }
+
+    def _usps_address_key(self):
+        """
+        Returns the canonical key of the address in the USPS address cache
+        """
+        return canonical_hash(self._usps_address_values())
+
+    def _usps_street_suggest(self, validation):
+        """
+        Returns True if the address matches its street level validation or
+        a list with the suggested address.
+
+        :param validation: `usps.address.cache` record of the address
+        """
+        if validation.error:
+            self.raise_user_error(validation.error)
+
+        subdivision = self._usps_subdivision_of(validation)
+        if subdivision is None:
+            return []
+
+        zip_code = validation.zip5
+        if validation.zip4:
+            zip_code = '%s-%s' % (validation.zip5, validation.zip4)
+        suggested = {
+            'street': validation.address2,
+            'streetbis': validation.address1,
+            'city': validation.city,
+            'zip': zip_code,
+            'subdivision': subdivision,
+        }
+        if not self.usps_differences(suggested):
+            return True
+        return [self._usps_suggestion(suggested)]
+
+    @classmethod
+    def _usps_street_validations(cls, config, addresses, priority=BULK):
+        """
+        Returns a dictionary of the `usps.address.cache` records by canonical
+        key for the given addresses. USPS is only called for the addresses
+        without a fresh cached validation and the results are written back.
+
+        :param config: Active record of the USPS configuration
+        :param priority: Priority of the USPS requests for the rate limit
+        """
+        AddressCache = Pool().get('usps.address.cache')
+
+        values = dict(
+            (address._usps_address_key(), address._usps_address_values())
+            for address in addresses
         )
+        validations = AddressCache.get_fresh_many(values.keys(), config=config)
+        missing = dict(
+            (key, address_values) for key, address_values in values.iteritems()
+            if key not in validations
+        )
+        if missing:
+            validations.update(cls._usps_fetch_validations(
+                config, missing, priority
+            ))
+        return validations
 
-        try:
-            lookup_response = api_instance.request(zipcode_request_type)
-        except USPSInvalidZip5, exc:
-            self.raise_user_error(unicode(exc[0]))
+    @classmethod
+    def _usps_fetch_validations(cls, config, values, priority=BULK):
+        """
+        Validates the addresses with USPS and returns a dictionary of the
+        `usps.address.cache` records they are written to. If USPS is not
+        available, the expired cached validations are returned instead.
 
-        # The approach here is to check if some diff in suggestion or not,
-        # If yes Return unsaved active record as suggestion else True
+        :param values: dictionary of the request values by canonical key
+        """
+        AddressCache = Pool().get('usps.address.cache')
 
+        api_instance = config.get_api_instance_of('address_val')
+        keys = values.keys()
         try:
-            subdivision, = Subdivision.search([
-                ('code', '=', '%s-%s' % (
-                    self.country.code, lookup_response.ZipCode.State
+            results = api_instance.validate_many(
+                [values[key] for key in keys], priority
+            )
+        except USPSServiceUnavailable, exc:
+            validations = AddressCache.get_fresh_many(
+                keys, stale=True, config=config
+            )
+            if len(validations) < len(keys):
+                raise USPSUnavailableError(cls.raise_user_error(
+                    'usps_unavailable', unicode(exc[0]),
+                    raise_exception=False
                 ))
-            ])
-        except ValueError:
-            # If a unique match cannot be found for the subdivision,
-            # we wont be able to save the address anyway.
-            return []
+            return validations
+        return dict(
+            (key, AddressCache.store(key, result))
+            for key, result in zip(keys, results)
+        )
+
+    @classmethod
+    def _usps_city_state_lookups(cls, config, zips, priority=BULK):
+        """
+        Returns a dictionary of the `usps.zip.cache` records by ZIP5 for the
+        given ZIP5 codes. USPS is only called for the ZIP5 without a fresh
+        cached lookup and the results are written back.
+
+        In offline first mode, the ZIP dataset is looked up before and
+        unsaved records are returned for the ZIP5 found in it.
 
-        suggested_address = Address(
-            name=self.name,
-            street=self.street,
-            streetbis=self.streetbis,
-            city=str(lookup_response.ZipCode.City),
-            zip=str(lookup_response.ZipCode.Zip5),
-            subdivision=subdivision,
-            country=self.country,
+        :param config: Active record of the USPS configuration
+        :param priority: Priority of the USPS requests for the rate limit
+        """
+        ZipCache = Pool().get('usps.zip.cache')
+
+        missing = set(zips)
+        lookups = {}
+        if config.offline_first and config.zip_dataset:
+            lookups.update(cls._usps_dataset_lookups(
+                config.zip_dataset, missing
+            ))
+            missing.difference_update(lookups)
+
+        lookups.update(ZipCache.get_fresh_many(missing, config=config))
+        missing.difference_update(lookups)
+
+        if missing:
+            lookups.update(cls._usps_fetch_lookups(config, missing, priority))
+        return lookups
+
+    @classmethod
+    def _usps_fetch_lookups(cls, config, zips, priority=BULK):
+        """
+        Looks up the ZIP5 codes with USPS and returns a dictionary of the
+        `usps.zip.cache` records they are written to. If USPS is not
+        available, the expired cached lookups are returned instead.
+        """
+        ZipCache = Pool().get('usps.zip.cache')
+
+        api_instance = config.get_api_instance_of('city_state_lookup')
+        try:
+            results = api_instance.lookup_many(zips, priority)
+        except USPSServiceUnavailable, exc:
+            lookups = ZipCache.get_fresh_many(zips, stale=True, config=config)
+            if len(lookups) < len(zips):
+                raise USPSUnavailableError(cls.raise_user_error(
+                    'usps_unavailable', unicode(exc[0]),
+                    raise_exception=False
+                ))
+            return lookups
+        return dict(
+            (zip5, ZipCache.store(zip5, result))
+            for zip5, result in results.iteritems()
         )
 
-        if self.get_full_address(None).upper() == \
-                suggested_address.get_full_address(None).upper():
-            # USPS return same address if address is passed.
-            return True
+    @classmethod
+    def _usps_dataset_lookups(cls, path, zips):
+        """
+        Returns a dictionary of unsaved `usps.zip.cache` records by ZIP5 for
+        the given ZIP5 codes found in the ZIP dataset.
+        """
+        ZipCache = Pool().get('usps.zip.cache')
+        Subdivision = Pool().get('country.subdivision')
 
-        return [suggested_address]
+        dataset = get_dataset(path)
+        lookups = {}
+        for zip5 in zips:
+            row = dataset.lookup(zip5)
+            if row is not None:
+                city, state = row
+                lookups[zip5] = ZipCache(
+                    zip5=zip5, city=city, state=state, error=None,
+                    subdivision=Subdivision.get_usps_subdivision(state),
+                )
+        return lookups
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+    revalidation.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import datetime
+
+from trytond.model import fields, ModelSQL, ModelView
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.transaction import Transaction
+
+__all__ = ['USPSAddressRevalidation']
+
+STATES = {
+    'readonly': Eval('state') != 'draft',
+}
+DEPENDS = ['state']
+
+
+class USPSAddressRevalidation(ModelSQL, ModelView):
+    """
+    Revalidation of all the US addresses with USPS, run by the scheduler
+    chunk by chunk in the order of the address ids. The id of the last
+    address revalidated is kept as a checkpoint and committed with each
+    chunk, so that an interrupted revalidation resumes after it.
+    """
+    __name__ = 'usps.address.revalidation'
+
+    name = fields.Char('Name', required=True, states=STATES, depends=DEPENDS)
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('cancel', 'Cancelled'),
+    ], 'State', readonly=True, required=True)
+    chunk_size = fields.Integer(
+        'Chunk Size', required=True, states=STATES, depends=DEPENDS,
+        help='Number of addresses revalidated and committed together.'
+    )
+    last_id = fields.Integer(
+        'Last Address ID', readonly=True,
+        help='Id of the last address revalidated.'
+    )
+    processed = fields.Integer('Processed', readonly=True)
+    valid = fields.Integer('Valid', readonly=True)
+    suggested = fields.Integer(
+        'Suggested', readonly=True,
+        help='Number of addresses for which USPS suggests another address.'
+    )
+    invalid = fields.Integer('Invalid', readonly=True)
+    errors = fields.Integer(
+        'Errors', readonly=True,
+        help='Number of addresses whose validation failed.'
+    )
+    started_at = fields.DateTime('Started At', readonly=True)
+    finished_at = fields.DateTime('Finished At', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(USPSAddressRevalidation, cls).__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+        cls._buttons.update({
+            'start': {
+                'invisible': ~Eval('state').in_(['draft', 'cancel']),
+            },
+            'cancel': {
+                'invisible': Eval('state') != 'running',
+            },
+        })
+
+    @staticmethod
+    def default_state():
+        return 'draft'
+
+    @staticmethod
+    def default_chunk_size():
+        return 500
+
+    @staticmethod
+    def default_last_id():
+        return 0
+
+    @staticmethod
+    def default_processed():
+        return 0
+
+    @staticmethod
+    def default_valid():
+        return 0
+
+    @staticmethod
+    def default_suggested():
+        return 0
+
+    @staticmethod
+    def default_invalid():
+        return 0
+
+    @staticmethod
+    def default_errors():
+        return 0
+
+    @classmethod
+    @ModelView.button
+    def start(cls, revalidations):
+        """
+        Starts the revalidations, or resumes the cancelled ones after their
+        checkpoint
+        """
+        cls.write(revalidations, {'state': 'running'})
+        not_started = [r for r in revalidations if not r.started_at]
+        if not_started:
+            cls.write(not_started, {'started_at': datetime.now()})
+
+    @classmethod
+    @ModelView.button
+    def cancel(cls, revalidations):
+        cls.write(revalidations, {'state': 'cancel'})
+
+    @classmethod
+    def revalidate(cls):
+        """
+        Processes the running revalidations chunk by chunk, committing each
+        chunk. Called by the scheduler.
+        """
+        cursor = Transaction().cursor
+
+        for revalidation_id in map(int, cls.search([
+                ('state', '=', 'running')])):
+            # Read again for each chunk, as it may have been cancelled
+            # meanwhile
+            while cls(revalidation_id).state == 'running':
+                cls(revalidation_id).process_chunk()
+                cursor.commit()
+
+    def process_chunk(self):
+        """
+        Revalidates the US addresses of the next chunk after the checkpoint
+        and moves the checkpoint to the last of them, counting the addresses
+        failing as errors. The revalidation is done once a chunk is not full.
+        """
+        Address = Pool().get('party.address')
+
+        addresses = Address.search([
+            ('id', '>', self.last_id),
+            ['OR', ('country', '=', None), ('country.code', '=', 'US')],
+        ], order=[('id', 'ASC')], limit=self.chunk_size)
+        results = Address.usps_validate_addresses_apart(addresses)
+
+        outcomes = map(Address.usps_outcome_of, results)
+        values = {
+            'processed': self.processed + len(addresses),
+            'valid': self.valid + outcomes.count('valid'),
+            'suggested': self.suggested + outcomes.count('suggested'),
+            'invalid': self.invalid + outcomes.count('invalid'),
+            'errors': self.errors + outcomes.count('error'),
+        }
+        if addresses:
+            values['last_id'] = addresses[-1].id
+        if len(addresses) < self.chunk_size:
+            values.update({
+                'state': 'done',
+                'finished_at': datetime.now(),
+            })
+        self.write([self], values)
@@ -82,6 +82,7 @@ minor_version = int(minor_version)
 
 requires = [
     'requests',
+    'futures',
 ]
 
 MODULE2PREFIX = {
@@ -140,6 +141,9 @@ setup(
     entry_points="""
     [trytond.modules]
     %s = trytond.modules.%s
+    [console_scripts]
+    usps-load-zips = usps.zip_dataset:main
+    usps-validate-addresses = usps.bulk_validation:main
     """ % (MODULE, MODULE),
     test_suite='tests',
     test_loader='trytond.test_loader:Loader',
@@ -11,7 +11,20 @@ import trytond.tests.test_tryton
 
 from tests.test_views_depends import TestViewsDepends
 from tests.test_api import TestUSPSApi
+from tests.test_cache import TestLRUCache
+from tests.test_breaker import TestCircuitBreaker
+from tests.test_parser import TestParser
+from tests.test_serializer import TestSerializer
+from tests.test_normalize import TestNormalize
+from tests.test_instrumentation import TestInstrumentation
+from tests.test_ratelimit import TestRateLimit
+from tests.test_singleflight import TestSingleFlight
+from tests.test_fake_server import TestFakeServer
+from tests.test_bulk_validation import TestBulkValidation
+from tests.test_zip_dataset import TestZipDataset
 from tests.test_address_validation import TestAddressValidation
+from tests.test_revalidation import TestRevalidation
+from tests.test_address_queue import TestAddressQueue
 
 
 def suite():
@@ -21,7 +34,20 @@ def suite():
     test_suite = trytond.tests.test_tryton.suite()
     test_suite.addTests([
         unittest.TestLoader().loadTestsFromTestCase(TestUSPSApi),
+        unittest.TestLoader().loadTestsFromTestCase(TestLRUCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestCircuitBreaker),
+        unittest.TestLoader().loadTestsFromTestCase(TestParser),
+        unittest.TestLoader().loadTestsFromTestCase(TestSerializer),
+        unittest.TestLoader().loadTestsFromTestCase(TestNormalize),
+        unittest.TestLoader().loadTestsFromTestCase(TestInstrumentation),
+        unittest.TestLoader().loadTestsFromTestCase(TestRateLimit),
+        unittest.TestLoader().loadTestsFromTestCase(TestSingleFlight),
+        unittest.TestLoader().loadTestsFromTestCase(TestFakeServer),
+        unittest.TestLoader().loadTestsFromTestCase(TestBulkValidation),
+        unittest.TestLoader().loadTestsFromTestCase(TestZipDataset),
         unittest.TestLoader().loadTestsFromTestCase(TestAddressValidation),
+        unittest.TestLoader().loadTestsFromTestCase(TestRevalidation),
+        unittest.TestLoader().loadTestsFromTestCase(TestAddressQueue),
         unittest.TestLoader().loadTestsFromTestCase(TestViewsDepends),
     ])
     return test_suite
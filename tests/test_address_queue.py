@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+    test_address_queue
+
+    Test the deferred validation of the addresses
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: GPLv3, see LICENSE for more details.
+"""
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import DB_NAME, POOL, USER, CONTEXT
+from trytond.transaction import Transaction
+
+from test_base import TestUSPSBase
+
+
+class TestAddressQueue(TestUSPSBase):
+    "Test the deferred validation of the addresses"
+
+    def setUp(self):
+        super(TestAddressQueue, self).setUp()
+        self.AddressQueue = POOL.get('usps.address.queue')
+
+    def test_0010_deferred_validation(self):
+        """
+        Test that the created and modified addresses are queued and
+        validated in batches
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            # Not queued unless deferred validation is set
+            self.assertEqual(self.AddressQueue.search([], count=True), 0)
+            self.USPSConfiguration.write([self.USPSConfiguration(1)], {
+                'deferred_validation': True,
+            })
+
+            with Transaction().set_context(company=None):
+                party, = self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [('create', self.get_address_values())],
+                }])
+            valid, suggested, invalid, foreign = sorted(
+                party.addresses, key=lambda address: address.id
+            )
+
+            # Foreign addresses are not queued
+            entries = self.AddressQueue.search([], order=[('id', 'ASC')])
+            self.assertEqual(
+                [entry.address for entry in entries],
+                [valid, suggested, invalid]
+            )
+            self.assertTrue(
+                all(entry.state == 'pending' for entry in entries)
+            )
+
+            # Pending addresses are queued once
+            self.Address.write([valid], {'street': '250 NE 25th Street'})
+            self.Address.write([valid], {'active': False})
+            self.assertEqual(self.AddressQueue.search([], count=True), 3)
+
+            self.AddressQueue.process_batch(entries)
+            entries = self.AddressQueue.browse(map(int, entries))
+            self.assertTrue(all(entry.state == 'done' for entry in entries))
+            self.assertTrue(all(entry.validated_at for entry in entries))
+            self.assertEqual(entries[0].outcome, 'valid')
+            self.assertEqual(entries[1].outcome, 'suggested')
+            self.assertTrue('Florida' in entries[1].suggestions)
+            self.assertEqual(entries[1].differences, 'subdivision')
+            self.assertEqual(entries[0].differences, None)
+            self.assertEqual(entries[2].outcome, 'invalid')
+            self.assertTrue(entries[2].message)
+
+            # Validated addresses are queued again once modified
+            self.Address.write([valid], {'city': 'Miami'})
+            self.assertEqual(self.AddressQueue.search([
+                ('address', '=', valid.id),
+                ('state', '=', 'pending'),
+            ], count=True), 1)
+
+    def test_0020_process(self):
+        """
+        Test that the scheduler validates all the queued addresses, batch by
+        batch
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.USPSConfiguration.write([self.USPSConfiguration(1)], {
+                'deferred_validation': True,
+            })
+
+            with Transaction().set_context(company=None):
+                self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [('create', self.get_address_values() * 3)],
+                }])
+            # The foreign addresses are not queued
+            self.assertEqual(self.AddressQueue.search([], count=True), 9)
+
+            # Keep the test database as is
+            commits = []
+            Transaction().cursor.commit = lambda: commits.append(
+                self.AddressQueue.search([
+                    ('state', '=', 'pending'),
+                ], count=True)
+            )
+            self.AddressQueue.process()
+
+            self.assertEqual(commits, [4, 0])
+            entries = self.AddressQueue.search([])
+            self.assertTrue(all(entry.state == 'done' for entry in entries))
+            self.assertEqual(
+                sorted(entry.outcome for entry in entries),
+                ['invalid'] * 3 + ['suggested'] * 3 + ['valid'] * 3
+            )
+
+    def test_0030_process_failing_address(self):
+        """
+        Test that an address failing its validation does not block the queue
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.USPSConfiguration.write([self.USPSConfiguration(1)], {
+                'deferred_validation': True,
+            })
+
+            with Transaction().set_context(company=None):
+                party, = self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [
+                        ('create', self.get_address_values()[:3]),
+                    ],
+                }])
+            valid, suggested, invalid = sorted(
+                party.addresses, key=lambda address: address.id
+            )
+            self.poison_addresses([suggested])
+
+            Transaction().cursor.commit = lambda: None
+            self.AddressQueue.process()
+
+            entries = self.AddressQueue.search([], order=[('id', 'ASC')])
+            self.assertTrue(all(entry.state == 'done' for entry in entries))
+            self.assertEqual(
+                [entry.outcome for entry in entries],
+                ['valid', 'error', 'invalid']
+            )
+            self.assertEqual(entries[1].message, 'Poisoned address')
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestAddressQueue)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
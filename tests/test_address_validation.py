@@ -7,13 +7,20 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: GPLv3, see LICENSE for more details.
 """
+import os
+import tempfile
+from datetime import datetime, timedelta
 import unittest
+from StringIO import StringIO
+
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import DB_NAME, USER, CONTEXT
 from trytond.exceptions import UserError
 from trytond.transaction import Transaction
 
-from test_base import TestUSPSBase
+from usps.zip_dataset import get_dataset
+
+from test_base import BaseAPI, TestUSPSBase
 
 
 class TestAddressValidation(TestUSPSBase):
@@ -73,6 +80,15 @@ class TestAddressValidation(TestUSPSBase):
             self.assertEqual(len(suggestions), 1)
             self.assertEqual(suggestions[0].subdivision, subdivision_florida)
 
+            # The lookup is cached for the other workers
+            zip_cache, = self.USPSZipCache.search([('zip5', '=', '33141')])
+            self.assertEqual(zip_cache.city, 'MIAMI BEACH')
+            self.assertEqual(zip_cache.state, 'FL')
+            self.assertEqual(zip_cache.subdivision, subdivision_florida)
+            self.assertEqual(
+                self.USPSZipCache.get_fresh('33141'), zip_cache
+            )
+
     def test_0020_address_validation_errors(self):
         """
         Test address validation usps errors
@@ -134,6 +150,554 @@ class TestAddressValidation(TestUSPSBase):
             })
             self.assertRaises(UserError, address.validate_address)
 
+    def test_0030_address_validation_offline_first(self):
+        """
+        Test address validation from the ZIP dataset
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            country_us, = self.Country.search([('code', '=', 'US')])
+            subdivision_florida, = self.CountrySubdivision.search(
+                [('code', '=', 'US-FL')]
+            )
+            subdivision_california, = self.CountrySubdivision.search(
+                [('code', '=', 'US-CA')]
+            )
+
+            fd, path = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            self.addCleanup(os.remove, path)
+            get_dataset(path).load(StringIO(
+                'zip,city,state\n'
+                '33141,Miami Beach,FL\n'
+            ))
+            self.USPSConfiguration.write([self.USPSConfiguration(1)], {
+                'offline_first': True,
+                'zip_dataset': path,
+            })
+
+            suggestions = self.Address(**{
+                'name': 'John Doe',
+                'street': '250 NE 25th St',
+                'streetbis': '',
+                'zip': '33141',
+                'city': 'Miami Beach',
+                'country': country_us.id,
+                'subdivision': subdivision_california.id,
+            }).validate_address()
+            self.assertEqual(len(suggestions), 1)
+            self.assertEqual(suggestions[0].city, 'MIAMI BEACH')
+            self.assertEqual(suggestions[0].subdivision, subdivision_florida)
+
+            # Answered without calling USPS
+            self.assertEqual(self.USPSZipCache.search([]), [])
+
+    def test_0040_bulk_address_validation(self):
+        """
+        Test the validation of many addresses at once
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            subdivision_florida, = self.CountrySubdivision.search(
+                [('code', '=', 'US-FL')]
+            )
+            values = self.get_address_values()
+            addresses = [
+                self.Address(**address_values)
+                for address_values in values + values[:1]
+            ]
+
+            results = self.Address.usps_validate_addresses(addresses)
+            self.assertEqual(len(results), 5)
+            self.assertEqual(results[0], True)
+            self.assertEqual(len(results[1]), 1)
+            self.assertEqual(results[1][0].subdivision, subdivision_florida)
+            self.assertTrue(isinstance(results[2], basestring))
+            self.assertEqual(
+                results[3], 'USPS address validation not available for India.'
+            )
+            self.assertEqual(results[4], True)
+
+    def test_0050_api_instance_memoization(self):
+        """
+        Test that the API instances are reused until the configuration
+        changes
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            config = self.USPSConfiguration(1)
+            city_state_lookup = config.get_api_instance_of(
+                'city_state_lookup'
+            )
+            self.assertTrue(
+                config.get_api_instance_of('city_state_lookup')
+                is city_state_lookup
+            )
+            self.assertTrue(
+                config.get_api_instance_of('address_val')
+                is not city_state_lookup
+            )
+            # Looked up in usps.zip.cache instead
+            self.assertEqual(city_state_lookup.cache, None)
+
+            self.USPSConfiguration.write([config], {'read_timeout': 10})
+            config = self.USPSConfiguration(1)
+            new_city_state_lookup = config.get_api_instance_of(
+                'city_state_lookup'
+            )
+            self.assertTrue(new_city_state_lookup is not city_state_lookup)
+            self.assertEqual(new_city_state_lookup.read_timeout, 10)
+            self.assertEqual(config.get_api_instance_of('unknown'), None)
+
+            # Nor once it is deleted, even if created again the same
+            self.USPSConfiguration.delete([config])
+            config, = self.USPSConfiguration.create([{
+                'username': 'XXXXXXX',
+                'password': 'XXXXXXX',
+                'is_test': True,
+                'read_timeout': 10,
+            }])
+            self.assertTrue(
+                config.get_api_instance_of('city_state_lookup')
+                is not new_city_state_lookup
+            )
+
+    def test_0060_subdivision_index(self):
+        """
+        Test the index of the subdivisions by USPS state code
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            country_us, = self.Country.search([('code', '=', 'US')])
+            subdivision_florida, = self.CountrySubdivision.search(
+                [('code', '=', 'US-FL')]
+            )
+            subdivision_california, = self.CountrySubdivision.search(
+                [('code', '=', 'US-CA')]
+            )
+            self.assertEqual(
+                self.CountrySubdivision.get_usps_index(), {
+                    'FL': subdivision_florida.id,
+                    'CA': subdivision_california.id,
+                }
+            )
+
+            address = self.Address(**{
+                'name': 'John Doe',
+                'street': '264 Stirling Road',
+                'streetbis': '',
+                'zip': '04864',
+                'city': 'Warren',
+                'country': country_us.id,
+                'subdivision': subdivision_california.id,
+            })
+            self.assertEqual(address.validate_address(), [])
+
+            # The index is refreshed when a subdivision is created
+            subdivision_maine, = self.CountrySubdivision.create([{
+                'name': 'Maine',
+                'code': 'US-ME',
+                'country': country_us.id,
+                'type': 'state'
+            }])
+            self.assertEqual(
+                self.CountrySubdivision.get_usps_subdivision('ME'),
+                subdivision_maine.id
+            )
+            suggestions = address.validate_address()
+            self.assertEqual(len(suggestions), 1)
+            self.assertEqual(suggestions[0].subdivision, subdivision_maine)
+
+            # Modified
+            self.CountrySubdivision.write([subdivision_maine], {
+                'code': 'US-MA',
+            })
+            self.assertEqual(
+                self.CountrySubdivision.get_usps_subdivision('ME'), None
+            )
+            self.assertEqual(
+                self.CountrySubdivision.get_usps_subdivision('MA'),
+                subdivision_maine.id
+            )
+
+            # And deleted
+            self.CountrySubdivision.delete([subdivision_maine])
+            self.assertEqual(
+                self.CountrySubdivision.get_usps_subdivision('MA'), None
+            )
+
+            # The codes of several subdivisions are left out
+            self.CountrySubdivision.create([{
+                'name': 'Florida (duplicate)',
+                'code': 'US-FL',
+                'country': country_us.id,
+                'type': 'state'
+            }])
+            self.assertEqual(
+                self.CountrySubdivision.get_usps_index(), {
+                    'CA': subdivision_california.id,
+                }
+            )
+
+    def test_0070_street_level_validation(self):
+        """
+        Test the validation of the street with AddressValidation
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            country_us, = self.Country.search([('code', '=', 'US')])
+            subdivision_maryland, = self.CountrySubdivision.create([{
+                'name': 'Maryland',
+                'code': 'US-MD',
+                'country': country_us.id,
+                'type': 'state'
+            }])
+            self.USPSConfiguration.write([self.USPSConfiguration(1)], {
+                'street_validation': True,
+            })
+
+            address = {
+                'name': 'John Doe',
+                'street': '6406 Ivy Lane',
+                'streetbis': '',
+                'zip': '20770',
+                'city': 'Greenbelt',
+                'country': country_us.id,
+                'subdivision': subdivision_maryland.id,
+            }
+            suggestions = self.Address(**address).validate_address()
+            self.assertEqual(len(suggestions), 1)
+            self.assertEqual(suggestions[0].street, '6406 IVY LN')
+            self.assertEqual(suggestions[0].city, 'GREENBELT')
+            self.assertEqual(suggestions[0].zip, '20770-1441')
+            self.assertEqual(suggestions[0].subdivision, subdivision_maryland)
+            self.assertEqual(len(self.USPSAddressCache.search([])), 1)
+
+            # The suggested address is valid
+            self.assertEqual(suggestions[0].validate_address(), True)
+            self.assertEqual(len(self.USPSAddressCache.search([])), 2)
+
+            # Equivalent addresses are served from the cache
+            results = self.Address.usps_validate_addresses([
+                self.Address(**dict(address, street=' 6406 ivy ln. ')),
+                self.Address(**dict(address, city='GREENBELT')),
+                self.Address(**dict(address, zip='XXXXX', city='')),
+            ])
+            self.assertEqual(results[0][0].zip, '20770-1441')
+            self.assertEqual(results[1][0].zip, '20770-1441')
+            self.assertTrue(isinstance(results[2], basestring))
+            self.assertEqual(len(self.USPSAddressCache.search([])), 3)
+
+    def test_0080_metrics(self):
+        """
+        Test the metrics of the USPS calls
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            country_us, = self.Country.search([('code', '=', 'US')])
+            subdivision_florida, = self.CountrySubdivision.search(
+                [('code', '=', 'US-FL')]
+            )
+            self.Address(**{
+                'name': 'John Doe',
+                'street': '250 NE 25th St',
+                'streetbis': '',
+                'zip': '33141',
+                'city': 'Miami Beach',
+                'country': country_us.id,
+                'subdivision': subdivision_florida.id,
+            }).validate_address()
+
+            metrics = self.USPSConfiguration.get_metrics()
+            self.assertTrue(
+                metrics['CityStateLookup']['timings']['parse']['count'] >= 1
+            )
+            self.assertTrue(
+                metrics['CityStateLookup']['outcomes']['valid'] >= 1
+            )
+            self.assertTrue(
+                '# TYPE usps_outcomes_total counter' in
+                self.USPSConfiguration.get_metrics_prometheus()
+            )
+
+            # Not recorded without the memory instrumentation
+            self.addCleanup(
+                setattr, BaseAPI, 'instrumentation', BaseAPI.instrumentation
+            )
+            BaseAPI.configure_instrumentation(None)
+            self.assertEqual(self.USPSConfiguration.get_metrics(), {})
+            self.assertEqual(
+                self.USPSConfiguration.get_metrics_prometheus(), ''
+            )
+
+    def test_0090_validation_fingerprint(self):
+        """
+        Test that the addresses found valid are not validated again while
+        they are unchanged and fresh
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            country_us, = self.Country.search([('code', '=', 'US')])
+            subdivision_maryland, = self.CountrySubdivision.create([{
+                'name': 'Maryland',
+                'code': 'US-MD',
+                'country': country_us.id,
+                'type': 'state'
+            }])
+            self.USPSConfiguration.write([self.USPSConfiguration(1)], {
+                'street_validation': True,
+            })
+            with Transaction().set_context(company=None):
+                party, = self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [('create', [{
+                        'name': 'John Doe',
+                        'street': '6406 IVY LN',
+                        'zip': '20770-1441',
+                        'city': 'GREENBELT',
+                        'country': country_us.id,
+                        'subdivision': subdivision_maryland.id,
+                    }, {
+                        'name': 'John Doe',
+                        'street': '6406 Ivy Lane',
+                        'zip': '20770',
+                        'city': 'Greenbelt',
+                        'country': country_us.id,
+                        'subdivision': subdivision_maryland.id,
+                    }])],
+                }])
+            valid, suggested = sorted(
+                party.addresses, key=lambda address: address.id
+            )
+
+            self.assertEqual(valid.usps_outcome, None)
+            self.assertEqual(valid._usps_address_validate(), True)
+            self.assertEqual(
+                self.Address.usps_validate_addresses([suggested])[0][0].zip,
+                '20770-1441'
+            )
+            valid = self.Address(valid.id)
+            suggested = self.Address(suggested.id)
+            self.assertEqual(valid.usps_outcome, 'valid')
+            self.assertTrue(valid.usps_validated_at)
+            self.assertTrue(
+                valid.usps_fingerprint.endswith(valid._usps_address_key())
+            )
+            self.assertEqual(suggested.usps_outcome, 'suggested')
+
+            # Fresh valid addresses are not sent to USPS nor looked up in
+            # the cache
+            self.USPSAddressCache.delete(self.USPSAddressCache.search([]))
+            self.assertEqual(
+                self.Address.usps_validate_addresses([valid, suggested])[0],
+                True
+            )
+            self.assertEqual(valid._usps_address_validate(), True)
+            self.assertEqual(len(self.USPSAddressCache.search([])), 1)
+
+            # Modified addresses are validated again
+            self.Address.write([valid], {'streetbis': 'Suite 4'})
+            valid = self.Address(valid.id)
+            self.assertEqual(len(valid._usps_address_validate()), 1)
+            self.assertEqual(len(self.USPSAddressCache.search([])), 2)
+
+            # As well as the addresses validated before the freshness window
+            self.Address.write([valid], {'streetbis': None})
+            valid = self.Address(valid.id)
+            self.assertEqual(valid._usps_address_validate(), True)
+            config = self.USPSConfiguration(1)
+            self.assertTrue(self.Address(valid.id)._usps_is_fresh(config))
+            self.Address.write([valid], {
+                'usps_validated_at': datetime.now() - timedelta(31),
+            })
+            self.assertFalse(self.Address(valid.id)._usps_is_fresh(config))
+
+            # Or all of them without freshness
+            self.Address.write([valid], {'usps_validated_at': datetime.now()})
+            self.USPSConfiguration.write([config], {
+                'validation_freshness': None,
+            })
+            self.assertFalse(self.Address(valid.id)._usps_is_fresh(
+                self.USPSConfiguration(1)
+            ))
+
+    def test_0100_differences(self):
+        """
+        Test the comparison of the addresses with the suggested values
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            country_us, = self.Country.search([('code', '=', 'US')])
+            subdivision_florida, = self.CountrySubdivision.search(
+                [('code', '=', 'US-FL')]
+            )
+            subdivision_california, = self.CountrySubdivision.search(
+                [('code', '=', 'US-CA')]
+            )
+            address = self.Address(
+                name='John Doe',
+                street='250 NE 25th St',
+                streetbis=None,
+                zip='33141',
+                city='Miami Beach',
+                country=country_us,
+                subdivision=subdivision_florida,
+            )
+
+            self.assertEqual(address.usps_differences({
+                'streetbis': '',
+                'city': 'MIAMI BEACH',
+                'zip': '33141',
+                'subdivision': subdivision_florida,
+            }), [])
+            self.assertEqual(address.usps_differences({
+                'street': '250 NE 25TH ST',
+                'city': 'MIAMI',
+                'zip': '33141-1234',
+                'subdivision': subdivision_california,
+            }), ['city', 'zip', 'subdivision'])
+
+            suggestion = address._usps_suggestion({'zip': '33141-1234'})
+            self.assertEqual(suggestion.zip, '33141-1234')
+            self.assertEqual(suggestion.city, 'Miami Beach')
+            self.assertEqual(suggestion.subdivision, subdivision_florida)
+
+            # A suggested ZIP5 keeps the ZIP4 of the address
+            address.zip = '33141-1234'
+            self.assertEqual(address.usps_differences({
+                'city': 'MIAMI',
+                'zip': '33141',
+            }), ['city'])
+            self.assertEqual(address.usps_differences({
+                'zip': '33141-4321',
+            }), ['zip'])
+            suggestion = address._usps_suggestion({
+                'city': 'MIAMI',
+                'zip': '33141',
+            })
+            self.assertEqual(suggestion.zip, '33141-1234')
+            self.assertEqual(suggestion.city, 'MIAMI')
+            self.assertEqual(
+                address._usps_suggest(self.USPSZipCache(
+                    zip5='33141', city='Miami Beach', state='FL',
+                    subdivision=subdivision_florida, error=None,
+                )), True
+            )
+
+    def test_0110_invalid_zip(self):
+        """
+        Test that the addresses without a valid ZIP fail alone
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            correct_address = self.get_address_values()[0]
+            results = self.Address.usps_validate_addresses([
+                self.Address(**correct_address),
+                self.Address(**dict(correct_address, zip=None)),
+                self.Address(**dict(correct_address, zip='')),
+                self.Address(**dict(correct_address, zip='XXXXX')),
+            ])
+            self.assertEqual(results, [
+                True,
+                'The ZIP code "" is not valid.',
+                'The ZIP code "" is not valid.',
+                'The ZIP code "XXXXX" is not valid.',
+            ])
+            self.assertEqual(
+                [lookup.zip5 for lookup in self.USPSZipCache.search([])],
+                ['33141']
+            )
+
+            address = self.Address(**dict(correct_address, zip=None))
+            self.assertRaises(UserError, address.validate_address)
+
+    def test_0120_street_validation_unavailable(self):
+        """
+        Test the street level validation while USPS is not available
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            country_us, = self.Country.search([('code', '=', 'US')])
+            subdivision_maryland, = self.CountrySubdivision.create([{
+                'name': 'Maryland',
+                'code': 'US-MD',
+                'country': country_us.id,
+                'type': 'state'
+            }])
+            self.USPSConfiguration.write([self.USPSConfiguration(1)], {
+                'street_validation': True,
+            })
+            values = {
+                'name': 'John Doe',
+                'street': '6406 Ivy Lane',
+                'streetbis': '',
+                'zip': '20770',
+                'city': 'Greenbelt',
+                'country': country_us.id,
+                'subdivision': subdivision_maryland.id,
+            }
+            address = self.Address(**values)
+            address.validate_address()
+            validation, = self.USPSAddressCache.search([])
+            expired = datetime.now() - timedelta(days=1000)
+            self.USPSAddressCache.write([validation], {
+                'fetched_at': expired,
+            })
+
+            # The expired validations are used while USPS is not available
+            self.usps_server.server_error_rate = 1
+            suggestions = address.validate_address()
+            self.assertEqual(suggestions[0].zip, '20770-1441')
+            other_address = self.Address(**dict(values, street='8 Ivy Lane'))
+            self.assertRaises(UserError, other_address.validate_address)
+
+            # And refreshed once it is available again
+            self.usps_server.server_error_rate = 0
+            address.validate_address()
+            self.assertEqual(
+                self.USPSAddressCache.search([]), [validation]
+            )
+            self.assertTrue(
+                self.USPSAddressCache(validation.id).fetched_at > expired
+            )
+
+    def test_0130_city_state_lookup_unavailable(self):
+        """
+        Test the city/state validation while USPS is not available
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            values = self.get_address_values()[1]
+            address = self.Address(**values)
+            address.validate_address()
+            lookup, = self.USPSZipCache.search([])
+            expired = datetime.now() - timedelta(days=1000)
+            self.USPSZipCache.write([lookup], {'fetched_at': expired})
+
+            # The expired lookups are used while USPS is not available
+            self.usps_server.server_error_rate = 1
+            suggestions = address.validate_address()
+            self.assertEqual(suggestions[0].city, 'MIAMI BEACH')
+            other_address = self.Address(**dict(values, zip='90210'))
+            self.assertRaises(UserError, other_address.validate_address)
+
+            # And refreshed once it is available again
+            self.usps_server.server_error_rate = 0
+            address.validate_address()
+            self.assertEqual(self.USPSZipCache.search([]), [lookup])
+            self.assertTrue(self.USPSZipCache(lookup.id).fetched_at > expired)
+
 
 def suite():
     suite = trytond.tests.test_tryton.suite()
@@ -8,6 +8,7 @@
 import os
 import unittest
 
+from usps.api import BaseAPI
 from usps.address_validation import AddressValidation
 from usps.city_state_lookup import CityStateLookup
 from usps.exceptions import USPSInvalidAddress, USPSInvalidZip5
@@ -82,6 +83,23 @@ class TestUSPSApi(unittest.TestCase):
             address_validation_type
         )
 
+    def test_025_address_validation_many(self):
+        "Test the validation of more addresses than fit in one request"
+        addresses = [{
+            'Address1': '6406 Ivy Lane',
+            'City': 'Greenbelt',
+            'State': 'MD',
+            'Zip5': '20770',
+        }] * 6
+        addresses.insert(2, {'FirmName': 'John Doe', 'Zip5': '06371'})
+
+        results = self.address_validation.validate_many(addresses)
+        self.assertEqual(len(results), 7)
+        self.assertTrue(isinstance(results[2], USPSInvalidAddress))
+        for index in (0, 1, 3, 4, 5, 6):
+            self.assertEqual(results[index].Zip5, '20770')
+            self.assertEqual(results[index].Zip4, '1441')
+
     def test_030_city_state_lookup(self):
         "Test the city state lookup"
         zipcode_request_type = CityStateLookup.zipcode_request_type(
@@ -104,6 +122,57 @@ class TestUSPSApi(unittest.TestCase):
             zipcode_request_type
         )
 
+    def test_040_connection_reuse(self):
+        "Test that the connections are reused across API instances"
+        BaseAPI.configure_pool(pool_maxsize=2)
+        for zip5 in ("20770", "90210"):
+            self.city_state_lookup.request(
+                CityStateLookup.zipcode_request_type(Zip5=zip5)
+            )
+            CityStateLookup(
+                os.environ['USPS_USERNAME'],
+                os.environ['USPS_PASSWORD'],
+                True
+            ).request(CityStateLookup.zipcode_request_type(Zip5=zip5))
+
+        stats = BaseAPI.connection_stats()
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 3)
+
+    def test_050_city_state_lookup_many(self):
+        "Test the lookup of more ZIP5 codes than fit in one request"
+        zips = [
+            "20770", "90210", "2A77", "33141", "20770", "04864", "94301"
+        ]
+
+        results = self.city_state_lookup.lookup_many(zips)
+        self.assertEqual(len(results), 6)
+        self.assertTrue(isinstance(results["2A77"], USPSInvalidZip5))
+        self.assertEqual(results["20770"].City, 'GREENBELT')
+        self.assertEqual(results["90210"].State, 'CA')
+        self.assertEqual(results["94301"].Zip5, '94301')
+
+    def test_060_async_requests(self):
+        "Test the asynchronous requests"
+        futures = [
+            self.city_state_lookup.lookup_async("20770"),
+            self.city_state_lookup.lookup_async("2A77"),
+            self.city_state_lookup.request_async(
+                CityStateLookup.zipcode_request_type(Zip5="90210")
+            ),
+            self.address_validation.request_async(
+                AddressValidation.address_request_type(
+                    Address1='6406 Ivy Lane', Zip5="20770"
+                )
+            ),
+        ]
+
+        self.assertEqual(futures[0].result().City, 'GREENBELT')
+        self.assertRaises(USPSInvalidZip5, futures[1].result)
+        self.assertEqual(futures[2].result().ZipCode.State, 'CA')
+        self.assertEqual(futures[3].result().Address.Zip4, 1441)
+
 
 def suite():
     "Create a test suite and return it for better manageability"
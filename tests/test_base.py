@@ -22,6 +22,11 @@ from trytond.transaction import Transaction
 from trytond.config import CONFIG
 CONFIG['data_path'] = '.'
 
+# The API classes used by the module, not the ones of the usps package at the
+# root of the repository
+from trytond.modules.shipping_usps.usps.api import BaseAPI
+from trytond.modules.shipping_usps.usps.testing import FakeUSPSServer
+
 
 class TestUSPSBase(unittest.TestCase):
     """Test USPS Integration
@@ -31,6 +36,8 @@ class TestUSPSBase(unittest.TestCase):
         trytond.tests.test_tryton.install_module('shipping_usps')
         self.Address = POOL.get('party.address')
         self.USPSConfiguration = POOL.get('usps.configuration')
+        self.USPSZipCache = POOL.get('usps.zip.cache')
+        self.USPSAddressCache = POOL.get('usps.address.cache')
         self.CarrierConfig = POOL.get('carrier.configuration')
         self.Party = POOL.get('party.party')
         self.PartyContact = POOL.get('party.contact_mechanism')
@@ -40,10 +47,11 @@ class TestUSPSBase(unittest.TestCase):
         self.Company = POOL.get('company.company')
         self.User = POOL.get('res.user')
 
-        assert 'USPS_USERNAME' in os.environ, \
-            "USPS_USERNAME not given. Hint:Use export USPS_USERNAME=<username>"
-        assert 'USPS_PASSWORD' in os.environ, \
-            "USPS_PASSWORD not given. Hint:Use export USPS_PASSWORD=<password>"
+        # Validate against a local fake USPS server
+        self.usps_server = FakeUSPSServer().start()
+        self.addCleanup(self.usps_server.stop)
+        self.addCleanup(setattr, BaseAPI, 'urls', BaseAPI.urls)
+        BaseAPI.urls = self.usps_server.urls
 
     def setup_defaults(self):
         """Method to setup defaults
@@ -95,8 +103,8 @@ class TestUSPSBase(unittest.TestCase):
 
         # USPS Configuration
         self.USPSConfiguration.create([{
-            'username': os.environ['USPS_USERNAME'],
-            'password': os.environ['USPS_PASSWORD'],
+            'username': 'XXXXXXX',
+            'password': 'XXXXXXX',
             'is_test': True,
         }])
         self.CarrierConfig.create([{
@@ -127,3 +135,55 @@ class TestUSPSBase(unittest.TestCase):
         )
 
         CONTEXT.update(self.User.get_preferences(context_only=True))
+
+    def poison_addresses(self, addresses):
+        """
+        Makes the validation of the addresses raise a ValueError until the
+        end of the test
+        """
+        ids = set(map(int, addresses))
+        is_fresh = self.Address._usps_is_fresh
+
+        def poisoned(address, config):
+            if address.id in ids:
+                raise ValueError('Poisoned address')
+            return is_fresh(address, config)
+        self.Address._usps_is_fresh = poisoned
+        self.addCleanup(delattr, self.Address, '_usps_is_fresh')
+
+    def get_address_values(self):
+        """
+        Returns the values of a correct address in Florida, followed by the
+        values of the same address in California, with a wrong ZIP and in
+        India
+        """
+        country_in, = self.Country.create([{
+            'name': 'India',
+            'code': 'IN',
+        }])
+        country_us, = self.Country.search([('code', '=', 'US')])
+        subdivision_florida, = self.CountrySubdivision.search(
+            [('code', '=', 'US-FL')]
+        )
+        subdivision_california, = self.CountrySubdivision.search(
+            [('code', '=', 'US-CA')]
+        )
+
+        correct_address = {
+            'name': 'John Doe',
+            'street': '250 NE 25th St',
+            'streetbis': '',
+            'zip': '33141',
+            'city': 'Miami Beach',
+            'country': country_us.id,
+            'subdivision': subdivision_florida.id,
+        }
+        return [
+            correct_address,
+            dict(correct_address, subdivision=subdivision_california.id),
+            dict(correct_address, zip='XXXXX'),
+            dict(
+                correct_address, zip='110006', country=country_in.id,
+                subdivision=None,
+            ),
+        ]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_breaker.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from usps.api import BaseAPI
+from usps.breaker import CircuitBreaker
+from usps.exceptions import USPSServiceUnavailable
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """
+    Test the timeouts, retries and circuit breaker of the USPS API
+    """
+
+    def setUp(self):
+        self.addCleanup(BaseAPI._breakers.clear)
+
+    def test_010_breaker(self):
+        "Test the opening and closing of the circuit breaker"
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.before_request()
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+        self.assertRaises(USPSServiceUnavailable, breaker.before_request)
+
+        # Trial request after the cool down
+        breaker.cooldown = 0
+        breaker.before_request()
+        breaker.record_success()
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_020_disabled_breaker(self):
+        "Test that a breaker without threshold never opens"
+        breaker = CircuitBreaker(threshold=0)
+        for i in xrange(10):
+            breaker.before_request()
+            breaker.record_failure()
+        self.assertFalse(breaker.is_open)
+
+        # Even if it was opened
+        breaker.opened_at = breaker.failures = 1
+        breaker.before_request()
+
+    def test_030_unreachable(self):
+        "Test the requests to an unreachable USPS"
+        api = BaseAPI(
+            'username', 'password', connect_timeout=1, max_retries=1,
+            breaker_threshold=2, breaker_cooldown=60,
+        )
+        api.retry_backoff = 0
+        url = 'http://127.0.0.1:1/ShippingAPI.dll'
+
+        for i in xrange(2):
+            self.assertRaises(
+                USPSServiceUnavailable, api.send_request, url,
+                'CityStateLookup', '<CityStateLookupRequest/>'
+            )
+        self.assertTrue(api.get_breaker(url).is_open)
+        self.assertRaises(
+            USPSServiceUnavailable, api.send_request, url,
+            'CityStateLookup', '<CityStateLookupRequest/>'
+        )
+
+        # The instances with other settings have their own breaker
+        other_api = BaseAPI('username', 'password', breaker_threshold=0)
+        self.assertFalse(other_api.get_breaker(url).is_open)
+        self.assertEqual(api.get_breaker(url).threshold, 2)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestCircuitBreaker)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
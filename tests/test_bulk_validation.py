@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_bulk_validation.py
+
+    Runs the bulk validation of address files against the local fake USPS
+    server
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from usps.api import BaseAPI
+from usps.bulk_validation import main, OUTPUT_COLUMNS
+from usps.testing import FakeUSPSServer
+
+
+class TestBulkValidation(unittest.TestCase):
+    """
+    Test the validation of address files
+    """
+
+    def setUp(self):
+        self.server = FakeUSPSServer().start()
+        self.addCleanup(self.server.stop)
+        self.addCleanup(
+            BaseAPI.configure_concurrency, BaseAPI.max_concurrency
+        )
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stderr = StringIO()
+        self.addCleanup(setattr, sys, 'stderr', sys.stderr)
+        sys.stderr = self.stderr
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def validate(self, *args):
+        main([
+            '--url', self.server.url, '--username', 'XXXXXXX',
+            '--concurrency', '3',
+        ] + list(args))
+
+    def test_010_csv(self):
+        "Test the validation of a CSV file, in input order"
+        with open(self.path('input.csv'), 'wb') as input_file:
+            writer = csv.writer(input_file)
+            writer.writerow(['id', 'street', 'Zip5'])
+            for number in xrange(1, 24):
+                writer.writerow([
+                    number, '%d Ivy Lane' % number,
+                    '99999' if number % 7 == 0 else '20770',
+                ])
+
+        self.validate(
+            self.path('input.csv'), self.path('output.csv'),
+            '--column', 'Address2=street', '--progress', '10',
+        )
+
+        with open(self.path('output.csv'), 'rb') as output_file:
+            rows = list(csv.DictReader(output_file))
+            output_file.seek(0)
+            header = next(csv.reader(output_file))
+        self.assertEqual(header, ['id', 'street', 'Zip5'] + list(
+            OUTPUT_COLUMNS
+        ))
+        self.assertEqual(
+            [row['id'] for row in rows], [str(n) for n in xrange(1, 24)]
+        )
+        for row in rows:
+            if int(row['id']) % 7 == 0:
+                self.assertTrue(row['usps_error'])
+                self.assertEqual(row['usps_zip5'], '')
+            else:
+                self.assertEqual(row['usps_error'], '')
+                self.assertEqual(
+                    row['usps_address2'], '%s IVY LN' % row['id']
+                )
+                self.assertEqual(row['usps_city'], 'GREENBELT')
+                self.assertEqual(len(row['usps_zip4']), 4)
+        # 23 rows in batches of 5
+        self.assertEqual(self.server.requests, 5)
+
+        progress = self.stderr.getvalue().splitlines()
+        self.assertEqual(len(progress), 3)
+        self.assertTrue(progress[0].startswith('Validated 10 rows'))
+        self.assertTrue(
+            progress[-1].startswith('Validated 23 rows (3 invalid)')
+        )
+        self.assertTrue(progress[-1].endswith('--resume-from 23'))
+
+    def test_020_jsonl_resume(self):
+        "Test resuming the validation of a JSON lines file"
+        with open(self.path('input.jsonl'), 'wb') as input_file:
+            for number in xrange(1, 13):
+                input_file.write(json.dumps({
+                    'id': number,
+                    'Address2': '%d Ivy Lane' % number,
+                    'Zip5': 20770,
+                }) + '\n')
+        with open(self.path('output.jsonl'), 'wb') as output_file:
+            output_file.write('{"id": 0}\n')
+
+        self.validate(
+            self.path('input.jsonl'), self.path('output.jsonl'),
+            '--resume-from', '7',
+        )
+
+        with open(self.path('output.jsonl'), 'rb') as output_file:
+            rows = [json.loads(line) for line in output_file]
+        self.assertEqual(
+            [row['id'] for row in rows], [0, 8, 9, 10, 11, 12]
+        )
+        self.assertEqual(rows[1]['usps_address2'], '8 IVY LN')
+        self.assertEqual(rows[1]['usps_zip5'], '20770')
+        self.assertEqual(rows[1]['usps_error'], None)
+        self.assertTrue(
+            self.stderr.getvalue().endswith('--resume-from 12\n')
+        )
+
+    def test_030_stopped(self):
+        "Test that an unavailable USPS stops the validation"
+        self.server.server_error_rate = 1
+        with open(self.path('input.csv'), 'wb') as input_file:
+            input_file.write('Address2,Zip5\n6406 Ivy Lane,20770\n')
+
+        with self.assertRaises(SystemExit):
+            self.validate(
+                self.path('input.csv'), self.path('output.csv'),
+                '--resume-from', '0',
+            )
+        self.assertTrue(self.stderr.getvalue().startswith('Stopped ('))
+        self.assertTrue(
+            self.stderr.getvalue().endswith('--resume-from 0\n')
+        )
+
+    def test_040_arguments(self):
+        "Test the handling of the command line arguments"
+        with open(self.path('input'), 'wb') as input_file:
+            input_file.write('street,zip\n6406 Ivy Lane,20770\n')
+
+        errors = [
+            (['--username', 'XXXXXXX', '--column', 'Street=street'],
+                "Invalid column 'Street=street'"),
+            (['--username', 'XXXXXXX', '--column', 'Address2'],
+                "Invalid column 'Address2'"),
+            (['--username', ''], '--username or USPS_USERNAME is required'),
+        ]
+        for args, error in errors:
+            self.stderr.truncate(0)
+            with self.assertRaises(SystemExit) as context:
+                main([self.path('input'), self.path('output')] + args)
+            self.assertEqual(context.exception.code, 2)
+            self.assertTrue(
+                error in self.stderr.getvalue().splitlines()[-1]
+            )
+        self.assertFalse(os.path.exists(self.path('output')))
+
+        # The username defaults to USPS_USERNAME and the format of files
+        # without extension to CSV
+        if 'USPS_USERNAME' in os.environ:
+            self.addCleanup(
+                os.environ.__setitem__, 'USPS_USERNAME',
+                os.environ['USPS_USERNAME']
+            )
+        self.addCleanup(os.environ.pop, 'USPS_USERNAME', None)
+        os.environ['USPS_USERNAME'] = 'XXXXXXX'
+        main([
+            self.path('input'), self.path('output'), '--url', self.server.url,
+            '--column', 'Address2=street', '--column', 'Zip5=zip',
+        ])
+        with open(self.path('output'), 'rb') as output_file:
+            row, = csv.DictReader(output_file)
+        self.assertEqual(row['usps_address2'], '6406 IVY LN')
+        self.assertEqual(row['usps_zip4'], '1441')
+
+    def test_050_invalid_rows(self):
+        "Test that the rows which can not be sent fail alone"
+        with open(self.path('input.csv'), 'wb') as input_file:
+            input_file.write(
+                'Address2,Zip5\n'
+                '6406 Ivy Lane,20770\n'
+                '6406 Ivy\x01Lane,20770\n'
+                '6406 Ivy \xff Lane,20770\n'
+                '8 Ivy Lane,20770\n'
+            )
+
+        self.validate(self.path('input.csv'), self.path('output.csv'))
+
+        with open(self.path('output.csv'), 'rb') as output_file:
+            rows = list(csv.DictReader(output_file))
+        self.assertEqual(
+            [row['usps_address2'] for row in rows],
+            ['6406 IVY LN', '', '', '8 IVY LN']
+        )
+        self.assertTrue('control characters' in rows[1]['usps_error'])
+        self.assertTrue('utf8' in rows[2]['usps_error'])
+        self.assertEqual(rows[2]['Address2'], '6406 Ivy \xff Lane')
+        self.assertEqual(self.server.requests, 1)
+        self.assertTrue(
+            self.stderr.getvalue().startswith('Validated 4 rows (2 invalid)')
+        )
+
+    def test_060_unexpected_error(self):
+        "Test that the progress is reported after an unexpected error"
+        with open(self.path('input.csv'), 'wb') as input_file:
+            input_file.write('Address2,Zip5\xff\n6406 Ivy Lane,20770\n')
+
+        self.assertRaises(
+            UnicodeDecodeError, self.validate,
+            self.path('input.csv'), self.path('output.csv'),
+        )
+        self.assertTrue(self.stderr.getvalue().startswith(
+            'Stopped (unexpected error) after 0 rows'
+        ))
+        self.assertTrue(
+            self.stderr.getvalue().endswith('--resume-from 0\n')
+        )
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestBulkValidation)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
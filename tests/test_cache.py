@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_cache.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from usps.cache import LRUCache
+from usps.exceptions import USPSInvalidZip5
+
+
+class TestLRUCache(unittest.TestCase):
+    """
+    Test the cache of the USPS API results
+    """
+
+    def test_010_get_set(self):
+        "Test the hits and misses of the cache"
+        cache = LRUCache(maxsize=10)
+        invalid_zip = USPSInvalidZip5('Invalid Zip Code.')
+
+        self.assertEqual(cache.get('20770'), None)
+        cache.set('20770', 'GREENBELT')
+        cache.set('2A77', invalid_zip)
+        self.assertEqual(cache.get('20770'), 'GREENBELT')
+        self.assertTrue(cache.get('2A77') is invalid_zip)
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 2)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    def test_020_eviction(self):
+        "Test that the least recently used entry is evicted"
+        cache = LRUCache(maxsize=2)
+        cache.set('20770', 'GREENBELT')
+        cache.set('90210', 'BEVERLY HILLS')
+        cache.get('20770')
+        cache.set('33141', 'MIAMI BEACH')
+
+        self.assertEqual(cache.get('90210'), None)
+        self.assertEqual(cache.get('20770'), 'GREENBELT')
+        self.assertEqual(cache.get('33141'), 'MIAMI BEACH')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_030_expiry(self):
+        "Test that the entries expire after the ttl"
+        cache = LRUCache(ttl=0)
+        cache.set('20770', 'GREENBELT')
+        self.assertEqual(cache.get('20770'), None)
+        self.assertEqual(cache.get('20770', stale=True), 'GREENBELT')
+
+        cache = LRUCache(ttl=None)
+        cache.set('20770', 'GREENBELT')
+        self.assertEqual(cache.get('20770'), 'GREENBELT')
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLRUCache)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_fake_server.py
+
+    Runs the API against the local fake USPS server
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import time
+import unittest
+
+from usps.api import BaseAPI
+from usps.address_validation import AddressValidation
+from usps.city_state_lookup import CityStateLookup
+from usps.exceptions import USPSException, USPSInvalidAddress, \
+    USPSInvalidZip5, USPSServiceUnavailable
+from usps.testing import FakeUSPSServer
+
+
+class TestFakeServer(unittest.TestCase):
+    """
+    Test the API with the fake USPS server
+    """
+
+    def setUp(self):
+        self.server = FakeUSPSServer().start()
+        self.addCleanup(self.server.stop)
+        self.address_validation = self.make_api(AddressValidation)
+        self.city_state_lookup = self.make_api(CityStateLookup, cache=None)
+
+    def make_api(self, api_class, **kwargs):
+        api = api_class(
+            'XXXXXXX', '', max_retries=1, breaker_threshold=0, **kwargs
+        )
+        api.urls = self.server.urls
+        api.retry_backoff = 0
+        return api
+
+    def test_010_address_validation(self):
+        "Test the validation of addresses"
+        response = self.address_validation.request(
+            AddressValidation.address_request_type(
+                Address1='Suite 4', Address2='6406 Ivy Lane', Zip5='20770'
+            )
+        )
+        self.assertEqual(response.Address.Address1, 'STE 4')
+        self.assertEqual(response.Address.Address2, '6406 IVY LN')
+        self.assertEqual(response.Address.City, 'GREENBELT')
+        self.assertEqual(response.Address.State, 'MD')
+        self.assertEqual(response.Address.Zip4, 1441)
+
+        self.assertRaises(
+            USPSInvalidAddress, self.address_validation.request,
+            AddressValidation.address_request_type(
+                FirmName='John Doe', Zip5='06371'
+            )
+        )
+
+        results = self.address_validation.validate_many([
+            {'Address2': '%d Ivy Lane' % number, 'Zip5': '20770'}
+            for number in xrange(12)
+        ] + [{'Address2': '6406 Ivy Lane', 'Zip5': '00000'}])
+        self.assertEqual(len(results), 13)
+        self.assertEqual(results[11].Address2, '11 IVY LN')
+        self.assertEqual(len(results[11].Zip4), 4)
+        self.assertTrue(isinstance(results[12], USPSInvalidAddress))
+        self.assertEqual(self.server.requests, 5)
+
+    def test_020_city_state_lookup(self):
+        "Test the lookup of ZIP codes"
+        self.assertEqual(self.city_state_lookup.lookup('90210').State, 'CA')
+        self.assertRaises(
+            USPSInvalidZip5, self.city_state_lookup.lookup, '2A77'
+        )
+        response = self.city_state_lookup.request(
+            CityStateLookup.zipcode_request_type(Zip5='33141')
+        )
+        self.assertEqual(response.ZipCode.City, 'MIAMI BEACH')
+
+        self.server.resolve_any = True
+        results = self.city_state_lookup.lookup_many(
+            '%05d' % number for number in xrange(10)
+        )
+        self.assertEqual(results['00007'].City, 'ZIP 00007')
+
+    def test_030_connection_reuse(self):
+        "Test that the connections to the server are reused"
+        BaseAPI.configure_pool()
+        for zip5 in ('20770', '90210', '20770', '90210'):
+            self.city_state_lookup.lookup(zip5)
+        stats = BaseAPI.connection_stats()
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['connections'], 1)
+
+    def test_040_error_injection(self):
+        "Test the errors injected by the server"
+        self.server.error_rate = 1
+        self.assertRaises(
+            USPSException, self.city_state_lookup.lookup, '20770'
+        )
+
+        self.server.error_rate = 0
+        self.server.server_error_rate = 1
+        self.assertRaises(
+            USPSServiceUnavailable, self.city_state_lookup.lookup, '20770'
+        )
+        # The request was retried once
+        self.assertEqual(self.server.requests, 3)
+
+    def test_050_latency(self):
+        "Test the latency of the server"
+        self.server.latency = 0.1
+        start = time.time()
+        self.city_state_lookup.lookup('20770')
+        self.assertTrue(time.time() - start >= 0.1)
+
+        self.city_state_lookup.read_timeout = 0.05
+        self.assertRaises(
+            USPSServiceUnavailable, self.city_state_lookup.lookup, '90210'
+        )
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestFakeServer)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_instrumentation.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+import urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+from lxml import etree
+
+from usps.api import BaseAPI
+from usps.city_state_lookup import CityStateLookup
+from usps.exceptions import USPSException, USPSServiceUnavailable
+from usps.instrumentation import Histogram, MemoryInstrumentation
+from usps.singleflight import SingleFlight
+
+ERROR = (
+    '<Error><Number>-2147219399</Number><Source>WebtoolsAMS</Source>'
+    '<Description>Invalid Zip Code.</Description></Error>'
+)
+
+
+def reset_shared_state(test_case):
+    """
+    Gives the API instances fresh circuit breakers, rate limiters, calls in
+    flight and instrumentation, restored once the test case is done
+    """
+    for name, value in (
+            ('_breakers', {}),
+            ('_rate_limiters', {}),
+            ('_in_flight', SingleFlight()),
+            ('instrumentation', MemoryInstrumentation())):
+        test_case.addCleanup(setattr, BaseAPI, name, getattr(BaseAPI, name))
+        setattr(BaseAPI, name, value)
+
+
+class FakeAdapter(BaseAdapter):
+    "Answers the CityStateLookup requests with the given status"
+
+    def __init__(self, status_code=200, error=False):
+        super(FakeAdapter, self).__init__()
+        self.status_code = status_code
+        self.error = error
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.request = request
+        response.url = request.url
+        if self.error:
+            response._content = ERROR
+            return response
+        query = urlparse.parse_qs(urlparse.urlparse(request.url).query)
+        items = []
+        for zipcode in etree.fromstring(query['XML'][0]):
+            zip5 = zipcode.findtext('Zip5')
+            if zip5 == '20770':
+                items.append(
+                    '<ZipCode ID="%s"><Zip5>20770</Zip5><City>GREENBELT'
+                    '</City><State>MD</State></ZipCode>' % zipcode.get('ID')
+                )
+            else:
+                items.append('<ZipCode ID="%s">%s</ZipCode>' % (
+                    zipcode.get('ID'), ERROR
+                ))
+        response._content = (
+            '<CityStateLookupResponse>%s</CityStateLookupResponse>' % (
+                ''.join(items)
+            )
+        )
+        return response
+
+    def close(self):
+        pass
+
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Test the instrumentation of the USPS calls
+    """
+
+    def setUp(self):
+        reset_shared_state(self)
+
+    def make_api(self, adapter):
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        api = CityStateLookup(
+            'XXXXXXX', '', cache=None, max_retries=2, breaker_threshold=0
+        )
+        api.get_session = lambda: session
+        api.retry_backoff = 0
+        api.instrumentation = MemoryInstrumentation()
+        return api
+
+    def test_010_histogram(self):
+        "Test the buckets of the histograms"
+        histogram = Histogram([1, 5])
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(
+            histogram.cumulative_counts(), [(1, 2), (5, 3), ('+Inf', 4)]
+        )
+        self.assertEqual(histogram.sum, 14.5)
+        self.assertEqual(histogram.count, 4)
+
+    def test_020_successful_call(self):
+        "Test the recording of a successful call"
+        api = self.make_api(FakeAdapter())
+        api.lookup_many(['20770', '99999', '99998'])
+
+        metrics = api.instrumentation.snapshot()['CityStateLookup']
+        self.assertEqual(metrics['outcomes'], {
+            'success': 1,
+            'valid': 1,
+            'invalid': 2,
+        })
+        self.assertEqual(
+            sorted(metrics['timings']), ['connect', 'parse', 'transfer']
+        )
+        for timing in metrics['timings'].itervalues():
+            self.assertEqual(timing['count'], 1)
+        self.assertEqual(metrics['sizes']['request']['count'], 1)
+        self.assertTrue(metrics['sizes']['response']['sum'] > 0)
+
+        prometheus = api.instrumentation.to_prometheus()
+        self.assertTrue(
+            'usps_outcomes_total{api="CityStateLookup",outcome="invalid"} 2'
+            in prometheus.splitlines()
+        )
+        self.assertTrue(
+            'usps_request_duration_seconds_count{api="CityStateLookup",'
+            'phase="parse"} 1' in prometheus.splitlines()
+        )
+        self.assertTrue(
+            '# TYPE usps_payload_size_bytes histogram'
+            in prometheus.splitlines()
+        )
+
+    def test_030_failed_calls(self):
+        "Test the recording of the failed calls"
+        api = self.make_api(FakeAdapter(error=True))
+        self.assertRaises(USPSException, api.lookup_many, ['20770'])
+        self.assertEqual(
+            api.instrumentation.snapshot()['CityStateLookup']['outcomes'], {
+                'success': 1,
+                'error': 1,
+            }
+        )
+
+        api = self.make_api(FakeAdapter(status_code=503))
+        self.assertRaises(USPSServiceUnavailable, api.lookup_many, ['20770'])
+        metrics = api.instrumentation.snapshot()['CityStateLookup']
+        self.assertEqual(metrics['outcomes'], {
+            'retry': 2,
+            'unavailable': 1,
+        })
+        self.assertEqual(metrics['timings'], {})
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestInstrumentation)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_normalize.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from lxml import etree
+
+from usps.address_validation import AddressValidation
+from usps.city_state_lookup import CityStateLookup
+from usps.cache import LRUCache
+from usps.normalize import (
+    canonical_key, is_zip5, normalize_street, normalize_zip5, split_zip
+)
+
+
+class RecordingAddressValidation(AddressValidation):
+    "Answers the requests by echoing the addresses sent"
+
+    def _send_addresses(self, addresses_xml, priority=None):
+        self.requests.append(addresses_xml)
+        return '<AddressValidateResponse>%s</AddressValidateResponse>' % (
+            ''.join(addresses_xml)
+        )
+
+
+class RecordingCityStateLookup(CityStateLookup):
+    "Answers the requests with the same city for all the ZIP codes"
+
+    def _send_zipcodes(self, zipcodes_xml, priority=None):
+        self.requests.append(zipcodes_xml)
+        return '<CityStateLookupResponse>%s</CityStateLookupResponse>' % (
+            ''.join(
+                '<ZipCode ID="%s"><Zip5>%s</Zip5><City>GREENBELT</City>'
+                '<State>MD</State></ZipCode>' % (
+                    zipcode.get('ID'), zipcode.findtext('Zip5')
+                ) for zipcode in map(etree.fromstring, zipcodes_xml)
+            )
+        )
+
+
+class TestNormalize(unittest.TestCase):
+    """
+    Test the normalization of the addresses
+    """
+
+    def test_010_normalize_street(self):
+        "Test the normalization of street lines"
+        for value, expected in [
+            (u'6406 Ivy Lane', u'6406 IVY LN'),
+            (u' 6406  ivy ln. ', u'6406 IVY LN'),
+            (u'6406 North Ivy Lane South', u'6406 N IVY LN S'),
+            (u'6406 Ivy Lane, Suite 4', u'6406 IVY LN STE 4'),
+            (u'6406 Ivy Lane Apartment #4', u'6406 IVY LN APT # 4'),
+            (u'6406 Ivy Lane #4', u'6406 IVY LN # 4'),
+            (u'North Street', u'NORTH ST'),
+            (u'100 West Street', u'100 WEST ST'),
+            (u'Avenue of the Americas', u'AVENUE OF THE AMERICAS'),
+            (u'Suite 200', u'STE 200'),
+            (None, u''),
+        ]:
+            self.assertEqual(normalize_street(value), expected)
+
+    def test_020_split_zip(self):
+        "Test the splitting of ZIP+4 codes"
+        self.assertEqual(split_zip('20770'), (u'20770', u''))
+        self.assertEqual(split_zip(' 20770-1441'), (u'20770', u'1441'))
+        self.assertEqual(split_zip('207701441'), (u'20770', u'1441'))
+        self.assertEqual(split_zip('20770', '1441'), (u'20770', u'1441'))
+        self.assertEqual(split_zip('A1B 2C3'), (u'A1B 2C3', u''))
+        self.assertEqual(split_zip(None), (u'', u''))
+
+        self.assertTrue(is_zip5(normalize_zip5(' 20770-1441')))
+        for value in (None, '', 'XXXXX', '110006', 'A1B 2C3'):
+            self.assertFalse(is_zip5(normalize_zip5(value)))
+
+    def test_030_canonical_key(self):
+        "Test that equivalent addresses have the same key"
+        key = canonical_key({
+            'FirmName': 'XYZ Corp.',
+            'Address2': '6406 Ivy Lane',
+            'City': 'Greenbelt',
+            'State': 'MD',
+            'Zip5': '20770-1441',
+        })
+        self.assertEqual(key, canonical_key({
+            'FirmName': u'xyz  corp',
+            'Address1': '',
+            'Address2': u'6406 IVY LN',
+            'City': u'GREENBELT ',
+            'State': u'md',
+            'Zip5': u'20770',
+            'Zip4': u'1441',
+        }))
+        self.assertNotEqual(key, canonical_key({
+            'FirmName': 'XYZ Corp.',
+            'Address2': '6408 Ivy Lane',
+            'City': 'Greenbelt',
+            'State': 'MD',
+            'Zip5': '20770-1441',
+        }))
+        self.assertNotEqual(key, canonical_key({
+            'FirmName': 'XYZ Corp.',
+            'Address2': '6406 Ivy Lane',
+            'City': 'Greenbelt',
+            'State': 'MD',
+            'Zip5': '20770-1441',
+            'Urbanization': 'URB',
+        }))
+
+    def test_040_validate_many(self):
+        "Test that equivalent addresses are validated once"
+        api = RecordingAddressValidation('XXXXXXX', '')
+        api.requests = []
+        results = api.validate_many([
+            {'Address2': '6406 Ivy Lane', 'Zip5': '20770-1441'},
+            {'Address2': '8 Wildwood Drive', 'Zip5': '06371'},
+            {'Address2': ' 6406 ivy ln.', 'Zip5': '20770', 'Zip4': '1441'},
+        ])
+        self.assertEqual(len(api.requests), 1)
+        self.assertEqual(len(api.requests[0]), 2)
+        self.assertEqual(results[0], results[2])
+        self.assertEqual(results[0].Address2, '6406 Ivy Lane')
+        self.assertEqual(results[0].Zip5, '20770')
+        self.assertEqual(results[0].Zip4, '1441')
+        self.assertEqual(results[1].Address2, '8 Wildwood Drive')
+
+    def test_050_lookup_many(self):
+        "Test that the ZIP codes are looked up and cached by ZIP5"
+        api = RecordingCityStateLookup('XXXXXXX', '', cache=LRUCache())
+        api.requests = []
+        results = api.lookup_many(['20770', ' 20770-1441', '207701441'])
+        self.assertEqual(len(api.requests), 1)
+        self.assertEqual(len(api.requests[0]), 1)
+        self.assertEqual(
+            sorted(results), [' 20770-1441', '20770', '207701441']
+        )
+        self.assertEqual(set(results.values()), set([results['20770']]))
+
+        self.assertEqual(api.lookup('20770 1441').City, 'GREENBELT')
+        self.assertEqual(len(api.requests), 1)
+
+        # Not shared with the other users and servers
+        other_api = RecordingCityStateLookup('YYYYYYY', '', cache=api.cache)
+        other_api.requests = []
+        other_api.lookup('20770')
+        self.assertEqual(len(other_api.requests), 1)
+        other_api = RecordingCityStateLookup('XXXXXXX', '', cache=api.cache)
+        other_api.urls = {'unsecure': 'http://127.0.0.1:1/ShippingAPI.dll'}
+        other_api.requests = []
+        other_api.lookup('20770')
+        self.assertEqual(len(other_api.requests), 1)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestNormalize)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
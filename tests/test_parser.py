@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_parser.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from usps.exceptions import USPSException
+from usps.parser import parse_address_response, parse_city_state_response
+from usps.results import AddressResult, CityStateResult
+
+
+class TestParser(unittest.TestCase):
+    """
+    Test the parsing of the USPS responses
+    """
+
+    def test_010_address_response(self):
+        "Test the parsing of an AddressValidateResponse"
+        items = parse_address_response(
+            '<AddressValidateResponse>'
+            '<Address ID="0"><FirmName>XYZ CORP.</FirmName>'
+            '<Address2>6406 IVY LN</Address2><City>GREENBELT</City>'
+            '<State>MD</State><Zip5>20770</Zip5><Zip4>1441</Zip4>'
+            '</Address>'
+            '<Address ID="1"><Error><Number>-2147219401</Number>'
+            '<Source>clsAMS</Source><Description>Address Not Found.'
+            '</Description></Error></Address>'
+            '</AddressValidateResponse>'
+        )
+        self.assertEqual(len(items), 2)
+
+        id, address, error = items[0]
+        self.assertEqual(id, '0')
+        self.assertEqual(error, None)
+        self.assertEqual(address.Address2, '6406 IVY LN')
+        self.assertEqual(address.City, 'GREENBELT')
+        self.assertEqual(address.Zip4, '1441')
+        self.assertEqual(address.Address1, None)
+
+        self.assertEqual(
+            items[1], ('1', None, 'clsAMS--2147219401:Address Not Found.')
+        )
+
+    def test_020_city_state_response(self):
+        "Test the parsing of a CityStateLookupResponse"
+        (id, zipcode, error), = parse_city_state_response(
+            '<?xml version="1.0"?>'
+            '<CityStateLookupResponse><ZipCode ID="0"><Zip5>90210</Zip5>'
+            '<City>BEVERLY HILLS</City><State>CA</State></ZipCode>'
+            '</CityStateLookupResponse>'
+        )
+        self.assertEqual(zipcode.Zip5, '90210')
+        self.assertEqual(zipcode.City, 'BEVERLY HILLS')
+        self.assertEqual(zipcode.State, 'CA')
+
+    def test_030_error_response(self):
+        "Test the parsing of an error of the whole request"
+        self.assertRaises(
+            USPSException, parse_city_state_response,
+            '<Error><Number>80040B1A</Number><Description>Authorization '
+            'failure.</Description><Source>USPSCOM::DoAuth</Source></Error>'
+        )
+
+    def test_040_results(self):
+        "Test the equality, hash and immutability of the results"
+        result = CityStateResult(Zip5='20770', City='GREENBELT', State='MD')
+        same_result = CityStateResult(
+            Zip5='20770', City='GREENBELT', State='MD'
+        )
+        other_result = CityStateResult(
+            Zip5='90210', City='BEVERLY HILLS', State='CA'
+        )
+
+        self.assertEqual(result, same_result)
+        self.assertNotEqual(result, other_result)
+        self.assertNotEqual(
+            result, AddressResult(Zip5='20770', City='GREENBELT', State='MD')
+        )
+        self.assertEqual(len(set([result, same_result, other_result])), 2)
+        self.assertRaises(AttributeError, setattr, result, 'City', 'LANHAM')
+        self.assertFalse(hasattr(result, '__dict__'))
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestParser)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
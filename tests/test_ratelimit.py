@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_ratelimit.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from usps.city_state_lookup import CityStateLookup
+from usps.exceptions import USPSRateLimited
+from usps.instrumentation import MemoryInstrumentation
+from usps.ratelimit import BULK, INTERACTIVE, TokenBucket
+
+from tests.test_instrumentation import FakeAdapter, reset_shared_state
+
+
+class TestRateLimit(unittest.TestCase):
+    """
+    Test the rate limit of the USPS requests
+    """
+
+    def setUp(self):
+        reset_shared_state(self)
+
+    def test_010_token_bucket(self):
+        "Test the rate and the burst of the token bucket"
+        bucket = TokenBucket(rate=20, burst=2)
+        bucket.acquire(timeout=0)
+        bucket.acquire(timeout=0)
+        self.assertRaises(USPSRateLimited, bucket.acquire, timeout=0)
+
+        start = time.time()
+        bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.04)
+
+    def test_020_bulk_reserve(self):
+        "Test that bulk requests leave tokens to interactive requests"
+        bucket = TokenBucket(rate=0.001, burst=5)
+        for i in xrange(4):
+            bucket.acquire(BULK, timeout=0)
+        self.assertRaises(USPSRateLimited, bucket.acquire, BULK, timeout=0)
+        bucket.acquire(INTERACTIVE, timeout=0)
+        self.assertRaises(USPSRateLimited, bucket.acquire, timeout=0)
+
+    def test_030_interactive_priority(self):
+        "Test that waiting interactive requests pass before bulk requests"
+        bucket = TokenBucket(rate=20, burst=1)
+        bucket.acquire()
+        order = []
+
+        def acquire(priority):
+            bucket.acquire(priority)
+            order.append(priority)
+
+        threads = [
+            threading.Thread(target=acquire, args=(BULK,)),
+            threading.Thread(target=acquire, args=(INTERACTIVE,)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [INTERACTIVE, BULK])
+
+    def test_040_shared_bucket(self):
+        "Test a bucket shared through a file"
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        bucket1 = TokenBucket(rate=0.001, burst=2, path=path)
+        bucket2 = TokenBucket(rate=0.001, burst=2, path=path)
+        bucket1.acquire(timeout=0)
+        bucket2.acquire(timeout=0)
+        self.assertRaises(USPSRateLimited, bucket1.acquire, timeout=0)
+        self.assertRaises(USPSRateLimited, bucket2.acquire, timeout=0)
+
+    def test_050_api_rate_limit(self):
+        "Test the rate limit of the API instances"
+        session = requests.Session()
+        session.mount('http://', FakeAdapter())
+        apis = [
+            CityStateLookup(
+                'XXXXXXX', '', cache=None, rate_limit=0.001,
+                rate_limit_burst=1,
+            ) for i in xrange(2)
+        ]
+        for api in apis:
+            api.get_session = lambda: session
+            api.rate_limit_timeout = 0
+            api.instrumentation = MemoryInstrumentation()
+        self.assertTrue(
+            apis[0].get_rate_limiter() is apis[1].get_rate_limiter()
+        )
+
+        apis[0].lookup('20770')
+        self.assertRaises(USPSRateLimited, apis[1].lookup, '20770')
+        self.assertEqual(
+            apis[1].instrumentation.snapshot()['CityStateLookup'][
+                'outcomes'], {'rate_limited': 1}
+        )
+        self.assertEqual(
+            apis[1].get_breaker(apis[1].urls['unsecure']).failures, 0
+        )
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestRateLimit)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
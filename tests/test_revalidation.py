@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+    test_revalidation
+
+    Test the revalidation of the addresses
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: GPLv3, see LICENSE for more details.
+"""
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import DB_NAME, POOL, USER, CONTEXT
+from trytond.exceptions import UserError
+from trytond.transaction import Transaction
+
+from test_base import TestUSPSBase
+
+
+class TestRevalidation(TestUSPSBase):
+    "Test the revalidation of the addresses"
+
+    def setUp(self):
+        super(TestRevalidation, self).setUp()
+        self.Revalidation = POOL.get('usps.address.revalidation')
+
+    def test_0010_revalidation_chunks(self):
+        """
+        Test that the addresses are revalidated chunk by chunk after the
+        checkpoint
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            with Transaction().set_context(company=None):
+                self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [('create', self.get_address_values())],
+                }])
+            country_us, = self.Country.search([('code', '=', 'US')])
+            # The address of the company and the 3 US addresses above
+            us_addresses = self.Address.search([
+                ('country', '=', country_us.id),
+            ], order=[('id', 'ASC')])
+            self.assertEqual(len(us_addresses), 4)
+
+            revalidation, = self.Revalidation.create([{
+                'name': 'Test',
+                'chunk_size': 3,
+            }])
+            self.assertEqual(revalidation.state, 'draft')
+            self.Revalidation.start([revalidation])
+            self.assertEqual(revalidation.state, 'running')
+            self.assertTrue(revalidation.started_at)
+
+            revalidation.process_chunk()
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'running')
+            self.assertEqual(revalidation.last_id, us_addresses[2].id)
+            self.assertEqual(revalidation.processed, 3)
+
+            # Cancelled revalidations resume after their checkpoint
+            self.Revalidation.cancel([revalidation])
+            self.Revalidation.start([revalidation])
+            revalidation.process_chunk()
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'done')
+            self.assertTrue(revalidation.finished_at)
+            self.assertEqual(revalidation.last_id, us_addresses[3].id)
+            self.assertEqual(revalidation.processed, 4)
+            self.assertEqual(revalidation.valid, 2)
+            self.assertEqual(revalidation.suggested, 1)
+            self.assertEqual(revalidation.invalid, 1)
+
+    def test_0020_revalidation_empty_chunk(self):
+        """
+        Test that a revalidation is done once there are no addresses left
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            revalidation, = self.Revalidation.create([{
+                'name': 'Test',
+                'chunk_size': 1,
+            }])
+            self.Revalidation.start([revalidation])
+            revalidation.process_chunk()
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'running')
+            self.assertEqual(revalidation.processed, 1)
+
+            revalidation.process_chunk()
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'done')
+            self.assertEqual(revalidation.processed, 1)
+
+    def test_0030_revalidate(self):
+        """
+        Test that the scheduler revalidates the addresses chunk by chunk,
+        committing each chunk, and resumes after the last committed chunk
+        once interrupted
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            with Transaction().set_context(company=None):
+                self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [('create', self.get_address_values())],
+                }])
+            country_us, = self.Country.search([('code', '=', 'US')])
+            us_addresses = self.Address.search([
+                ('country', '=', country_us.id),
+            ], order=[('id', 'ASC')])
+
+            revalidation, = self.Revalidation.create([{
+                'name': 'Test',
+                'chunk_size': 1,
+            }])
+            self.Revalidation.start([revalidation])
+
+            # Keep the test database as is
+            commits = []
+            Transaction().cursor.commit = lambda: commits.append(
+                self.Revalidation(revalidation.id).last_id
+            )
+
+            # Interrupted once while revalidating the third chunk
+            validate_addresses = self.Address.usps_validate_addresses
+            interruptions = [KeyboardInterrupt]
+
+            def interrupted(addresses):
+                if len(commits) == 2 and interruptions:
+                    raise interruptions.pop()
+                return validate_addresses(addresses)
+            self.Address.usps_validate_addresses = staticmethod(interrupted)
+            self.addCleanup(
+                delattr, self.Address, 'usps_validate_addresses'
+            )
+            self.assertRaises(KeyboardInterrupt, self.Revalidation.revalidate)
+            self.assertEqual(
+                commits, [address.id for address in us_addresses[:2]]
+            )
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'running')
+            self.assertEqual(revalidation.processed, 2)
+
+            self.Revalidation.revalidate()
+            # The remaining chunks and a last empty one
+            self.assertEqual(commits[2:], [
+                us_addresses[2].id, us_addresses[3].id, us_addresses[3].id,
+            ])
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'done')
+            self.assertEqual(revalidation.processed, 4)
+            self.assertEqual(revalidation.valid, 2)
+            self.assertEqual(revalidation.suggested, 1)
+            self.assertEqual(revalidation.invalid, 1)
+
+    def test_0040_revalidate_failing_address(self):
+        """
+        Test that an address failing its validation is counted as an error
+        and does not stop the revalidation
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            with Transaction().set_context(company=None):
+                self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [('create', self.get_address_values())],
+                }])
+            country_us, = self.Country.search([('code', '=', 'US')])
+            us_addresses = self.Address.search([
+                ('country', '=', country_us.id),
+            ], order=[('id', 'ASC')])
+            self.poison_addresses(us_addresses[1:2])
+
+            revalidation, = self.Revalidation.create([{
+                'name': 'Test',
+                'chunk_size': 2,
+            }])
+            self.Revalidation.start([revalidation])
+            Transaction().cursor.commit = lambda: None
+            self.Revalidation.revalidate()
+
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'done')
+            self.assertEqual(revalidation.last_id, us_addresses[3].id)
+            self.assertEqual(revalidation.processed, 4)
+            self.assertEqual(revalidation.valid, 1)
+            self.assertEqual(revalidation.suggested, 1)
+            self.assertEqual(revalidation.invalid, 1)
+            self.assertEqual(revalidation.errors, 1)
+
+    def test_0050_revalidate_usps_unavailable(self):
+        """
+        Test that the revalidation stops at its checkpoint while USPS is not
+        available
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=None):
+                self.Party.create([{
+                    'name': 'John Doe',
+                    'addresses': [
+                        ('create', self.get_address_values()[:1]),
+                    ],
+                }])
+            self.usps_server.server_error_rate = 1
+
+            revalidation, = self.Revalidation.create([{
+                'name': 'Test',
+                'chunk_size': 2,
+            }])
+            self.Revalidation.start([revalidation])
+            Transaction().cursor.commit = lambda: None
+            self.assertRaises(UserError, self.Revalidation.revalidate)
+
+            # Even if another address of the chunk fails
+            self.poison_addresses(self.Address.search([], limit=1))
+            self.assertRaises(UserError, self.Revalidation.revalidate)
+
+            revalidation = self.Revalidation(revalidation.id)
+            self.assertEqual(revalidation.state, 'running')
+            self.assertEqual(revalidation.processed, 0)
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestRevalidation)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_serializer.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import unittest
+
+from lxml import etree
+from lxml.builder import E
+
+from usps.address_validation import AddressValidation
+from usps.city_state_lookup import CityStateLookup
+from usps.serializer import serialize_request
+
+
+class TestSerializer(unittest.TestCase):
+    """
+    Test that the template serializer writes the same XML as lxml
+    """
+
+    def assertSameAddressRequest(self, username, addresses):
+        expected = etree.tostring(E.AddressValidateRequest(*[
+            AddressValidation.address_request_type(id=str(index), **values)
+            for index, values in enumerate(addresses)
+        ], USERID=username))
+        self.assertEqual(serialize_request(
+            'AddressValidateRequest', username, [
+                AddressValidation.address_request_xml(id=str(index), **values)
+                for index, values in enumerate(addresses)
+            ]
+        ), expected)
+
+    def test_010_address_request(self):
+        "Test the serialization of address requests"
+        self.assertSameAddressRequest('XXXXXXX', [{
+            'FirmName': 'XYZ Corp.',
+            'Address2': '6406 Ivy ',
+            'City': 'Greenbelt',
+            'State': 'MD',
+        }, {
+            'Address1': u'Suite <1> & "2"\r\n\t\'3\'',
+            'City': u'Mayagüez',
+            'State': u'PR',
+            'Zip5': u'00680',
+        }, {}])
+        self.assertSameAddressRequest(u'ünïcode "user"\n\t\r<&>', [{
+            'Address2': u'\U0001F600 €',
+        }])
+
+        # Unknown fields are serialized by lxml
+        self.assertEqual(
+            AddressValidation.address_request_xml(Urbanization='URB'),
+            etree.tostring(
+                AddressValidation.address_request_type(Urbanization='URB')
+            )
+        )
+
+    def test_020_zipcode_request(self):
+        "Test the serialization of city/state lookup requests"
+        zips = ['90210', u'2A77', '<&>\r']
+        self.assertEqual(
+            serialize_request('CityStateLookupRequest', 'XXXXXXX', [
+                CityStateLookup.zipcode_request_xml(zip5, id=str(index))
+                for index, zip5 in enumerate(zips)
+            ]),
+            etree.tostring(E.CityStateLookupRequest(*[
+                CityStateLookup.zipcode_request_type(zip5, id=str(index))
+                for index, zip5 in enumerate(zips)
+            ], USERID='XXXXXXX'))
+        )
+
+    def test_030_invalid_values(self):
+        "Test that the values lxml refuses are refused"
+        for value in ('\x00', u'\x0b', u'￾', '\xc3\xa9'):
+            self.assertRaises(
+                ValueError, AddressValidation.address_request_type,
+                City=value
+            )
+            self.assertRaises(
+                ValueError, AddressValidation.address_request_xml,
+                City=value
+            )
+        for value in (5, None):
+            self.assertRaises(
+                TypeError, AddressValidation.address_request_type,
+                City=value
+            )
+            self.assertRaises(
+                TypeError, AddressValidation.address_request_xml,
+                City=value
+            )
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestSerializer)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
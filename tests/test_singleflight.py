@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_singleflight.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import threading
+import time
+import unittest
+
+import requests
+
+from usps.city_state_lookup import CityStateLookup
+from usps.instrumentation import MemoryInstrumentation
+from usps.ratelimit import BULK
+from usps.singleflight import SingleFlight
+
+from tests.test_instrumentation import FakeAdapter, reset_shared_state
+
+
+class BlockingAdapter(FakeAdapter):
+    "Holds the requests until released and counts them"
+
+    def __init__(self, *args, **kwargs):
+        super(BlockingAdapter, self).__init__(*args, **kwargs)
+        self.released = threading.Event()
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        self.released.wait()
+        return super(BlockingAdapter, self).send(request, **kwargs)
+
+
+def run_threads(target, number):
+    "Runs the target in `number` threads and returns the threads"
+    threads = [threading.Thread(target=target) for i in xrange(number)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+class TestSingleFlight(unittest.TestCase):
+    """
+    Test the coalescing of the concurrent identical requests
+    """
+
+    def setUp(self):
+        reset_shared_state(self)
+
+    def test_010_single_flight(self):
+        "Test that concurrent calls with the same key run once"
+        flight = SingleFlight()
+        released = threading.Event()
+        calls = []
+        results = []
+
+        def function(value):
+            calls.append(value)
+            released.wait()
+            return value * 2
+
+        threads = run_threads(
+            lambda: results.append(flight.do('key', function, 21)), 5
+        )
+        time.sleep(0.2)
+        released.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [21])
+        self.assertEqual(sorted(results), [(42, False)] + [(42, True)] * 4)
+        self.assertEqual(len(flight), 0)
+
+        # Calls after the completion run again
+        self.assertEqual(flight.do('key', function, 1), (2, False))
+
+    def test_020_shared_exception(self):
+        "Test that the exception of the call is raised by all the callers"
+        flight = SingleFlight()
+        released = threading.Event()
+        errors = []
+
+        def function():
+            released.wait()
+            raise ValueError('failed')
+
+        def call():
+            try:
+                flight.do('key', function)
+            except ValueError, exc:
+                errors.append(exc)
+
+        threads = run_threads(call, 3)
+        time.sleep(0.2)
+        released.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(len(set(map(id, errors))), 1)
+
+    def test_030_coalesced_requests(self):
+        "Test that concurrent identical lookups send a single request"
+        adapter = BlockingAdapter()
+        session = requests.Session()
+        session.mount('http://', adapter)
+        api = CityStateLookup('XXXXXXX', '', cache=None)
+        api.get_session = lambda: session
+        api.instrumentation = MemoryInstrumentation()
+        results = []
+
+        threads = run_threads(lambda: results.append(api.lookup('20770')), 10)
+        time.sleep(0.2)
+        adapter.released.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(adapter.requests, 1)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(results[0].City, 'GREENBELT')
+        self.assertEqual(
+            api.instrumentation.snapshot()['CityStateLookup']['outcomes'][
+                'coalesced'], 9
+        )
+
+        # Different requests are not coalesced
+        api.lookup_many(['20770', '99999'])
+        self.assertEqual(adapter.requests, 2)
+
+        # Nor identical requests of different priorities
+        adapter.released.clear()
+        threads = run_threads(lambda: api.lookup('20770'), 1)
+        threads += run_threads(
+            lambda: api.lookup_many(['20770'], priority=BULK), 1
+        )
+        time.sleep(0.2)
+        adapter.released.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(adapter.requests, 4)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestSingleFlight)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_zip_dataset.py
+
+    :copyright: (C) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from usps.zip_dataset import ZipDataset, main
+
+
+class TestZipDataset(unittest.TestCase):
+    """
+    Test the local ZIP dataset
+    """
+
+    def test_010_load_lookup(self):
+        "Test loading a CSV file and looking up ZIP5 codes in it"
+        dataset = ZipDataset(':memory:')
+        count = dataset.load(StringIO(
+            'ZIP,City,State,County\n'
+            '20770,Greenbelt,md,Prince Georges\n'
+            '4864,Warren,ME,Knox\n'
+            '20770,Berwyn Heights,MD,Prince Georges\n'
+        ))
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(dataset), 2)
+        self.assertEqual(dataset.lookup('20770'), ('GREENBELT', 'MD'))
+        self.assertEqual(dataset.lookup('04864'), ('WARREN', 'ME'))
+        self.assertEqual(dataset.lookup('90210'), None)
+
+        # Loading again replaces the content
+        dataset.load(StringIO(
+            'zipcode,city_name,state_code\n'
+            '90210,Beverly Hills,CA\n'
+        ), 'zipcode', 'city_name', 'state_code')
+        self.assertEqual(len(dataset), 1)
+        self.assertEqual(dataset.lookup('90210'), ('BEVERLY HILLS', 'CA'))
+        dataset.close()
+
+    def test_020_invalid_header(self):
+        "Test loading a CSV file without the expected columns"
+        dataset = ZipDataset(':memory:')
+        dataset.load(StringIO('zip,city,state\n20770,Greenbelt,MD\n'))
+
+        with self.assertRaises(ValueError) as context:
+            dataset.load(StringIO('zip,town,state\n90210,Beverly Hills,CA\n'))
+        self.assertEqual(
+            context.exception.args[0],
+            'Missing column(s) city in the CSV header'
+        )
+        self.assertRaises(ValueError, dataset.load, StringIO(''))
+        # The content is kept
+        self.assertEqual(dataset.lookup('20770'), ('GREENBELT', 'MD'))
+        dataset.close()
+
+    def test_030_main(self):
+        "Test loading a CSV file from the command line"
+        directory = tempfile.mkdtemp()
+        dataset_path = os.path.join(directory, 'zip.db')
+        csv_path = os.path.join(directory, 'zip.csv')
+        stderr = StringIO()
+        self.addCleanup(setattr, sys, 'stderr', sys.stderr)
+        sys.stderr = stderr
+
+        with open(csv_path, 'wb') as csv_file:
+            csv_file.write('zipcode,city,state\n20770,Greenbelt,MD\n')
+        main([dataset_path, csv_path, '--zip-column', 'zipcode'])
+        self.assertTrue(stderr.getvalue().startswith('Loaded 1 rows in '))
+
+        with self.assertRaises(SystemExit) as context:
+            main([dataset_path, csv_path])
+        self.assertEqual(context.exception.code, 2)
+        self.assertTrue(stderr.getvalue().endswith(
+            'error: Missing column(s) zip in the CSV header\n'
+        ))
+
+        dataset = ZipDataset(dataset_path)
+        self.assertEqual(dataset.lookup('20770'), ('GREENBELT', 'MD'))
+        dataset.close()
+        for path in (dataset_path, csv_path):
+            os.remove(path)
+        os.rmdir(directory)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestZipDataset)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -6,16 +6,24 @@
     :license: BSD, see LICENSE for more details.
 """
 from collections import OrderedDict
-from lxml import etree, objectify
+from functools import partial
+from lxml import etree
 from lxml.builder import E
 
 from api import BaseAPI
 from exceptions import USPSInvalidAddress
+from normalize import canonical_key, split_zip
+from parser import parse_address_response
+from ratelimit import BULK, INTERACTIVE
+from serializer import ADDRESS_FIELDS, serialize_address, serialize_request
 
 
 class AddressValidation(BaseAPI):
     "Implements the Address Validation"
 
+    #: Maximum number of addresses USPS accepts in a single request
+    max_batch_size = 5
+
     @classmethod
     def address_request_type(cls, id='0', **kwargs):
         """
@@ -73,6 +81,31 @@ class AddressValidation(BaseAPI):
         elements = cls.make_elements([], [], values)
         return E.Address(*elements, ID=id)
 
+    @classmethod
+    def address_request_xml(cls, id='0', **kwargs):
+        """
+        Returns the serialized Address element of :meth:`address_request_type`
+        for the same arguments, written from a template when possible.
+        """
+        if frozenset(ADDRESS_FIELDS).issuperset(kwargs):
+            return serialize_address(id, kwargs)
+        return etree.tostring(cls.address_request_type(id=id, **kwargs))
+
+    @classmethod
+    def get_address_error(cls, address):
+        """
+        Returns an :exception:`USPSInvalidAddress` for the error of the given
+        response Address element or None if it has no error.
+        """
+        error = address.find('Error')
+        if error is None:
+            return None
+        return USPSInvalidAddress("%s-%s:%s" % (
+            error.Source,
+            error.Number,
+            error.Description,
+        ), address)
+
     def look_for_error(self, response):
         """
         Look for address specific errors in response
@@ -80,36 +113,145 @@ class AddressValidation(BaseAPI):
         super(AddressValidation, self).look_for_error(response)
 
         # Look for address specific error
-        try:
-            error = response.Address.Error
-        except AttributeError:
-            return None
-        else:
-            raise USPSInvalidAddress("%s-%s:%s" % (
-                error.Source,
-                error.Number,
-                error.Description,
-            ), response)
+        errors = []
+        addresses = list(response.iterchildren('Address'))
+        for address in addresses:
+            error = self.get_address_error(address)
+            if error is not None:
+                errors.append(error)
+        self.record_items('Verify', len(addresses), len(errors))
+        if errors:
+            raise errors[0]
 
-    def request(self, address_type):
+    def send_addresses(self, address_types):
         """
-        Calls up USPS and send the request. Get the returned response and
-            return an element built out of it.
+        Sends a request for the given Address elements and returns the parsed
+        response. Only the errors of the whole request are looked for.
 
-        :param address_type: lxml element with data for the address request
-            type
+        :param address_types: list of lxml elements with data for the address
+            request type
         """
-        full_address_type = E.AddressValidateRequest(
-            address_type, USERID=self.username
+        return self.parse('Verify', self._objectify_response, (
+            self._send_addresses([
+                etree.tostring(address_type)
+                for address_type in address_types
+            ])
+        ))
+
+    def _send_addresses(self, addresses_xml, priority=INTERACTIVE):
+        """
+        Sends a request for the given serialized Address elements and returns
+        the raw response.
+        """
+        full_request = serialize_request(
+            'AddressValidateRequest', self.username, addresses_xml
         )
-        full_request = etree.tostring(full_address_type)
 
         # Send the request
-        result = self.send_request(
+        return self.send_request(
             self.urls['secure'],
             api_type='Verify',
-            data_xml=full_request
+            data_xml=full_request,
+            priority=priority
         )
-        response = objectify.fromstring(result)
+
+    def request(self, address_type):
+        """
+        Calls up USPS and send the request. Get the returned response and
+            return an element built out of it.
+
+        :param address_type: lxml element with data for the address request
+            type
+        """
+        response = self.send_addresses([address_type])
         self.look_for_error(response)
         return response
+
+    def request_async(self, address_type):
+        """
+        Same as :meth:`request` but returns immediately a
+        :class:`concurrent.futures.Future` of the response.
+        """
+        return self.submit(self.request, address_type)
+
+    def validate_many(self, addresses, priority=BULK):
+        """
+        Validates any number of addresses, sending them to USPS in batches of
+        :attr:`max_batch_size` addresses. The batches are sent concurrently,
+        see :meth:`map`.
+
+        Returns a list with one item per given address, in the same order:
+        either the :class:`AddressResult` of the response or an
+        :exception:`USPSInvalidAddress` if USPS could not validate that
+        address. Errors of a whole request are raised.
+
+        Equivalent addresses, with the same :func:`canonical_key`, are sent
+        once: the first of them is sent, with its ZIP+4 split, and its result
+        is returned for all of them.
+
+        :param addresses: list of dictionaries with the keyword arguments of
+            :meth:`address_request_type`
+        :param priority: Priority of the requests for the rate limit, see
+            :meth:`send_request`
+        """
+        keys = []
+        unique_addresses = OrderedDict()
+        for values in addresses:
+            key = canonical_key(values)
+            keys.append(key)
+            if key not in unique_addresses:
+                values = dict(values)
+                if values.get('Zip5'):
+                    values['Zip5'], values['Zip4'] = split_zip(
+                        values['Zip5'], values.get('Zip4')
+                    )
+                unique_addresses[key] = values
+        unique_keys = unique_addresses.keys()
+        unique_addresses = unique_addresses.values()
+        chunks = [
+            unique_addresses[offset:offset + self.max_batch_size]
+            for offset in xrange(
+                0, len(unique_addresses), self.max_batch_size
+            )
+        ]
+        results = []
+        validate_chunk = partial(self._validate_chunk, priority=priority)
+        for chunk_results in self.map(validate_chunk, chunks):
+            results.extend(chunk_results)
+        results = dict(zip(unique_keys, results))
+        return [results[address_key] for address_key in keys]
+
+    def validate_many_async(self, addresses, priority=BULK):
+        """
+        Same as :meth:`validate_many` but returns immediately a
+        :class:`concurrent.futures.Future` of the results.
+        """
+        return self.submit(self.validate_many, list(addresses), priority)
+
+    def _validate_chunk(self, chunk, priority=INTERACTIVE):
+        """
+        Validates at most :attr:`max_batch_size` addresses in one request
+        and maps each response Address back to its input by its ID.
+        """
+        items = self.parse('Verify', parse_address_response, (
+            self._send_addresses([
+                self.address_request_xml(id=str(index), **values)
+                for index, values in enumerate(chunk)
+            ], priority)
+        ))
+        by_id = dict((id, (result, error)) for id, result, error in items)
+        results = []
+        for index in xrange(len(chunk)):
+            result, error = by_id.get(str(index), (None, None))
+            if result is None:
+                results.append(USPSInvalidAddress(
+                    error or "Address %d missing in the USPS response" % index,
+                    None
+                ))
+            else:
+                results.append(result)
+        self.record_items('Verify', len(results), len([
+            item for item in results
+            if isinstance(item, USPSInvalidAddress)
+        ]))
+        return results
@@ -5,9 +5,21 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from lxml import objectify
 from lxml.builder import E
-from exceptions import USPSException
+from breaker import CircuitBreaker
+from exceptions import USPSException, USPSRateLimited, \
+    USPSServiceUnavailable
+from instrumentation import Instrumentation, MemoryInstrumentation
+from ratelimit import INTERACTIVE, TokenBucket
+from singleflight import SingleFlight
 
 
 class BaseAPI(object):
@@ -17,6 +29,19 @@ class BaseAPI(object):
     :param username: API Username
     :param password: API Password
     :param is_test: True if supposed to work in test mode
+    :param connect_timeout: Seconds to wait for the connection to USPS
+    :param read_timeout: Seconds to wait for the response of USPS
+    :param max_retries: Number of retries of a request failing with a
+        connection error, a timeout or a server error
+    :param breaker_threshold: Number of consecutive failed requests after
+        which the requests fail fast, 0 to disable the circuit breaker
+    :param breaker_cooldown: Seconds during which the requests fail fast
+    :param rate_limit: Maximum number of requests per second, None or 0 for
+        no limit
+    :param rate_limit_burst: Maximum number of requests sent at once within
+        the rate limit
+    :param rate_limit_file: Path of a file to share the rate limit with the
+        other processes
     """
 
     urls = {
@@ -24,22 +49,402 @@ class BaseAPI(object):
         'unsecure': 'http://production.shippingapis.com/ShippingAPITest.dll',
     }
 
-    def __init__(self, username, password, is_test=True):
+    #: Number of hosts for which a connection pool is kept
+    pool_connections = 10
+
+    #: Maximum number of connections kept open per host
+    pool_maxsize = 10
+
+    #: Keep the connections open between requests
+    keep_alive = True
+
+    # HTTP session shared by all the API instances. It is created lazily by
+    # :meth:`get_session` and always stored on BaseAPI itself, so that
+    # AddressValidation and CityStateLookup share the same connections.
+    _session = None
+    _session_lock = threading.Lock()
+
+    #: Maximum number of requests run at once by the asynchronous methods
+    max_concurrency = 10
+
+    # Thread pool shared by all the API instances to run the asynchronous
+    # methods, created lazily by :meth:`get_executor`.
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    # Marks the threads of the executor, see :meth:`map`
+    _local = threading.local()
+
+    connect_timeout = 5
+    read_timeout = 30
+    max_retries = 2
+
+    #: Delay in seconds before the first retry, doubled at each retry. The
+    #: actual delay is a random duration up to it.
+    retry_backoff = 0.5
+
+    breaker_threshold = 5
+    breaker_cooldown = 60
+
+    # Circuit breakers by URL and settings, shared by all the API instances
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    rate_limit = None
+    rate_limit_burst = None
+    rate_limit_file = None
+
+    #: Maximum number of seconds an interactive request waits for the rate
+    #: limit, bulk requests wait as long as needed
+    rate_limit_timeout = 10
+
+    # Rate limiters by settings, shared by all the API instances
+    _rate_limiters = {}
+    _rate_limiters_lock = threading.Lock()
+
+    # Requests in flight, shared by all the API instances
+    _in_flight = SingleFlight()
+
+    #: :class:`Instrumentation` recording the calls of all the API instances
+    instrumentation = MemoryInstrumentation()
+
+    def __init__(self, username, password, is_test=True,
+                 connect_timeout=None, read_timeout=None, max_retries=None,
+                 breaker_threshold=None, breaker_cooldown=None,
+                 rate_limit=None, rate_limit_burst=None,
+                 rate_limit_file=None):
         self.username = username
         self.password = password
         self.is_test = is_test
+        # The settings left to None keep the default of the class
+        for name, value in [
+                ('connect_timeout', connect_timeout),
+                ('read_timeout', read_timeout),
+                ('max_retries', max_retries),
+                ('breaker_threshold', breaker_threshold),
+                ('breaker_cooldown', breaker_cooldown),
+                ('rate_limit', rate_limit),
+                ('rate_limit_burst', rate_limit_burst),
+                ('rate_limit_file', rate_limit_file),
+                ]:
+            if value is not None:
+                setattr(self, name, value)
+
+    @classmethod
+    def configure_pool(cls, pool_connections=None, pool_maxsize=None,
+                       keep_alive=None):
+        """
+        Change the settings of the shared connection pool. The current
+        session (if any) is closed and a new one is created with the new
+        settings on the next request.
+
+        :param pool_connections: Number of hosts to keep a pool for
+        :param pool_maxsize: Maximum number of connections kept per host
+        :param keep_alive: False to close the connection after each request
+        """
+        with BaseAPI._session_lock:
+            if pool_connections is not None:
+                BaseAPI.pool_connections = pool_connections
+            if pool_maxsize is not None:
+                BaseAPI.pool_maxsize = pool_maxsize
+            if keep_alive is not None:
+                BaseAPI.keep_alive = keep_alive
+            if BaseAPI._session is not None:
+                BaseAPI._session.close()
+                BaseAPI._session = None
+
+    @classmethod
+    def get_session(cls):
+        """
+        Returns the :class:`requests.Session` shared by all the API instances.
+        The underlying urllib3 pools are thread safe, so the session can be
+        used from several threads at once.
+        """
+        session = BaseAPI._session
+        if session is None:
+            with BaseAPI._session_lock:
+                if BaseAPI._session is None:
+                    BaseAPI._session = BaseAPI._make_session()
+                session = BaseAPI._session
+        return session
+
+    @classmethod
+    def _make_session(cls):
+        """
+        Builds a new session with the pool settings of the class
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=cls.pool_connections,
+            pool_maxsize=cls.pool_maxsize,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not cls.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    @classmethod
+    def connection_stats(cls):
+        """
+        Returns the counters of the shared connection pool as a dictionary:
+
+            * connections: Number of connections opened
+            * requests: Number of requests sent
+            * reused: Number of requests sent on an already open connection
+        """
+        stats = {'connections': 0, 'requests': 0}
+        session = BaseAPI._session
+        if session is not None:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    try:
+                        pool = pools[key]
+                    except KeyError:
+                        # Evicted by another thread meanwhile
+                        continue
+                    stats['connections'] += pool.num_connections
+                    stats['requests'] += pool.num_requests
+        stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+        return stats
+
+    @classmethod
+    def configure_concurrency(cls, max_concurrency):
+        """
+        Change the maximum number of requests run at once by the
+        asynchronous methods. Requests already submitted still complete.
+        """
+        with BaseAPI._executor_lock:
+            BaseAPI.max_concurrency = max_concurrency
+            if BaseAPI._executor is not None:
+                BaseAPI._executor.shutdown(wait=False)
+                BaseAPI._executor = None
+
+    @classmethod
+    def get_executor(cls):
+        """
+        Returns the :class:`concurrent.futures.ThreadPoolExecutor` shared by
+        all the API instances.
+        """
+        executor = BaseAPI._executor
+        if executor is None:
+            with BaseAPI._executor_lock:
+                if BaseAPI._executor is None:
+                    BaseAPI._executor = ThreadPoolExecutor(
+                        max_workers=BaseAPI.max_concurrency
+                    )
+                executor = BaseAPI._executor
+        return executor
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Calls the method with the arguments in the shared thread pool and
+        returns a :class:`concurrent.futures.Future` of its result. The
+        exceptions raised by the method are raised by `Future.result`.
+
+        From asyncio code, the future can be awaited through
+        `asyncio.wrap_future`.
+        """
+        return self.get_executor().submit(
+            self._run_in_executor, method, *args, **kwargs
+        )
+
+    @classmethod
+    def _run_in_executor(cls, method, *args, **kwargs):
+        BaseAPI._local.in_executor = True
+        return method(*args, **kwargs)
+
+    def map(self, method, items):
+        """
+        Returns the list of the results of the method called on each item.
+        The calls are run concurrently in the shared thread pool, unless
+        already called from it: waiting for the pool from one of its threads
+        could dead lock.
+        """
+        items = list(items)
+        if len(items) < 2 or getattr(BaseAPI._local, 'in_executor', False):
+            return [method(item) for item in items]
+        futures = [self.submit(method, item) for item in items]
+        return [future.result() for future in futures]
+
+    @classmethod
+    def configure_instrumentation(cls, instrumentation):
+        """
+        Replaces the instrumentation of all the API instances, None to not
+        record anything.
+        """
+        BaseAPI.instrumentation = instrumentation or Instrumentation()
+
+    def parse(self, api_type, parser, xml):
+        """
+        Returns the result of the parser called on the response XML,
+        recording its duration and the errors of the whole request it
+        raises.
+        """
+        start = time.time()
+        try:
+            return parser(xml)
+        except USPSException:
+            self.instrumentation.record_outcome(api_type, 'error')
+            raise
+        finally:
+            self.instrumentation.record_timing(
+                api_type, 'parse', time.time() - start
+            )
+
+    def _objectify_response(self, xml):
+        """
+        Returns the objectified response, raising the error of the whole
+        request if any.
+        """
+        response = objectify.fromstring(xml)
+        BaseAPI.look_for_error(self, response)
+        return response
+
+    def record_items(self, api_type, total, invalid):
+        """
+        Records the outcomes of the `total` addresses or ZIP codes of a
+        response of which `invalid` have an error.
+        """
+        self.instrumentation.record_outcome(api_type, 'valid', total - invalid)
+        self.instrumentation.record_outcome(api_type, 'invalid', invalid)
 
-    def send_request(self, url, api_type, data_xml):
+    def get_breaker(self, url):
+        """
+        Returns the :class:`CircuitBreaker` of the URL with the settings of
+        this instance, shared by all the API instances with the same URL and
+        settings.
+        """
+        key = (url, self.breaker_threshold, self.breaker_cooldown)
+        with BaseAPI._breakers_lock:
+            breaker = BaseAPI._breakers.get(key)
+            if breaker is None:
+                breaker = BaseAPI._breakers[key] = CircuitBreaker(*key[1:])
+        return breaker
+
+    def get_rate_limiter(self):
+        """
+        Returns the :class:`TokenBucket` of the rate limit settings of this
+        instance, shared by all the API instances with the same settings, or
+        None if there is no rate limit.
+        """
+        if not self.rate_limit:
+            return None
+        key = (self.rate_limit, self.rate_limit_burst, self.rate_limit_file)
+        with BaseAPI._rate_limiters_lock:
+            limiter = BaseAPI._rate_limiters.get(key)
+            if limiter is None:
+                limiter = BaseAPI._rate_limiters[key] = TokenBucket(*key)
+        return limiter
+
+    def _acquire_rate_limit(self, priority):
+        """
+        Waits for the rate limit to allow a request of the priority
+        """
+        limiter = self.get_rate_limiter()
+        if limiter is not None:
+            limiter.acquire(priority, timeout=(
+                self.rate_limit_timeout if priority == INTERACTIVE else None
+            ))
+
+    def send_request(self, url, api_type, data_xml, priority=INTERACTIVE):
         """
         Sends data to the server on a request
+
+        Requests failing with a connection error, a timeout or a server
+        error are retried. If they still fail, or if the circuit breaker of
+        the URL is open, :exception:`USPSServiceUnavailable` is raised.
+
+        Each attempt waits for the rate limit, if any, and raises
+        :exception:`USPSRateLimited` if it can not be sent in time.
+
+        Concurrent identical requests of the same priority are coalesced:
+        only the first one is sent and the others wait for it and share its
+        response or its exception. Interactive requests never wait behind
+        bulk ones this way.
+
+        :param priority: :data:`usps.ratelimit.INTERACTIVE` or
+            :data:`usps.ratelimit.BULK`
+        """
+        content, shared = BaseAPI._in_flight.do(
+            (url, api_type, data_xml, priority), self._send_request, url,
+            api_type, data_xml, priority
+        )
+        if shared:
+            self.instrumentation.record_outcome(api_type, 'coalesced')
+        return content
+
+    def _send_request(self, url, api_type, data_xml, priority):
+        """
+        Sends the request, see :meth:`send_request`
         """
         params = {
             'API': api_type,
             'XML': data_xml,
         }
-        rv = requests.get(url, params=params)
+        self.instrumentation.record_size(api_type, 'request', len(data_xml))
+        breaker = self.get_breaker(url)
+        try:
+            breaker.before_request()
+            try:
+                rv = self._get_with_retries(url, params, priority)
+            except USPSRateLimited:
+                raise
+            except USPSServiceUnavailable:
+                breaker.record_failure()
+                raise
+        except USPSServiceUnavailable, exc:
+            self.instrumentation.record_outcome(api_type, (
+                'rate_limited' if isinstance(exc, USPSRateLimited)
+                else 'unavailable'
+            ))
+            raise
+        breaker.record_success()
+        self.instrumentation.record_outcome(api_type, 'success')
+        self.instrumentation.record_size(
+            api_type, 'response', len(rv.content)
+        )
         return rv.content
 
+    def _get_with_retries(self, url, params, priority=INTERACTIVE):
+        """
+        Sends a GET request, retrying it with a jittered exponential backoff
+        """
+        for attempt in xrange(self.max_retries + 1):
+            if attempt:
+                self.instrumentation.record_outcome(params['API'], 'retry')
+                time.sleep(random.uniform(
+                    0, self.retry_backoff * 2 ** (attempt - 1)
+                ))
+            self._acquire_rate_limit(priority)
+            start = time.time()
+            try:
+                rv = self.get_session().get(
+                    url, params=params,
+                    timeout=(self.connect_timeout, self.read_timeout),
+                )
+            except (requests.ConnectionError, requests.Timeout), exc:
+                error = exc
+                continue
+            if rv.status_code < 500:
+                self._record_timings(params['API'], rv, time.time() - start)
+                return rv
+            error = 'HTTP error %s' % rv.status_code
+        raise USPSServiceUnavailable("USPS is not reachable: %s" % error)
+
+    def _record_timings(self, api_type, response, duration):
+        """
+        Records the connect and transfer phases of a request which took
+        `duration` seconds. The connect phase lasts until the headers of the
+        response are received.
+        """
+        connect = min(response.elapsed.total_seconds(), duration)
+        self.instrumentation.record_timing(api_type, 'connect', connect)
+        self.instrumentation.record_timing(
+            api_type, 'transfer', duration - connect
+        )
+
     @classmethod
     def make_elements(cls, required_keys, args, kwargs):
         """Ensures that the given keys exist in either the elements list given
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    breaker.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import threading
+import time
+
+from exceptions import USPSServiceUnavailable
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker which opens after `threshold` consecutive failed
+    requests. While it is open, requests fail fast for `cooldown` seconds.
+    Then a single request is let through: the breaker closes if it succeeds
+    or stays open for another cool down if it fails.
+
+    :param threshold: Number of consecutive failures opening the breaker,
+        0 to never open it
+    :param cooldown: Number of seconds the breaker stays open
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self):
+        """
+        Raises :exception:`USPSServiceUnavailable` if the breaker is open
+        """
+        if not self.threshold:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.time()
+            if remaining > 0:
+                raise USPSServiceUnavailable(
+                    "USPS requests suspended for %d seconds after %d "
+                    "failures" % (remaining, self.failures)
+                )
+            # Let this request through as a trial, the others keep failing
+            # until it completes.
+            self.opened_at = time.time()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        if not self.threshold:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+    bulk_validation.py
+
+    Validates the addresses of CSV or JSON lines files of any size with
+    USPS, streaming the rows: batches of addresses are validated
+    concurrently and written back in input order, with a bounded number of
+    batches in flight.
+
+    Usage: usps-validate-addresses addresses.csv validated.csv
+        --column Address2=street --column Zip5=zip
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque, OrderedDict
+from itertools import islice
+
+from address_validation import AddressValidation
+from api import BaseAPI
+from exceptions import USPSException, USPSInvalidAddress
+from ratelimit import BULK
+from serializer import ADDRESS_FIELDS, serialize_address
+
+#: Fields of the results written after the input columns, prefixed by
+#: `usps_`
+RESULT_FIELDS = ('Address1', 'Address2', 'City', 'State', 'Zip5', 'Zip4')
+
+OUTPUT_COLUMNS = tuple(
+    'usps_%s' % field.lower() for field in RESULT_FIELDS
+) + ('usps_error',)
+
+
+def _decode(value):
+    "Returns the unicode of an UTF-8 value or the value if it is invalid"
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value
+
+
+def read_csv(input_file):
+    """
+    Yields the rows of a UTF-8 CSV file with a header as ordered
+    dictionaries of unicode values. The values which are not valid UTF-8
+    are kept as is, the validation of their row fails.
+    """
+    reader = csv.reader(input_file)
+    header = [name.decode('utf-8') for name in next(reader)]
+    for line in reader:
+        yield OrderedDict(zip(header, map(_decode, line)))
+
+
+def read_jsonl(input_file):
+    "Yields the objects of a JSON lines file as ordered dictionaries"
+    for line in input_file:
+        if line.strip():
+            yield json.loads(line, object_pairs_hook=OrderedDict)
+
+
+class CSVWriter(object):
+    """
+    Writes the rows in CSV, with the columns of the first row followed by
+    :data:`OUTPUT_COLUMNS`
+    """
+
+    def __init__(self, output_file, header=True):
+        self.writer = csv.writer(output_file)
+        self.header = header
+        self.columns = None
+
+    def write(self, row):
+        if self.columns is None:
+            self.columns = [
+                name for name in row if name not in OUTPUT_COLUMNS
+            ] + list(OUTPUT_COLUMNS)
+            if self.header:
+                self.writer.writerow(
+                    [name.encode('utf-8') for name in self.columns]
+                )
+        self.writer.writerow([
+            value if isinstance(value, str) else unicode(value).encode('utf-8')
+            for value in (row.get(name) or '' for name in self.columns)
+        ])
+
+
+class JSONLWriter(object):
+    "Writes the rows as JSON lines"
+
+    def __init__(self, output_file, header=True):
+        self.output_file = output_file
+
+    def write(self, row):
+        self.output_file.write(json.dumps(row) + '\n')
+
+
+FORMATS = {
+    'csv': (read_csv, CSVWriter),
+    'jsonl': (read_jsonl, JSONLWriter),
+}
+
+
+def get_format(path):
+    "Returns the format of a file from its extension, CSV by default"
+    extension = os.path.splitext(path)[1].lower()
+    return 'jsonl' if extension in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+def address_values(row, columns):
+    """
+    Returns the keyword arguments of
+    :meth:`AddressValidation.address_request_type` for a row
+
+    :param columns: dictionary of the column of the row by USPS field
+    """
+    values = {}
+    for field, column in columns.iteritems():
+        value = row.get(column)
+        if isinstance(value, str):
+            values[field] = value.decode('utf-8')
+        elif value is not None:
+            values[field] = unicode(value)
+    return values
+
+
+def check_row(row, columns):
+    """
+    Returns a tuple of the :func:`address_values` of the row and of the
+    :exception:`USPSInvalidAddress` of the row if they can not be sent to
+    USPS, because of invalid UTF-8 or control characters for example, or
+    None
+    """
+    try:
+        values = address_values(row, columns)
+        serialize_address('0', values)
+    except ValueError, exc:
+        return None, USPSInvalidAddress(unicode(exc), None)
+    return values, None
+
+
+def result_values(result):
+    """
+    Returns the dictionary of the :data:`OUTPUT_COLUMNS` for a result of
+    :meth:`AddressValidation.validate_many`
+    """
+    if isinstance(result, USPSInvalidAddress):
+        values = dict.fromkeys(OUTPUT_COLUMNS)
+        values['usps_error'] = unicode(result[0])
+        return values
+    values = dict(
+        ('usps_%s' % field.lower(), getattr(result, field))
+        for field in RESULT_FIELDS
+    )
+    values['usps_error'] = None
+    return values
+
+
+def validate_rows(api, rows, columns, window, priority=BULK):
+    """
+    Validates the rows in batches of :attr:`AddressValidation.max_batch_size`
+    sent concurrently and yields them in input order, updated with their
+    :func:`result_values`. At most `window` batches are read and in flight
+    at once, so the memory used does not depend on the number of rows.
+
+    The rows which can not be sent get the error of :func:`check_row`.
+    Errors of a whole request are raised once the rows before it are
+    yielded.
+    """
+    rows = iter(rows)
+    pending = deque()
+    while True:
+        batch = list(islice(rows, api.max_batch_size))
+        if batch:
+            checks = [check_row(row, columns) for row in batch]
+            pending.append((batch, checks, api.validate_many_async([
+                values for values, error in checks if error is None
+            ], priority)))
+        if pending and (len(pending) >= window or not batch):
+            batch, checks, future = pending.popleft()
+            results = iter(future.result())
+            for row, (values, error) in zip(batch, checks):
+                row.update(result_values(error or next(results)))
+                yield row
+        elif not batch:
+            return
+
+
+class Progress(object):
+    "Reports the number of rows written on stderr"
+
+    def __init__(self, offset, every, stream=None):
+        self.offset = offset
+        self.every = every
+        self.stream = stream or sys.stderr
+        self.count = 0
+        self.invalid = 0
+        self.start = time.time()
+
+    @property
+    def position(self):
+        "Number of input rows handled, to resume after"
+        return self.offset + self.count
+
+    def update(self, row):
+        self.count += 1
+        if row['usps_error']:
+            self.invalid += 1
+        return self.every and not self.count % self.every
+
+    def report(self, message='Validated'):
+        duration = time.time() - self.start
+        self.stream.write(
+            '%s %d rows (%d invalid) in %.1fs, %.1f rows/s, resume with '
+            '--resume-from %d\n' % (
+                message, self.count, self.invalid, duration,
+                self.count / duration if duration else 0, self.position,
+            )
+        )
+
+
+def parse_columns(specifications):
+    """
+    Returns the dictionary of the columns by USPS field of the
+    FIELD=COLUMN specifications, each field being read from the column of
+    its name by default.
+    """
+    columns = dict((field, field) for field in ADDRESS_FIELDS)
+    for specification in specifications or []:
+        field, sep, column = specification.partition('=')
+        if field not in ADDRESS_FIELDS or not sep:
+            raise argparse.ArgumentTypeError(
+                'Invalid column %r, expected FIELD=COLUMN with FIELD in %s' % (
+                    specification, ', '.join(ADDRESS_FIELDS)
+                )
+            )
+        columns[field] = column.decode('utf-8')
+    return columns
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Validate the addresses of a CSV or JSON lines file '
+        'with USPS.'
+    )
+    parser.add_argument('input', help='file to validate, - for stdin')
+    parser.add_argument('output', help='file to write, - for stdout')
+    parser.add_argument(
+        '--format', choices=sorted(FORMATS),
+        help='format of the files, from the extension of the input by '
+        'default'
+    )
+    parser.add_argument(
+        '--column', action='append', metavar='FIELD=COLUMN',
+        help='column of a USPS field (%s), the column named after the '
+        'field by default' % ', '.join(ADDRESS_FIELDS)
+    )
+    parser.add_argument(
+        '--username', default=os.environ.get('USPS_USERNAME'),
+        help='USPS username, USPS_USERNAME by default'
+    )
+    parser.add_argument(
+        '--password', default=os.environ.get('USPS_PASSWORD'),
+        help='USPS password, USPS_PASSWORD by default'
+    )
+    parser.add_argument(
+        '--url', help='base URL of another USPS Web Tools server'
+    )
+    parser.add_argument(
+        '--concurrency', type=int, default=BaseAPI.max_concurrency,
+        help='number of requests sent at once'
+    )
+    parser.add_argument(
+        '--rate-limit', type=float,
+        help='maximum number of requests per second'
+    )
+    parser.add_argument(
+        '--resume-from', type=int, default=0, metavar='ROW',
+        help='skip the first ROW input rows and append to the output'
+    )
+    parser.add_argument(
+        '--progress', type=int, default=10000, metavar='ROWS',
+        help='report the progress every ROWS rows, 0 to not report it'
+    )
+    return parser
+
+
+def close_files(*files):
+    "Closes the files, except the standard input and output"
+    for file_ in files:
+        if file_ not in (sys.stdin, sys.stdout):
+            file_.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point validating the addresses of a file
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    try:
+        columns = parse_columns(args.column)
+    except argparse.ArgumentTypeError, exc:
+        parser.error(unicode(exc))
+    if not args.username:
+        parser.error('--username or USPS_USERNAME is required')
+
+    read, Writer = FORMATS[args.format or get_format(args.input)]
+    BaseAPI.configure_concurrency(args.concurrency)
+    BaseAPI.configure_pool(
+        pool_maxsize=max(BaseAPI.pool_maxsize, args.concurrency)
+    )
+    api = AddressValidation(
+        args.username, args.password or '', rate_limit=args.rate_limit,
+    )
+    if args.url:
+        api.urls = {
+            'secure': args.url.rstrip('/') + '/ShippingAPI.dll',
+            'unsecure': args.url.rstrip('/') + '/ShippingAPITest.dll',
+        }
+
+    input_file = sys.stdin if args.input == '-' else open(args.input, 'rb')
+    output_file = sys.stdout if args.output == '-' else open(
+        args.output, 'ab' if args.resume_from else 'wb'
+    )
+    writer = Writer(output_file, header=not args.resume_from)
+    progress = Progress(args.resume_from, args.progress)
+    rows = islice(read(input_file), args.resume_from, None)
+    # The progress is reported however the validation ends, so that it can
+    # be resumed
+    stopped = 'unexpected error'
+    try:
+        for row in validate_rows(api, rows, columns, args.concurrency * 2):
+            writer.write(row)
+            if progress.update(row):
+                output_file.flush()
+                progress.report()
+        stopped = None
+    except (USPSException, KeyboardInterrupt), exc:
+        stopped = exc.args[0] if exc.args else exc.__class__.__name__
+    finally:
+        close_files(input_file, output_file)
+        progress.report(
+            'Stopped (%s) after' % stopped if stopped else 'Validated'
+        )
+    if stopped:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    cache.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe cache which evicts the least recently used entry once it
+    holds `maxsize` entries. Entries expire `ttl` seconds after being set.
+
+    :param maxsize: Maximum number of entries kept
+    :param ttl: Lifetime of an entry in seconds, None to never expire them
+    """
+
+    def __init__(self, maxsize=10000, ttl=24 * 60 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None, stale=False):
+        """
+        Returns the value cached for the key or default if there is none or
+        if it has expired.
+
+        Expired entries are kept until they are evicted or set again, so
+        that they can still be returned with `stale` as a fallback when
+        fresh values can not be fetched.
+        """
+        with self._lock:
+            try:
+                expire, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Put back the entry as the most recently used
+            self._entries[key] = expire, value
+            if not stale and expire is not None and expire <= time.time():
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Caches the value for the key
+        """
+        expire = None
+        if self.ttl is not None:
+            expire = time.time() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            while self._entries and len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[key] = expire, value
+
+    def clear(self):
+        """
+        Empties the cache and resets the statistics
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Returns the statistics of the cache as a dictionary with the number of
+        hits, misses, evictions, the current size and the maxsize.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -5,16 +5,47 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: BSD, see LICENSE for more details.
 """
-from lxml import etree, objectify
+from functools import partial
+from lxml import etree
 from lxml.builder import E
 
 from api import BaseAPI
-from exceptions import USPSInvalidZip5
+from cache import LRUCache
+from exceptions import USPSInvalidZip5, USPSServiceUnavailable
+from normalize import normalize_zip5
+from parser import parse_city_state_response
+from ratelimit import BULK, INTERACTIVE
+from serializer import serialize_request, serialize_zipcode
 
 
 class CityStateLookup(BaseAPI):
     "Implements the City/State Lookup"
 
+    #: Maximum number of ZIP codes USPS accepts in a single request
+    max_batch_size = 5
+
+    #: Cache of the lookup results shared by all the instances, by URL,
+    #: username and ZIP5. The results rarely change, so they are kept for a
+    #: week. Invalid ZIP5 are cached too. Can be replaced or set to None to
+    #: disable caching.
+    cache = LRUCache(maxsize=50000, ttl=7 * 24 * 60 * 60)
+
+    def __init__(self, username, password, is_test=True, cache=False,
+                 **kwargs):
+        super(CityStateLookup, self).__init__(
+            username, password, is_test, **kwargs
+        )
+        if cache is not False:
+            # Instance specific cache
+            self.cache = cache
+
+    def _cache_key(self, zip5):
+        """
+        Returns the key of the lookup of the ZIP5 in :attr:`cache`, so that
+        the servers and users do not share results
+        """
+        return self.urls['unsecure'], self.username, zip5
+
     @classmethod
     def zipcode_request_type(cls, Zip5, id='0'):
         """
@@ -44,6 +75,30 @@ class CityStateLookup(BaseAPI):
         """
         return E.ZipCode(E.Zip5(Zip5), ID=id)
 
+    @classmethod
+    def zipcode_request_xml(cls, Zip5, id='0'):
+        """
+        Returns the serialized ZipCode element of
+        :meth:`zipcode_request_type` for the same arguments, written from a
+        template.
+        """
+        return serialize_zipcode(id, Zip5)
+
+    @classmethod
+    def get_zipcode_error(cls, zipcode):
+        """
+        Returns an :exception:`USPSInvalidZip5` for the error of the given
+        response ZipCode element or None if it has no error.
+        """
+        error = zipcode.find('Error')
+        if error is None:
+            return None
+        return USPSInvalidZip5("%s-%s:%s" % (
+            error.Source,
+            error.Number,
+            error.Description,
+        ), zipcode)
+
     def look_for_error(self, response):
         """
         Look for city state lookup specific errors in response
@@ -51,37 +106,180 @@ class CityStateLookup(BaseAPI):
         super(CityStateLookup, self).look_for_error(response)
 
         # Look for address specific error
-        try:
-            error = response.ZipCode.Error
-        except AttributeError:
-            return None
-        else:
-            raise USPSInvalidZip5("%s-%s:%s" % (
-                error.Source,
-                error.Number,
-                error.Description,
-            ), response)
+        errors = []
+        zipcodes = list(response.iterchildren('ZipCode'))
+        for zipcode in zipcodes:
+            error = self.get_zipcode_error(zipcode)
+            if error is not None:
+                errors.append(error)
+        self.record_items('CityStateLookup', len(zipcodes), len(errors))
+        if errors:
+            raise errors[0]
 
-    def request(self, zipcode_type):
+    def send_zipcodes(self, zipcode_types):
         """
-        Calls up USPS and send the request. Get the returned response and
-            return an element built out of it.
+        Sends a request for the given ZipCode elements and returns the parsed
+        response. Only the errors of the whole request are looked for.
 
-        :param address_type: lxml element with data for the address request
-            type
+        :param zipcode_types: list of lxml elements with data for the zipcode
+            request type
+        """
+        return self.parse('CityStateLookup', self._objectify_response, (
+            self._send_zipcodes([
+                etree.tostring(zipcode_type) for zipcode_type in zipcode_types
+            ])
+        ))
+
+    def _send_zipcodes(self, zipcodes_xml, priority=INTERACTIVE):
+        """
+        Sends a request for the given serialized ZipCode elements and returns
+        the raw response.
         """
-        full_zipcode_type = E.CityStateLookupRequest(
-            zipcode_type, USERID=self.username
+        full_request = serialize_request(
+            'CityStateLookupRequest', self.username, zipcodes_xml
         )
-        full_request = etree.tostring(full_zipcode_type)
 
         # Send the request
-        result = self.send_request(
+        return self.send_request(
             self.urls['unsecure'],  # CityStateLookup API call is available on
                                     # unsecure protocol only.
             api_type='CityStateLookup',
-            data_xml=full_request
+            data_xml=full_request,
+            priority=priority
         )
-        response = objectify.fromstring(result)
+
+    def request(self, zipcode_type):
+        """
+        Calls up USPS and send the request. Get the returned response and
+            return an element built out of it.
+
+        :param address_type: lxml element with data for the address request
+            type
+        """
+        response = self.send_zipcodes([zipcode_type])
         self.look_for_error(response)
         return response
+
+    def request_async(self, zipcode_type):
+        """
+        Same as :meth:`request` but returns immediately a
+        :class:`concurrent.futures.Future` of the response.
+        """
+        return self.submit(self.request, zipcode_type)
+
+    def lookup_many(self, zips, priority=BULK):
+        """
+        Looks up the city and state of any number of ZIP5 codes, sending them
+        to USPS in batches of :attr:`max_batch_size` distinct codes. The
+        batches are sent concurrently, see :meth:`map`.
+
+        Returns a dictionary mapping each given ZIP5 to either the
+        :class:`CityStateResult` of the response or an
+        :exception:`USPSInvalidZip5` if USPS has no match for it. Errors of a
+        whole request are raised.
+
+        Results are read from and stored in :attr:`cache`. Its expired
+        results are used if USPS is not available.
+
+        :param zips: iterable of ZIP5 or ZIP+4 codes, normalized with
+            :func:`normalize_zip5`; codes with the same ZIP5 are looked up
+            once
+        :param priority: Priority of the requests for the rate limit, see
+            :meth:`send_request`
+        """
+        normalized = dict((zip5, normalize_zip5(zip5)) for zip5 in zips)
+        results = {}
+        unique_zips = []
+        for zip5 in set(normalized.itervalues()):
+            results[zip5] = None
+            if self.cache is not None:
+                results[zip5] = self.cache.get(self._cache_key(zip5))
+            if results[zip5] is None:
+                unique_zips.append(zip5)
+
+        results.update(self._fetch(unique_zips, priority))
+        return dict(
+            (zip5, results[key]) for zip5, key in normalized.iteritems()
+        )
+
+    def _fetch(self, zips, priority=BULK):
+        """
+        Looks up the ZIP5 codes in batches of :attr:`max_batch_size` codes.
+        If USPS is not available, the expired results of :attr:`cache` are
+        returned when all the codes have one.
+        """
+        chunks = [
+            zips[offset:offset + self.max_batch_size]
+            for offset in xrange(0, len(zips), self.max_batch_size)
+        ]
+        results = {}
+        try:
+            lookup_chunk = partial(self._lookup_chunk, priority=priority)
+            for chunk_results in self.map(lookup_chunk, chunks):
+                results.update(chunk_results)
+        except USPSServiceUnavailable:
+            if self.cache is None:
+                raise
+            for zip5 in zips:
+                results[zip5] = self.cache.get(
+                    self._cache_key(zip5), stale=True
+                )
+                if results[zip5] is None:
+                    raise
+        return results
+
+    def _lookup_chunk(self, chunk, priority=INTERACTIVE):
+        """
+        Looks up at most :attr:`max_batch_size` ZIP5 codes in one request and
+        maps each response ZipCode back to its ZIP5 by its ID.
+        """
+        items = self.parse('CityStateLookup', parse_city_state_response, (
+            self._send_zipcodes([
+                self.zipcode_request_xml(Zip5=zip5, id=str(index))
+                for index, zip5 in enumerate(chunk)
+            ], priority)
+        ))
+        by_id = dict((id, (result, error)) for id, result, error in items)
+        results = {}
+        for index, zip5 in enumerate(chunk):
+            result, error = by_id.get(str(index), (None, None))
+            if result is None and error is None:
+                results[zip5] = USPSInvalidZip5(
+                    "ZIP %s missing in the USPS response" % zip5, None
+                )
+                continue
+            results[zip5] = result or USPSInvalidZip5(error, None)
+            if self.cache is not None:
+                self.cache.set(self._cache_key(zip5), results[zip5])
+        self.record_items('CityStateLookup', len(results), len([
+            item for item in results.itervalues()
+            if isinstance(item, USPSInvalidZip5)
+        ]))
+        return results
+
+    def lookup(self, zip5):
+        """
+        Returns the :class:`CityStateResult` with the city and state of the
+        ZIP5, from :attr:`cache` if possible.
+
+        :param zip5: ZIP5 code to look up
+        :raises USPSInvalidZip5: if USPS has no match for the code
+        """
+        result = self.lookup_many([zip5], INTERACTIVE)[zip5]
+        if isinstance(result, USPSInvalidZip5):
+            raise result
+        return result
+
+    def lookup_async(self, zip5):
+        """
+        Same as :meth:`lookup` but returns immediately a
+        :class:`concurrent.futures.Future` of the result.
+        """
+        return self.submit(self.lookup, zip5)
+
+    def lookup_many_async(self, zips, priority=BULK):
+        """
+        Same as :meth:`lookup_many` but returns immediately a
+        :class:`concurrent.futures.Future` of the results.
+        """
+        return self.submit(self.lookup_many, list(zips), priority)
@@ -26,3 +26,17 @@ class USPSInvalidZip5(Exception):
     Invalid Zip5 for USPS
     """
     pass
+
+
+class USPSServiceUnavailable(USPSException):
+    """
+    USPS could not be reached or its circuit breaker is open
+    """
+    pass
+
+
+class USPSRateLimited(USPSServiceUnavailable):
+    """
+    The request would exceed the rate limit of the USPS account
+    """
+    pass
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+    instrumentation.py
+
+    Hooks called by the API on each USPS call, to record its timings, its
+    outcome and the size of its payloads.
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import bisect
+import threading
+from collections import defaultdict
+
+#: Upper bounds of the buckets of the timing histograms, in seconds
+TIMING_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30,
+)
+
+#: Upper bounds of the buckets of the size histograms, in bytes
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+
+class Instrumentation(object):
+    """
+    Instrumentation doing nothing, to be subclassed. The API calls:
+
+        * :meth:`record_timing` with the phases `connect` (until the
+          response headers are received), `transfer` (reading the response
+          body) and `parse`
+        * :meth:`record_outcome` with the outcomes `success`, `error` (error
+          of the whole request), `unavailable`, `rate_limited`, `retry` and
+          `coalesced` (sharing the response of an identical request) per
+          request, and `valid` and `invalid` per address or ZIP code
+        * :meth:`record_size` with the directions `request` and `response`
+
+    The API type is the `API` parameter of the call, `Verify` or
+    `CityStateLookup`.
+    """
+
+    def record_timing(self, api_type, phase, seconds):
+        pass
+
+    def record_outcome(self, api_type, outcome, count=1):
+        pass
+
+    def record_size(self, api_type, direction, size):
+        pass
+
+
+class Histogram(object):
+    """
+    Cumulative histogram of observations with fixed bucket bounds
+
+    :param buckets: sorted upper bounds of the buckets
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        Returns the list of tuples (upper bound, number of observations less
+        than or equal to it), ending with the '+Inf' bound.
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {
+            'buckets': self.cumulative_counts(),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class MemoryInstrumentation(Instrumentation):
+    """
+    Thread safe instrumentation keeping histograms and counters in memory,
+    for the lifetime of the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "Forgets all the recorded values"
+        with self._lock:
+            self._timings = {}
+            self._sizes = {}
+            self._outcomes = defaultdict(int)
+
+    def record_timing(self, api_type, phase, seconds):
+        with self._lock:
+            key = (api_type, phase)
+            if key not in self._timings:
+                self._timings[key] = Histogram(TIMING_BUCKETS)
+            self._timings[key].observe(seconds)
+
+    def record_outcome(self, api_type, outcome, count=1):
+        with self._lock:
+            self._outcomes[(api_type, outcome)] += count
+
+    def record_size(self, api_type, direction, size):
+        with self._lock:
+            key = (api_type, direction)
+            if key not in self._sizes:
+                self._sizes[key] = Histogram(SIZE_BUCKETS)
+            self._sizes[key].observe(size)
+
+    def snapshot(self):
+        """
+        Returns the recorded values as a dictionary by API type of
+        dictionaries with:
+
+            * timings: dictionary of the timing histograms by phase
+            * sizes: dictionary of the size histograms by direction
+            * outcomes: dictionary of the counts by outcome
+
+        The histograms are given as dictionaries with the cumulative
+        `buckets`, the `sum` and the `count` of the observations.
+        """
+        result = defaultdict(
+            lambda: {'timings': {}, 'sizes': {}, 'outcomes': {}}
+        )
+        with self._lock:
+            for (api_type, phase), histogram in self._timings.iteritems():
+                result[api_type]['timings'][phase] = histogram.to_dict()
+            for (api_type, direction), histogram in self._sizes.iteritems():
+                result[api_type]['sizes'][direction] = histogram.to_dict()
+            for (api_type, outcome), count in self._outcomes.iteritems():
+                result[api_type]['outcomes'][outcome] = count
+        return dict(result)
+
+    def to_prometheus(self):
+        """
+        Returns the recorded values in the Prometheus text exposition format
+        """
+        with self._lock:
+            lines = []
+            lines.extend(_format_histograms(
+                'usps_request_duration_seconds',
+                'Duration of the phases of the USPS calls.',
+                'phase', self._timings,
+            ))
+            lines.extend(_format_histograms(
+                'usps_payload_size_bytes',
+                'Size of the USPS requests and responses.',
+                'direction', self._sizes,
+            ))
+            lines.append(
+                '# HELP usps_outcomes_total Outcomes of the USPS calls.'
+            )
+            lines.append('# TYPE usps_outcomes_total counter')
+            for (api_type, outcome), count in sorted(
+                    self._outcomes.iteritems()):
+                lines.append('usps_outcomes_total{%s} %s' % (
+                    _format_labels(api=api_type, outcome=outcome), count
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(**labels):
+    return ','.join(
+        '%s="%s"' % (name, unicode(value).replace('\\', '\\\\').replace(
+            '"', '\\"'
+        ).replace('\n', '\\n'))
+        for name, value in sorted(labels.iteritems())
+    )
+
+
+def _format_histograms(name, help, label, histograms):
+    """
+    Returns the lines of the Prometheus histogram metric `name` for the
+    histograms by (API type, label value).
+    """
+    lines = [
+        '# HELP %s %s' % (name, help),
+        '# TYPE %s histogram' % name,
+    ]
+    for (api_type, value), histogram in sorted(histograms.iteritems()):
+        labels = {'api': api_type, label: value}
+        for bound, count in histogram.cumulative_counts():
+            lines.append('%s_bucket{%s} %s' % (
+                name, _format_labels(le=bound, **labels), count
+            ))
+        lines.append('%s_sum{%s} %s' % (
+            name, _format_labels(**labels), histogram.sum
+        ))
+        lines.append('%s_count{%s} %s' % (
+            name, _format_labels(**labels), histogram.count
+        ))
+    return lines
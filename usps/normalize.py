@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+    normalize.py
+
+    Normalizes addresses into canonical keys, so that the spellings of the
+    same address ("6406 Ivy Lane", " 6406 ivy  ln.") are validated and
+    cached once.
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import hashlib
+import json
+import re
+
+from serializer import ADDRESS_FIELDS
+
+#: Street suffixes and their USPS abbreviation (Publication 28, C1)
+STREET_SUFFIXES = {
+    'ALLEY': 'ALY', 'ANNEX': 'ANX', 'ARCADE': 'ARC', 'AVENUE': 'AVE',
+    'AV': 'AVE', 'AVEN': 'AVE', 'BAYOU': 'BYU', 'BEACH': 'BCH',
+    'BEND': 'BND', 'BLUFF': 'BLF', 'BOULEVARD': 'BLVD', 'BOUL': 'BLVD',
+    'BRANCH': 'BR', 'BRIDGE': 'BRG', 'BROOK': 'BRK', 'BYPASS': 'BYP',
+    'CAUSEWAY': 'CSWY', 'CENTER': 'CTR', 'CENTRE': 'CTR', 'CIRCLE': 'CIR',
+    'CIRC': 'CIR', 'CLIFF': 'CLF', 'CLUB': 'CLB', 'COMMON': 'CMN',
+    'CORNER': 'COR', 'COURSE': 'CRSE', 'COURT': 'CT', 'COVE': 'CV',
+    'CREEK': 'CRK', 'CRESCENT': 'CRES', 'CROSSING': 'XING', 'DALE': 'DL',
+    'DRIVE': 'DR', 'DRIV': 'DR', 'ESTATE': 'EST', 'ESTATES': 'ESTS',
+    'EXPRESSWAY': 'EXPY', 'EXTENSION': 'EXT', 'FALLS': 'FLS',
+    'FERRY': 'FRY', 'FIELD': 'FLD', 'FIELDS': 'FLDS', 'FOREST': 'FRST',
+    'FORK': 'FRK', 'FORT': 'FT', 'FREEWAY': 'FWY', 'GARDEN': 'GDN',
+    'GARDENS': 'GDNS', 'GATEWAY': 'GTWY', 'GLEN': 'GLN', 'GREEN': 'GRN',
+    'GROVE': 'GRV', 'HARBOR': 'HBR', 'HEIGHTS': 'HTS', 'HIGHWAY': 'HWY',
+    'HILL': 'HL', 'HILLS': 'HLS', 'HOLLOW': 'HOLW', 'ISLAND': 'IS',
+    'JUNCTION': 'JCT', 'KNOLL': 'KNL', 'LAKE': 'LK', 'LAKES': 'LKS',
+    'LANDING': 'LNDG', 'LANE': 'LN', 'LOOP': 'LOOP', 'MANOR': 'MNR',
+    'MEADOW': 'MDW', 'MEADOWS': 'MDWS', 'MILL': 'ML', 'MOUNT': 'MT',
+    'MOUNTAIN': 'MTN', 'ORCHARD': 'ORCH', 'PARKWAY': 'PKWY',
+    'PARKWY': 'PKWY', 'PASSAGE': 'PSGE', 'PIKE': 'PIKE', 'PINES': 'PNES',
+    'PLACE': 'PL', 'PLAIN': 'PLN', 'PLAINS': 'PLNS', 'PLAZA': 'PLZ',
+    'POINT': 'PT', 'PORT': 'PRT', 'PRAIRIE': 'PR', 'RANCH': 'RNCH',
+    'RIDGE': 'RDG', 'RIVER': 'RIV', 'ROAD': 'RD', 'ROUTE': 'RTE',
+    'SHORE': 'SHR', 'SHORES': 'SHRS', 'SPRING': 'SPG', 'SPRINGS': 'SPGS',
+    'SQUARE': 'SQ', 'STATION': 'STA', 'STREET': 'ST', 'STR': 'ST',
+    'SUMMIT': 'SMT', 'TERRACE': 'TER', 'TRACE': 'TRCE', 'TRAIL': 'TRL',
+    'TRAILS': 'TRL', 'TUNNEL': 'TUNL', 'TURNPIKE': 'TPKE', 'VALLEY': 'VLY',
+    'VIEW': 'VW', 'VILLAGE': 'VLG', 'VISTA': 'VIS', 'WALK': 'WALK',
+    'WAY': 'WAY', 'WELLS': 'WLS',
+}
+
+#: Directionals and their USPS abbreviation (Publication 28, B)
+DIRECTIONALS = {
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE',
+    'SOUTHWEST': 'SW',
+}
+
+#: Secondary unit designators and their USPS abbreviation (Publication 28,
+#: C2)
+SECONDARY_UNITS = {
+    'APARTMENT': 'APT', 'APT': 'APT', 'BASEMENT': 'BSMT', 'BSMT': 'BSMT',
+    'BUILDING': 'BLDG', 'BLDG': 'BLDG', 'DEPARTMENT': 'DEPT',
+    'DEPT': 'DEPT', 'FLOOR': 'FL', 'FL': 'FL', 'HANGAR': 'HNGR',
+    'HNGR': 'HNGR', 'LOT': 'LOT', 'OFFICE': 'OFC', 'OFC': 'OFC',
+    'PIER': 'PIER', 'ROOM': 'RM', 'RM': 'RM', 'SPACE': 'SPC',
+    'SPC': 'SPC', 'SUITE': 'STE', 'STE': 'STE', 'TRAILER': 'TRLR',
+    'TRLR': 'TRLR', 'UNIT': 'UNIT', '#': '#',
+}
+
+_PUNCTUATION = re.compile(r'[.,]')
+_UNIT_NUMBER_SIGN = re.compile(r'#(?=\S)')
+_ZIP = re.compile(r'^(\d{5})(?:[\s-]*(\d{4}))?$')
+
+
+def normalize_text(value):
+    """
+    Returns the value upper cased, without periods and commas and with its
+    whitespace collapsed.
+    """
+    if not value:
+        return u''
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return u' '.join(_PUNCTUATION.sub(u' ', value).upper().split())
+
+
+def _abbreviate_primary(words):
+    """
+    Abbreviates the directionals around the street name and the street
+    suffix of the words of a primary address ("6406 NORTH IVY LANE").
+    """
+    words = list(words)
+    # A directional may precede the street name, after the house number
+    start = 1 if len(words) > 2 and words[0][:1].isdigit() else 0
+    if len(words) - start > 2:
+        words[start] = DIRECTIONALS.get(words[start], words[start])
+    end = len(words) - 1
+    if end > start + 1 and words[end] in DIRECTIONALS:
+        words[end] = DIRECTIONALS[words[end]]
+        end -= 1
+    if end > start:
+        words[end] = STREET_SUFFIXES.get(words[end], words[end])
+    return words
+
+
+def normalize_street(value):
+    """
+    Returns the normalized street line: see :func:`normalize_text`, with
+    the street suffix, the directionals and the secondary unit designator
+    abbreviated as USPS does ("6406 North Ivy Lane Suite 4" gives
+    "6406 N IVY LN STE 4").
+    """
+    words = _UNIT_NUMBER_SIGN.sub(u'# ', normalize_text(value)).split()
+    for index, word in enumerate(words):
+        if word in SECONDARY_UNITS:
+            break
+    else:
+        index = len(words)
+    unit = words[index:]
+    if unit:
+        unit[0] = SECONDARY_UNITS[unit[0]]
+    return u' '.join(_abbreviate_primary(words[:index]) + unit)
+
+
+def split_zip(zip5, zip4=None):
+    """
+    Returns a tuple (ZIP5, ZIP4) of the given codes, splitting a ZIP+4
+    given as ZIP5 ("20770-1441" or "207701441").
+    """
+    zip5 = normalize_text(zip5)
+    zip4 = normalize_text(zip4)
+    match = _ZIP.match(zip5)
+    if match is not None and match.group(2):
+        zip5, zip4 = match.groups()
+    return zip5, zip4
+
+
+def normalize_zip5(value):
+    """
+    Returns the ZIP5 of a ZIP5 or ZIP+4 code, see :func:`split_zip`
+    """
+    return split_zip(value)[0]
+
+
+def is_zip5(value):
+    """
+    Returns True if the value is a normalized ZIP5 code, see
+    :func:`normalize_zip5`
+    """
+    return len(value) == 5 and value.isdigit()
+
+
+def normalize_address(values):
+    """
+    Returns a dictionary of the normalized values of an address, by field
+    of :data:`ADDRESS_FIELDS`. The missing fields are empty. Other fields
+    are normalized with :func:`normalize_text`.
+
+    :param values: dictionary of the keyword arguments of
+        :meth:`AddressValidation.address_request_type`
+    """
+    normalized = dict(
+        (field, normalize_text(value)) for field, value in values.iteritems()
+    )
+    for field in ('Address1', 'Address2'):
+        normalized[field] = normalize_street(values.get(field))
+    normalized['Zip5'], normalized['Zip4'] = split_zip(
+        values.get('Zip5'), values.get('Zip4')
+    )
+    for field in ADDRESS_FIELDS:
+        normalized.setdefault(field, u'')
+    return normalized
+
+
+def canonical_key(values):
+    """
+    Returns a hashable key identical for the equivalent spellings of an
+    address, see :func:`normalize_address`.
+    """
+    normalized = normalize_address(values)
+    return tuple(normalized.pop(field) for field in ADDRESS_FIELDS) + \
+        tuple(sorted(normalized.iteritems()))
+
+
+def canonical_hash(values):
+    """
+    Returns the hexadecimal SHA-1 digest of the :func:`canonical_key` of an
+    address, to store or index it.
+    """
+    return hashlib.sha1(json.dumps(canonical_key(values))).hexdigest()
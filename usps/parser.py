@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+    parser.py
+
+    Parses the USPS responses into result objects, without the overhead of
+    lxml.objectify and without keeping the parsed document alive.
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from lxml import etree
+
+from exceptions import USPSException
+from results import AddressResult, CityStateResult
+
+
+def format_error(error):
+    """
+    Returns the message of an Error element as "Source-Number:Description"
+    """
+    return u"%s-%s:%s" % (
+        error.findtext('Source'),
+        error.findtext('Number'),
+        error.findtext('Description'),
+    )
+
+
+def parse_response(xml, tag, result_class):
+    """
+    Parses a response and returns, for each of its `tag` children in
+    document order, a tuple (ID, result, error): either the result built
+    from the child or the error message of the child.
+
+    :raises USPSException: if the whole response is an error
+    """
+    root = etree.fromstring(xml)
+    if root.tag == 'Error':
+        raise USPSException(format_error(root), None)
+
+    fields = frozenset(result_class.fields)
+    items = []
+    for element in root.iterchildren(tag):
+        values = {}
+        error = None
+        for child in element:
+            if child.tag in fields:
+                values[child.tag] = child.text or u''
+            elif child.tag == 'Error':
+                error = format_error(child)
+        if error is None:
+            items.append((element.get('ID'), result_class(**values), None))
+        else:
+            items.append((element.get('ID'), None, error))
+    return items
+
+
+def parse_address_response(xml):
+    """
+    Returns the items of an AddressValidateResponse with
+    :class:`AddressResult` results, see :func:`parse_response`
+    """
+    return parse_response(xml, 'Address', AddressResult)
+
+
+def parse_city_state_response(xml):
+    """
+    Returns the items of a CityStateLookupResponse with
+    :class:`CityStateResult` results, see :func:`parse_response`
+    """
+    return parse_response(xml, 'ZipCode', CityStateResult)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+    ratelimit.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from exceptions import USPSRateLimited
+
+#: Priority of the requests a user is waiting for
+INTERACTIVE = 'interactive'
+
+#: Priority of the requests of background and batch jobs
+BULK = 'bulk'
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket letting through `rate` requests per second on
+    average and bursts of up to `burst` requests.
+
+    Interactive requests have priority: bulk requests wait while an
+    interactive request of the process waits, and they leave `reserve`
+    tokens in the bucket for the interactive requests of the other
+    processes.
+
+    With `path`, the bucket is stored in that file and shared by all the
+    processes using it, which are coordinated with `fcntl.flock`.
+
+    :param rate: Number of requests per second
+    :param burst: Capacity of the bucket, defaults to the rate and at least 1
+    :param path: Path of the file shared by the processes
+    :param reserve: Fraction of the capacity reserved to the interactive
+        requests
+    """
+
+    def __init__(self, rate, burst=None, path=None, reserve=0.2):
+        if path and fcntl is None:
+            raise ValueError("A shared rate limit file requires fcntl")
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate, 1))
+        self.reserve = min(reserve * self.burst, self.burst - 1)
+        self.path = path
+        self._tokens = self.burst
+        self._updated_at = time.time()
+        self._interactive_waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """
+        Takes a token from the bucket, waiting for it if needed.
+
+        :param priority: :data:`INTERACTIVE` or :data:`BULK`
+        :param timeout: Maximum number of seconds to wait, None to wait as
+            long as needed
+        :raises USPSRateLimited: if no token can be taken within the timeout
+        """
+        interactive = priority == INTERACTIVE
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._condition:
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                self._wait_for_token(interactive, deadline)
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                    self._condition.notify_all()
+
+    def _wait_for_token(self, interactive, deadline):
+        while True:
+            if interactive or not self._interactive_waiting:
+                wait = self._take(1 if interactive else 1 + self.reserve)
+            else:
+                wait = 1 / self.rate
+            if not wait:
+                return
+            if deadline is not None and time.time() + wait > deadline:
+                raise USPSRateLimited(
+                    "USPS rate limit of %g requests per second reached"
+                    % self.rate
+                )
+            self._condition.wait(wait)
+
+    def _take(self, needed):
+        """
+        Takes a token if the bucket holds at least `needed` tokens and
+        returns 0, otherwise returns the number of seconds to wait for them.
+        """
+        if self.path:
+            return self._take_shared(needed)
+        self._tokens, wait = self._refill(
+            self._tokens, self._updated_at, needed
+        )
+        self._updated_at = time.time()
+        return wait
+
+    def _refill(self, tokens, updated_at, needed):
+        """
+        Returns the tokens of the bucket once refilled and taken from, and
+        the number of seconds to wait.
+        """
+        elapsed = max(time.time() - updated_at, 0)
+        tokens = min(self.burst, tokens + elapsed * self.rate)
+        if tokens >= needed:
+            return tokens - 1, 0
+        return tokens, (needed - tokens) / self.rate
+
+    def _take_shared(self, needed):
+        """
+        Same as :meth:`_take` with the bucket stored in :attr:`path` as
+        "<tokens> <updated at>".
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                tokens, updated_at = map(float, os.read(fd, 64).split())
+            except ValueError:
+                # New or corrupted file
+                tokens, updated_at = self.burst, time.time()
+            tokens, wait = self._refill(tokens, updated_at, needed)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, '%r %r' % (tokens, time.time()))
+            return wait
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    results.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+
+
+class Result(object):
+    """
+    Base class of the immutable results returned by the API. The fields are
+    named after the tags of the USPS response and hold their text, or None
+    when the tag is missing. Results with the same values are equal and have
+    the same hash, so they can be deduplicated and used as cache values.
+    """
+    __slots__ = ()
+
+    #: Names of the fields of the result
+    fields = ()
+
+    def __init__(self, **values):
+        for name in self.fields:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "%s objects are immutable" % self.__class__.__name__
+        )
+
+    def __delattr__(self, name):
+        raise AttributeError(
+            "%s objects are immutable" % self.__class__.__name__
+        )
+
+    def values(self):
+        "Returns the tuple of the values of the fields"
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def __eq__(self, other):
+        return (
+            self.__class__ is other.__class__
+            and self.values() == other.values()
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, self.values()))
+
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, state):
+        for name, value in zip(self.fields, state):
+            object.__setattr__(self, name, value)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, ' '.join(
+            '%s=%r' % (name, getattr(self, name))
+            for name in self.fields if getattr(self, name) is not None
+        ))
+
+
+class AddressResult(Result):
+    "Address validated by USPS"
+    fields = (
+        'FirmName', 'Address1', 'Address2', 'City', 'State', 'Urbanization',
+        'Zip5', 'Zip4', 'DeliveryPoint', 'CarrierRoute', 'ReturnText',
+    )
+    __slots__ = fields
+
+
+class CityStateResult(Result):
+    "City and state of a ZIP5"
+    fields = ('Zip5', 'City', 'State')
+    __slots__ = fields
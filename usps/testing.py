@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+    testing.py
+
+    Local stand-in of the USPS Web Tools server, speaking the Verify and
+    CityStateLookup protocols, to test and benchmark the API without USPS.
+
+    Usage::
+
+        with FakeUSPSServer(latency=0.05) as server:
+            api = CityStateLookup('username', 'password')
+            api.urls = server.urls
+            api.lookup('20770')
+
+    Or from the command line: python -m usps.testing --port 8080
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import random
+import socket
+import sys
+import threading
+import time
+import urlparse
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from lxml import etree
+
+from normalize import normalize_street, normalize_text
+from serializer import escape_text
+
+#: ZIP5 codes known by default, with their city and state
+ZIPS = {
+    '04864': ('WARREN', 'ME'),
+    '06371': ('OLD LYME', 'CT'),
+    '20770': ('GREENBELT', 'MD'),
+    '33141': ('MIAMI BEACH', 'FL'),
+    '90210': ('BEVERLY HILLS', 'CA'),
+    '94301': ('PALO ALTO', 'CA'),
+}
+
+#: ZIP4 codes of the streets known by default, by ZIP5 and normalized
+#: street. The other streets get a ZIP4 derived from them.
+ZIP4S = {
+    ('20770', u'6406 IVY LN'): '1441',
+    ('94301', u'247 HIGH ST'): '1041',
+}
+
+ERROR_TEMPLATE = (
+    '<Error><Number>%s</Number><Source>%s</Source>'
+    '<Description>%s</Description></Error>'
+)
+
+INVALID_ZIP = ERROR_TEMPLATE % (
+    '-2147219399', 'WebtoolsAMS', 'Invalid Zip Code.'
+)
+
+ADDRESS_NOT_FOUND = ERROR_TEMPLATE % (
+    '-2147219401', 'clsAMS', 'Address Not Found.'
+)
+
+INJECTED_ERROR = ERROR_TEMPLATE % (
+    '80040B19', 'USPSCOM::DoAuth',
+    'Authorization failure. Injected by the fake server.'
+)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients give up on the slow responses, on timeout for example
+        if not issubclass(sys.exc_info()[0], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    "Answers the requests of the API with the FakeUSPSServer of the server"
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        status, body = self.server.fake.respond(self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeUSPSServer(object):
+    """
+    HTTP server answering the Verify and CityStateLookup requests from a
+    table of ZIP5 codes. Valid addresses are the ones with a street and a
+    known ZIP5; their street is normalized and given its ZIP4 from a table
+    of known streets or a ZIP4 derived from it.
+
+    :param host: Interface to listen on
+    :param port: Port to listen on, 0 for any free port
+    :param latency: Seconds to wait before answering
+    :param jitter: Maximum random seconds added to the latency
+    :param error_rate: Probability of answering with an Error document
+    :param server_error_rate: Probability of answering with an HTTP 503
+    :param zips: Dictionary of the (city, state) by known ZIP5, defaults to
+        :data:`ZIPS`
+    :param resolve_any: Make all the numeric ZIP5 codes known, the unknown
+        ones being in the city "ZIP <zip5>" of "ZZ"
+    :param zip4s: Dictionary of the ZIP4 by ZIP5 and normalized street,
+        defaults to :data:`ZIP4S`
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0,
+                 error_rate=0, server_error_rate=0, zips=None,
+                 resolve_any=False, zip4s=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.zips = ZIPS if zips is None else zips
+        self.resolve_any = resolve_any
+        self.zip4s = ZIP4S if zip4s is None else zip4s
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    @property
+    def urls(self):
+        "URLs to set on the API instances in place of `BaseAPI.urls`"
+        return {
+            'secure': self.url + '/ShippingAPI.dll',
+            'unsecure': self.url + '/ShippingAPITest.dll',
+        }
+
+    def start(self):
+        "Serves the requests in a background thread"
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def respond(self, path):
+        """
+        Returns a tuple (HTTP status, body) answering the request path
+        """
+        with self._lock:
+            self.requests += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if random.random() < self.server_error_rate:
+            return 503, 'Service Unavailable'
+        if random.random() < self.error_rate:
+            return 200, INJECTED_ERROR
+        return 200, self.answer(path)
+
+    def answer(self, path):
+        """
+        Returns the response document of the request path
+        """
+        query = urlparse.parse_qs(urlparse.urlparse(path).query)
+        try:
+            api_type, = query['API']
+            request = etree.fromstring(query['XML'][0])
+        except (KeyError, ValueError, etree.XMLSyntaxError):
+            return ERROR_TEMPLATE % (
+                '80040B19', 'USPSCOM::DoAuth', 'Invalid request.'
+            )
+        if api_type == 'Verify':
+            return self.verify(request)
+        elif api_type == 'CityStateLookup':
+            return self.city_state_lookup(request)
+        return ERROR_TEMPLATE % (
+            '80040B19', 'USPSCOM::DoAuth', 'API Authorization failure.'
+        )
+
+    def get_city_state(self, zip5):
+        """
+        Returns the tuple (city, state) of the ZIP5 or None if it is unknown
+        """
+        if zip5 in self.zips:
+            return self.zips[zip5]
+        if self.resolve_any and len(zip5) == 5 and zip5.isdigit():
+            return 'ZIP %s' % zip5, 'ZZ'
+        return None
+
+    def get_zip4(self, zip5, street):
+        """
+        Returns the ZIP4 of the normalized street of the ZIP5
+        """
+        zip4 = self.zip4s.get((zip5, street))
+        if zip4 is None:
+            # Stable for the street and never 0000, which is not assigned
+            zip4 = '%04d' % (1 + zlib.crc32(street.encode('utf-8')) % 9999)
+        return zip4
+
+    def verify(self, request):
+        """
+        Returns the AddressValidateResponse of the request. As USPS, the
+        street is read from Address1 when Address2 is empty.
+        """
+        items = []
+        for address in request.iterchildren('Address'):
+            street = normalize_street(address.findtext('Address2'))
+            secondary = normalize_street(address.findtext('Address1'))
+            if not street:
+                street, secondary = secondary, u''
+            zip5 = normalize_text(address.findtext('Zip5'))
+            city_state = self.get_city_state(zip5)
+            if not street or city_state is None:
+                items.append('<Address ID="%s">%s</Address>' % (
+                    address.get('ID'), ADDRESS_NOT_FOUND
+                ))
+                continue
+            items.append(
+                '<Address ID="%s">%s<Address2>%s</Address2><City>%s</City>'
+                '<State>%s</State><Zip5>%s</Zip5><Zip4>%s</Zip4>'
+                '</Address>' % (
+                    address.get('ID'),
+                    '<Address1>%s</Address1>' % escape_text(secondary)
+                    if secondary else '',
+                    escape_text(street),
+                    escape_text(city_state[0]), escape_text(city_state[1]),
+                    escape_text(zip5), self.get_zip4(zip5, street),
+                )
+            )
+        return '<AddressValidateResponse>%s</AddressValidateResponse>' % (
+            ''.join(items)
+        )
+
+    def city_state_lookup(self, request):
+        "Returns the CityStateLookupResponse of the request"
+        items = []
+        for zipcode in request.iterchildren('ZipCode'):
+            zip5 = normalize_text(zipcode.findtext('Zip5'))
+            city_state = self.get_city_state(zip5)
+            if city_state is None:
+                items.append('<ZipCode ID="%s">%s</ZipCode>' % (
+                    zipcode.get('ID'), INVALID_ZIP
+                ))
+                continue
+            items.append(
+                '<ZipCode ID="%s"><Zip5>%s</Zip5><City>%s</City>'
+                '<State>%s</State></ZipCode>' % (
+                    zipcode.get('ID'), escape_text(zip5),
+                    escape_text(city_state[0]), escape_text(city_state[1]),
+                )
+            )
+        return '<CityStateLookupResponse>%s</CityStateLookupResponse>' % (
+            ''.join(items)
+        )
+
+
+def main(argv=None):
+    """
+    Command line entry point running a fake USPS server
+    """
+    parser = argparse.ArgumentParser(description='Run a fake USPS server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--server-error-rate', type=float, default=0)
+    parser.add_argument('--resolve-any', action='store_true')
+    args = parser.parse_args(argv)
+
+    server = FakeUSPSServer(
+        args.host, args.port, args.latency, args.jitter, args.error_rate,
+        args.server_error_rate, resolve_any=args.resolve_any,
+    )
+    print 'Serving on %s' % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+    zip_dataset.py
+
+    Local ZIP5 to city/state dataset, used to answer city/state lookups
+    without calling USPS.
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+import argparse
+import csv
+import sqlite3
+import sys
+import threading
+import time
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def get_dataset(path):
+    """
+    Returns the :class:`ZipDataset` of the path, opening it only once per
+    process.
+    """
+    with _datasets_lock:
+        if path not in _datasets:
+            _datasets[path] = ZipDataset(path)
+        return _datasets[path]
+
+
+class ZipDataset(object):
+    """
+    ZIP5 to city/state mapping stored in an indexed SQLite file.
+
+    :param path: Path of the SQLite file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS zip_code ('
+                'zip5 TEXT PRIMARY KEY, city TEXT NOT NULL, '
+                'state TEXT NOT NULL)'
+            )
+            self._connection.commit()
+
+    def load(self, csv_file, zip_column='zip', city_column='city',
+             state_column='state'):
+        """
+        Replaces the content of the dataset with the rows of a CSV file and
+        returns the number of rows read. The file is streamed, so it is never
+        held in memory. When a ZIP5 is listed more than once, its first city
+        is kept.
+
+        :param csv_file: File object of a CSV file with a header row
+        :param zip_column: Header of the ZIP code column
+        :param city_column: Header of the city column
+        :param state_column: Header of the state code column
+        :raises ValueError: If a column is missing from the header, before
+                            the content of the dataset is replaced
+        """
+        reader = csv.reader(csv_file)
+        header = [column.strip().lower() for column in next(reader, [])]
+        columns = (zip_column, city_column, state_column)
+        missing = [
+            column for column in columns if column.lower() not in header
+        ]
+        if missing:
+            raise ValueError(
+                'Missing column(s) %s in the CSV header' % ', '.join(missing)
+            )
+        indexes = [header.index(column.lower()) for column in columns]
+        count = [0]
+
+        def rows():
+            for row in reader:
+                if not row:
+                    continue
+                count[0] += 1
+                zip_code, city, state = [row[index] for index in indexes]
+                yield (
+                    zip_code.strip()[:5].zfill(5),
+                    city.strip().upper().decode('utf-8'),
+                    state.strip().upper().decode('utf-8'),
+                )
+
+        with self._lock:
+            connection = self._connection
+            connection.execute('PRAGMA synchronous = OFF')
+            # Commits the whole load at once or rolls it back on error
+            with connection:
+                connection.execute('DELETE FROM zip_code')
+                connection.executemany(
+                    'INSERT OR IGNORE INTO zip_code (zip5, city, state) '
+                    'VALUES (?, ?, ?)', rows()
+                )
+            connection.execute('PRAGMA synchronous = FULL')
+        return count[0]
+
+    def lookup(self, zip5):
+        """
+        Returns a tuple (city, state) for the ZIP5 or None if it is not in
+        the dataset.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT city, state FROM zip_code WHERE zip5 = ?', (zip5,)
+            ).fetchone()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM zip_code'
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point loading a CSV file in a dataset
+    """
+    parser = argparse.ArgumentParser(
+        description='Load a ZIP/city/state CSV file in a USPS ZIP dataset.'
+    )
+    parser.add_argument('dataset', help='path of the SQLite dataset file')
+    parser.add_argument('csv', help='CSV file to load, - for stdin')
+    parser.add_argument('--zip-column', default='zip')
+    parser.add_argument('--city-column', default='city')
+    parser.add_argument('--state-column', default='state')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    csv_file = sys.stdin if args.csv == '-' else open(args.csv, 'rb')
+    try:
+        count = ZipDataset(args.dataset).load(
+            csv_file, args.zip_column, args.city_column, args.state_column
+        )
+    except ValueError, exc:
+        parser.error(unicode(exc))
+    finally:
+        if csv_file is not sys.stdin:
+            csv_file.close()
+    sys.stderr.write('Loaded %d rows in %.2fs\n' % (
+        count, time.time() - start
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+    zip_cache.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import datetime, timedelta
+
+from trytond.model import fields, ModelSQL, ModelView
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+from usps.exceptions import USPSInvalidZip5
+
+__all__ = ['USPSZipCache']
+
+
+class USPSZipCache(ModelSQL, ModelView):
+    """
+    City/State lookup results of USPS by ZIP5, shared by all the processes
+    """
+    __name__ = 'usps.zip.cache'
+    _rec_name = 'zip5'
+
+    zip5 = fields.Char('ZIP5', required=True, select=True, readonly=True)
+    city = fields.Char('City', readonly=True)
+    state = fields.Char('State', readonly=True)
+    subdivision = fields.Many2One(
+        'country.subdivision', 'Subdivision', readonly=True
+    )
+    error = fields.Char('Error', readonly=True)
+    fetched_at = fields.DateTime('Fetched At', required=True, readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(USPSZipCache, cls).__setup__()
+        cls._order.insert(0, ('zip5', 'ASC'))
+
+    @classmethod
+    def get_fresh(cls, zip5):
+        """
+        Returns the cached lookup of the ZIP5 or None if there is none or if
+        it is older than the validity set in the USPS configuration.
+        """
+        return cls.get_fresh_many([zip5]).get(zip5)
+
+    @classmethod
+    def get_fresh_many(cls, zips, stale=False, config=None):
+        """
+        Returns a dictionary of the fresh cached lookups by ZIP5 for the
+        given ZIP5 codes. See :meth:`get_fresh`.
+
+        :param stale: Return also the lookups older than the validity
+        :param config: Active record of the USPS configuration, read if not
+                       given
+        """
+        USPSConfiguration = Pool().get('usps.configuration')
+        cursor = Transaction().cursor
+
+        validity = (config or USPSConfiguration(1)).zip_cache_validity
+        zips = list(zips)
+        lookups = {}
+        for offset in xrange(0, len(zips), cursor.IN_MAX):
+            domain = [('zip5', 'in', zips[offset:offset + cursor.IN_MAX])]
+            if validity and not stale:
+                domain.append(
+                    ('fetched_at', '>=', datetime.now() - timedelta(validity))
+                )
+            # Oldest first, so that the latest lookup of a ZIP5 is kept
+            for record in cls.search(domain, order=[('fetched_at', 'ASC')]):
+                lookups[record.zip5] = record
+        return lookups
+
+    @classmethod
+    def store(cls, zip5, result):
+        """
+        Caches the result of a city/state lookup and returns the record.
+
+        :param zip5: The ZIP5 looked up
+        :param result: The ZipCode element returned by the lookup or the
+            :exception:`USPSInvalidZip5` raised by it
+        """
+        Subdivision = Pool().get('country.subdivision')
+
+        values = {
+            'fetched_at': datetime.now(),
+        }
+        if isinstance(result, USPSInvalidZip5):
+            values.update({
+                'city': None,
+                'state': None,
+                'subdivision': None,
+                'error': unicode(result[0]),
+            })
+        else:
+            values.update({
+                'city': unicode(result.City),
+                'state': unicode(result.State),
+                'subdivision': Subdivision.get_usps_subdivision(
+                    unicode(result.State)
+                ),
+                'error': None,
+            })
+
+        # Concurrent misses of several processes may still store the same
+        # ZIP5 twice, get_fresh uses the latest one.
+        records = cls.search([('zip5', '=', zip5)])
+        if records:
+            cls.write(records, values)
+            return records[0]
+        values['zip5'] = zip5
+        record, = cls.create([values])
+        return record